@@ -38,8 +38,10 @@ from webauthn2.util import context_from_environment
 
 from .exception import *
 
+from . import sanepg2, listener
 from .registry import get_registry
-from .catalog import get_catalog_factory
+from .catalog import get_catalog_factory, Catalog, SpareCatalogs
+from .model import SqlTemplateCache
 from .util import negotiated_content_type, urlquote, random_name
 
 __all__ = [
@@ -60,6 +62,18 @@ global_env = webauthn2.merge_config(
         }
     )
 
+# setup database connection pool sizing
+sanepg2.pools.configure(global_env.get('connection_pool', {}))
+sanepg2.set_io_backend(global_env.get('io_backend'))
+
+# setup model cache bounds
+Catalog.MODEL_CACHE.configure(global_env.get('model_cache', {}))
+Catalog.META_CACHE.configure(global_env.get('meta_cache', {}))
+SqlTemplateCache.configure(global_env.get('sql_template_cache', {}))
+
+# setup push-based validation of version lookups
+listener.versions.configure(global_env.get('version_listener', {}))
+
 # setup webauthn2 handler
 webauthn2_manager = webauthn2.Manager()
 
@@ -77,6 +91,12 @@ if catalog_factory_config:
 else:
     catalog_factory = None
 
+# setup pre-created spare catalogs, replenished once requests arrive
+if registry and catalog_factory:
+    spare_catalogs = SpareCatalogs(catalog_factory, registry, global_env.get('spare_catalogs', {}))
+else:
+    spare_catalogs = None
+
 # setup logger and web request log helpers
 logger = logging.getLogger('ermrest')
 sysloghandler = SysLogHandler(address='/dev/log', facility=SysLogHandler.LOG_LOCAL1)
@@ -133,8 +153,12 @@ def request_init():
     web.ctx.ermrest_request_trace = request_trace
     web.ctx.ermrest_registry = registry
     web.ctx.ermrest_catalog_factory = catalog_factory
+    web.ctx.ermrest_spare_catalogs = spare_catalogs
+    if spare_catalogs is not None:
+        spare_catalogs.start()
     web.ctx.ermrest_config = global_env
     web.ctx.ermrest_catalog_pc = None
+    web.ctx.ermrest_catalog_replica_pc = None
 
     try:
         # get client authentication context
@@ -174,7 +198,15 @@ def request_final():
             web.ctx.ermrest_request_trace(
                 'ERMrest DB conn LEAK averted in request_final()!?'
             )
+            web.ctx.ermrest_catalog_pc.used_pool.stats.count('leaks')
             web.ctx.ermrest_catalog_pc.final()
+    if web.ctx.ermrest_catalog_replica_pc is not None:
+        if web.ctx.ermrest_catalog_replica_pc.conn is not None:
+            web.ctx.ermrest_request_trace(
+                'ERMrest DB replica conn LEAK averted in request_final()!?'
+            )
+            web.ctx.ermrest_catalog_replica_pc.used_pool.stats.count('leaks')
+            web.ctx.ermrest_catalog_replica_pc.final()
     logger.info( (log_final_template % parts).encode('utf-8') )
 
 def web_method():
@@ -192,6 +224,7 @@ def web_method():
     def helper(original_method):
         def wrapper(*args):
             request_init()
+            result = None
             try:
                 try:
                     try:
@@ -228,6 +261,8 @@ def web_method():
                     raise rest.UnsupportedMediaType(e.message)
                 except psycopg2.pool.PoolError, e:
                     raise rest.ServiceUnavailable(e.message)
+                except psycopg2.extensions.QueryCanceledError, e:
+                    raise rest.ServiceUnavailable('Request exceeded its database time limit.')
                 except psycopg2.Error, e:
                     # TODO: simplify postgres error text?
                     raise rest.Conflict( str(e) )
@@ -236,6 +271,9 @@ def web_method():
                     web.debug('got exception "%s"' % str(ev), traceback.format_exception(et, ev, tb))
                     raise
             finally:
+                if hasattr(result, 'close'):
+                    # cancel database work if client abandoned response
+                    result.close()
                 request_final()
         return wrapper
     return helper
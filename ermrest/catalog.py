@@ -25,13 +25,409 @@ This module provides catalog management features including:
 
 import psycopg2
 import sanepg2
-
-from util import sql_identifier, sql_literal, schema_exists, table_exists, random_name
+import listener
+import sys
+import os
+import errno
+import time
+import threading
+import collections
+import hashlib
+import tempfile
+import cPickle
+import cStringIO
+import types
+import web
+
+from util import sql_identifier, sql_literal, schema_exists, table_exists, random_name, lock_field_upgrades
+from .exception import ConflictData
 from .model import introspect
-from .model.misc import annotatable_classes
+from .model.introspect import reintrospect
+from .model.misc import annotatable_classes, create_model_change_log
 
 __all__ = ['get_catalog_factory']
 
+def _approx_size(root):
+    """Estimate memory retained by object graph reachable from root, in bytes.
+
+       Counts each reachable container, instance, and instance dict
+       once.  Shared immutable atoms such as small ints are counted
+       too, so this is an overestimate suitable for accounting only.
+    """
+    seen = set()
+    stack = [root]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, type):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+    return total
+
+class ModelCache (object):
+    """Bounded LRU cache of introspected models.
+
+       Only the current model version of each catalog is kept, so
+       storing a newer version replaces the superseded model, which
+       remains available through latest() and pristine() until then
+       as a base for incremental refresh.  Least-recently-used catalogs are evicted
+       when there are more than max_entries models or their
+       approximate size exceeds max_bytes.
+
+       Request handlers may patch a cached model in place, so a
+       serialized copy taken before the model was handed out can
+       be stored with it as the pristine base for refresh.
+    """
+    def __init__(self, max_entries=64, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # map catalog key -> (version, model, approx_bytes, pristine)
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, config):
+        """Update bounds from config dictionary with max_entries and max_bytes keys."""
+        with self._lock:
+            self.max_entries = config.get('max_entries', self.max_entries)
+            self.max_bytes = config.get('max_bytes', self.max_bytes)
+            self._enforce_bounds()
+
+    def get(self, key, version):
+        """Return cached model of catalog key at version or None."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                if entry[0] == version:
+                    self._entries[key] = entry # now most-recently-used
+                    self.hits += 1
+                    return entry[1]
+                else:
+                    # keep other version until put() replaces it
+                    self._entries[key] = entry
+            self.misses += 1
+            return None
+
+    def latest(self, key):
+        """Return (version, model) cached for catalog key or (None, None)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, None
+            return entry[0], entry[1]
+
+    def pristine(self, key):
+        """Return (version, pristine) cached for catalog key or (None, None)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, None
+            return entry[0], entry[3]
+
+    def put(self, key, version, model, pristine=None):
+        """Cache model as current version for catalog key.
+
+           Optional pristine is the serialized model as introspected.
+        """
+        size = _approx_size(model) + (len(pristine) if pristine is not None else 0)
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None:
+                if old[0] > version:
+                    return
+                del self._entries[key]
+                self._bytes -= old[2]
+                self.evictions += 1
+            self._entries[key] = (version, model, size, pristine)
+            self._bytes += size
+            self._enforce_bounds()
+
+    def _enforce_bounds(self):
+        # caller must hold self._lock
+        while self._entries and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries)
+                or (self.max_bytes is not None and self._bytes > self.max_bytes and len(self._entries) > 1)
+        ):
+            key, entry = self._entries.popitem(last=False)
+            self._bytes -= entry[2]
+            self.evictions += 1
+
+    def stats(self):
+        """Return dictionary of cache statistics."""
+        with self._lock:
+            return dict(
+                entries=len(self._entries),
+                max_entries=self.max_entries,
+                approx_bytes=self._bytes,
+                max_bytes=self.max_bytes,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions
+            )
+
+class MetaCache (object):
+    """Bounded LRU cache of catalog metadata maps.
+
+       Each entry is stored with the catalog's meta version stamp, or
+       with stamp None to remember that a catalog has no stamp yet and
+       must not be cached.
+    """
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # map catalog key -> (stamp, meta)
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, config):
+        """Update bounds from config dictionary with max_entries key."""
+        with self._lock:
+            self.max_entries = config.get('max_entries', self.max_entries)
+            self._enforce_bounds()
+
+    def get(self, key):
+        """Return (stamp, meta) cached for catalog key or None."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry # now most-recently-used
+            return entry
+
+    def count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, key, stamp, meta):
+        """Cache meta map as of stamp for catalog key."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (stamp, meta)
+            self._enforce_bounds()
+
+    def invalidate(self, key):
+        """Forget catalog key."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _enforce_bounds(self):
+        # caller must hold self._lock
+        while self._entries and self.max_entries is not None and len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        """Return dictionary of cache statistics."""
+        with self._lock:
+            return dict(
+                entries=len(self._entries),
+                max_entries=self.max_entries,
+                hits=self.hits,
+                misses=self.misses
+            )
+
+_flat_kinds = dict() # type -> _flat_instance() result
+
+def _flat_instance(obj):
+    """Return True if obj is pickled as a separate item by _dump_flat()."""
+    cls = type(obj)
+    flat = _flat_kinds.get(cls)
+    if flat is None:
+        flat = hasattr(obj, '__dict__') \
+            and cls is not types.InstanceType \
+            and not isinstance(obj, (type, types.ClassType, types.ModuleType)) \
+            and cls.__reduce_ex__ is object.__reduce_ex__ \
+            and cls.__reduce__ is object.__reduce__ \
+            and not hasattr(obj, '__getnewargs__')
+        _flat_kinds[cls] = flat
+    return flat
+
+def _dump_flat(root, f):
+    """Pickle the object graph reachable from root to file f without deep recursion.
+
+       Pickling a model directly recurses along its foreign key
+       graph, which for large catalogs is far deeper than the
+       default recursion limit and thread stack allow.  Instead,
+       every plain instance is replaced by a persistent reference
+       and its own state is pickled as a separate item, so the
+       recursion depth is bounded by the nesting of containers
+       within any one object.  Load with _load_flat().
+    """
+    index = dict() # id(obj) -> item number
+    queue = []
+
+    def inst_persistent_id(obj):
+        if not _flat_instance(obj):
+            return None
+        i = index.get(id(obj))
+        if i is None:
+            i = len(queue)
+            index[id(obj)] = i
+            queue.append(obj)
+        return (i, type(obj))
+
+    pickler = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+    pickler.inst_persistent_id = inst_persistent_id
+    inline = not _flat_instance(root)
+    pickler.dump(inline)
+    if inline:
+        pickler.dump(root)
+    else:
+        inst_persistent_id(root)
+
+    i = 0
+    while i < len(queue):
+        obj = queue[i]
+        reduced = obj.__reduce_ex__(2)
+        listitems = reduced[3] if len(reduced) > 3 else None
+        dictitems = reduced[4] if len(reduced) > 4 else None
+        pickler.dump((
+            i,
+            type(obj),
+            reduced[2] if len(reduced) > 2 else None,
+            list(listitems) if listitems is not None else None,
+            list(dictitems) if dictitems is not None else None
+        ))
+        i += 1
+
+def _load_flat(f):
+    """Return a new object graph unpickled from file f written by _dump_flat()."""
+    objs = dict() # item number -> instance
+
+    def persistent_load(pid):
+        i, cls = pid
+        obj = objs.get(i)
+        if obj is None:
+            obj = cls.__new__(cls)
+            objs[i] = obj
+        return obj
+
+    unpickler = cPickle.Unpickler(f)
+    unpickler.persistent_load = persistent_load
+    inline = unpickler.load()
+    root = unpickler.load() if inline else None
+
+    states = []
+    while True:
+        try:
+            i, cls, state, listitems, dictitems = unpickler.load()
+        except EOFError:
+            break
+        obj = persistent_load((i, cls))
+        if listitems:
+            for v in listitems:
+                obj.append(v)
+        if dictitems:
+            for k, v in dictitems:
+                obj[k] = v
+        if state is not None:
+            states.append((obj, state))
+
+    # restore instance state once every instance has its contents
+    for obj, state in states:
+        if hasattr(obj, '__setstate__'):
+            obj.__setstate__(state)
+        else:
+            if isinstance(state, tuple):
+                state, slotstate = state
+                for k, v in (slotstate or {}).items():
+                    setattr(obj, k, v)
+            if state:
+                obj.__dict__.update(state)
+
+    return root if inline else objs[0]
+
+def _dumps_flat(model):
+    """Return model serialized by _dump_flat() as a string."""
+    buf = cStringIO.StringIO()
+    _dump_flat(model, buf)
+    return buf.getvalue()
+
+def _loads_flat(data):
+    """Return a new model from string data written by _dumps_flat()."""
+    return _load_flat(cStringIO.StringIO(data))
+
+class ModelSnapshots (object):
+    """Versioned on-disk model snapshots shared by sibling processes.
+
+       Each catalog has at most one current file named by a digest
+       of its cache key and its model version.  Files are written to
+       a temporary name and renamed into place, so readers only ever
+       see complete snapshots.  Files hold a model written by
+       _dump_flat().
+    """
+    # older snapshots held directly pickled models
+    _SUFFIX = '.flat'
+    _OLD_SUFFIXES = ('.pickle',)
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+
+    def _prefix(self, key):
+        return hashlib.sha1(key).hexdigest()
+
+    def _path(self, key, version):
+        return os.path.join(self.dirname, '%s-%d%s' % (self._prefix(key), version, self._SUFFIX))
+
+    def load(self, key, version):
+        """Return (model, data) snapshot of catalog key at version or None.
+
+           The data is the model serialized by _dumps_flat(), which
+           callers may keep as a pristine copy instead of dumping the
+           model again.
+        """
+        try:
+            f = open(self._path(key, version), 'rb')
+        except IOError, e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        with f:
+            data = f.read()
+        return _loads_flat(data), data
+
+    def save(self, key, version, model, data=None):
+        """Atomically store model as snapshot of catalog key at version.
+
+           Optional data is the model already serialized by _dumps_flat().
+        """
+        prefix = self._prefix(key)
+        path = self._path(key, version)
+        fd, tmpname = tempfile.mkstemp(prefix='.%s-' % prefix, dir=self.dirname)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if data is not None:
+                    f.write(data)
+                else:
+                    _dump_flat(model, f)
+            os.rename(tmpname, path)
+        except:
+            os.unlink(tmpname)
+            raise
+        # purge superseded versions; open readers keep their inode
+        for fname in os.listdir(self.dirname):
+            if not fname.startswith(prefix + '-'):
+                continue
+            try:
+                if fname.endswith(self._OLD_SUFFIXES) \
+                   or (fname.endswith(self._SUFFIX) and int(fname[len(prefix)+1:-len(self._SUFFIX)]) < version):
+                    os.unlink(os.path.join(self.dirname, fname))
+            except (ValueError, OSError):
+                pass
+
 _POSTGRES_FACTORY = "postgres"
 _SUPPORTED_FACTORY_TYPES = (_POSTGRES_FACTORY)
 
@@ -124,12 +520,88 @@ class CatalogFactory (object):
         finally:
             pc.final()
     
+    def clone(self, source, owner=None, attempts=5):
+        """Create a Catalog as a copy of the source Catalog.
+
+           This operation creates a database using the source catalog
+           database as its template, so the source must be on the same
+           host as the catalog factory.  The copy is granted to 'owner'
+           as by Catalog.set_owner() but it is not registered.
+
+           Postgres refuses to copy a database while other sessions
+           are connected to it, so this process's pool and version
+           listener for the source are closed and idle sessions of
+           other service processes are terminated, retrying up to
+           'attempts' times before raising ConflictData.  Those
+           processes notice the lost connections on their next pool
+           checkout and replace them, while their version listeners
+           wait retry_interval seconds before reconnecting.  Sessions
+           of other roles and sessions in a transaction are never
+           terminated.
+        """
+        dbname = random_name(prefix='_ermrest_')
+        srcname = source.descriptor[self._KEY_DBNAME]
+
+        def body(conn, ignored_cur):
+            cur = None
+            try:
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cur = conn.cursor()
+                for attempt in range(attempts):
+                    sanepg2.pools.discard(source.dsn)
+                    listener.versions.stop(source.dsn)
+                    cur.execute("""
+SELECT pg_terminate_backend(pid)
+FROM pg_stat_activity
+WHERE datname = %(dbname)s
+  AND pid <> pg_backend_pid()
+  AND usename = current_user
+  AND state = 'idle'
+;""" % dict(dbname=sql_literal(srcname)))
+                    try:
+                        cur.execute("CREATE DATABASE %s TEMPLATE %s" % (sql_identifier(dbname), sql_identifier(srcname)))
+                        return
+                    except psycopg2.Error, ev:
+                        if ev.pgcode != '55006':
+                            raise
+                    # object_in_use, e.g. a session opened meanwhile
+                    time.sleep(0.1 * 2 ** attempt)
+            except psycopg2.Error, ev:
+                msg = str(ev)
+                idx = msg.find("\n")  # DETAIL starts after the first line feed
+                if idx > -1:
+                    msg = msg[0:idx]
+                raise RuntimeError(msg)
+            finally:
+                if cur:
+                    cur.close()
+                # just in case caller didn't use sanepg2 which resets this already...
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ)
+            raise ConflictData('Source catalog database %s is in use.' % srcname)
+
+        def post_commit(ignored):
+            descriptor = dict(self._template)
+            descriptor[self._KEY_DBNAME] = dbname
+            return Catalog(self, descriptor)
+
+        pc = sanepg2.PooledConnection(self._dsn)
+        try:
+            catalog = pc.perform(body, post_commit).next()
+        finally:
+            pc.final()
+
+        # fix up ownership copied from the source
+        pc = sanepg2.PooledConnection(catalog.dsn)
+        try:
+            pc.perform(lambda conn, cur: catalog.set_owner(cur, owner)).next()
+        finally:
+            pc.final()
+        return catalog
+
     def _destroy_catalog(self, conn, ignored_cur, catalog):
         """Destroys a catalog.
         
-           Do not call this method directly.
-
-           NOTE: This code looks b0rken; notice reference to _dbc which is never defined
+           Do not call this method directly; use Catalog.destroy().
         """
         cur = None
         try:
@@ -164,8 +636,119 @@ WHERE datname = %(dbname)s
             if cur:
                 cur.close()
             # just in case caller didn't use sanepg2 which resets this already...
-            self._dbc.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ)
     
+
+class SpareCatalogs (object):
+    """Background replenisher of pre-created, unowned spare catalogs.
+
+       Spares are created by the catalog factory, initialized with
+       anonymous permissions, and listed in the registry without
+       being registered.  A create request claims one and only has
+       to set its owner and register it.  The registry serializes
+       replenishers of all service processes so the pool stays near
+       its configured size.
+    """
+
+    def __init__(self, factory, registry, config={}):
+        self.factory = factory
+        self.registry = registry
+        self.count = config.get('count', 0)
+        self.check_interval = config.get('check_interval', 60)
+        self.max_pending_seconds = config.get('max_pending_seconds', 3600)
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Start the replenisher thread if spares are configured and it is not running.
+
+           Cheap once started, so web service processes call this
+           from every request instead of at import time, which would
+           also run it in command-line tools importing the service.
+        """
+        if self.count > 0 and self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    thread = threading.Thread(target=self._run, name='ermrest-spare-catalogs')
+                    thread.daemon = True
+                    thread.start()
+                    self._thread = thread
+
+    def wake(self):
+        """Ask the replenisher to check the pool now."""
+        self._wakeup.set()
+
+    def claim(self, owner):
+        """Return a claimed spare Catalog now owned by owner, or None."""
+        if self.count <= 0:
+            return None
+        descriptor = self.registry.claim_spare()
+        if descriptor is None:
+            self.wake()
+            return None
+        catalog = Catalog(self.factory, descriptor)
+        try:
+            pc = sanepg2.PooledConnection(catalog.dsn)
+            try:
+                pc.perform(lambda conn, cur: catalog.set_owner(cur, owner)).next()
+            finally:
+                pc.final()
+        except psycopg2.Error, e:
+            # the spare is unusable and no longer in the pool
+            web.debug('ERMrest discarding spare catalog', descriptor, e)
+            self._discard(catalog)
+            catalog = None
+        self.wake()
+        return catalog
+
+    def _discard(self, catalog):
+        """Drop an unlisted spare catalog database, logging any failure."""
+        try:
+            catalog.destroy()
+        except Exception, e:
+            web.debug('ERMrest cannot drop spare catalog', catalog.descriptor, e)
+
+    def _run(self):
+        while True:
+            try:
+                self.replenish()
+            except Exception, e:
+                web.debug('ERMrest spare catalog replenisher error', e)
+            self._wakeup.wait(self.check_interval)
+            self._wakeup.clear()
+
+    def replenish(self):
+        """Create spares until the registry pool is full."""
+        while True:
+            reservation = self.registry.reserve_spare(self.count, self.max_pending_seconds)
+            if reservation is None:
+                return
+            try:
+                catalog = self.factory.create()
+            except:
+                self.registry.release_spare(reservation)
+                raise
+            try:
+                pc = sanepg2.PooledConnection(catalog.dsn)
+                try:
+                    pc.perform(lambda conn, cur: catalog.init_meta(conn, cur)).next()
+                finally:
+                    pc.final()
+            except:
+                et, ev, tb = sys.exc_info()
+                self.registry.release_spare(reservation)
+                self._discard(catalog)
+                raise et, ev, tb
+            try:
+                filled = self.registry.fill_spare(reservation, catalog.descriptor)
+            except:
+                et, ev, tb = sys.exc_info()
+                self._discard(catalog)
+                raise et, ev, tb
+            if not filled:
+                web.debug('ERMrest spare catalog reservation expired', catalog.descriptor)
+                self._discard(catalog)
     
 class Catalog (object):
     """Provides basic catalog management.
@@ -176,6 +759,7 @@ class Catalog (object):
     _SCHEMA_NAME = '_ermrest'
     _TABLE_NAME = 'meta'
     _MODEL_VERSION_TABLE_NAME = 'model_version'
+    _META_VERSION_TABLE_NAME = 'meta_version'
     _DATA_VERSION_TABLE_NAME = 'data_version'
     META_OWNER = 'owner'
     META_READ_USER = 'read_user'
@@ -185,8 +769,24 @@ class Catalog (object):
     META_CONTENT_WRITE_USER = 'content_write_user'
     ANONYMOUS = '*'
 
-    # key cache by (str(descriptor), version)
-    MODEL_CACHE = dict()
+    # bits of get_rights() result
+    RIGHT_OWNER = 1
+    RIGHT_READ = 2
+    RIGHT_WRITE = 4
+    RIGHT_SCHEMA_WRITE = 8
+    RIGHT_CONTENT_READ = 16
+    RIGHT_CONTENT_WRITE = 32
+    RIGHTS_ALL = 63
+    _KEY_REPLICAS = 'replicas'
+
+    # current model per str(descriptor)
+    MODEL_CACHE = ModelCache()
+
+    # ModelSnapshots store per configured model_snapshot_dir
+    MODEL_SNAPSHOTS = dict()
+
+    # meta maps per str(descriptor)
+    META_CACHE = MetaCache()
 
     def __init__(self, factory, descriptor, config=None):
         """Initializes the catalog.
@@ -206,8 +806,14 @@ class Catalog (object):
         assert descriptor is not None
         self.descriptor = descriptor
         self.dsn = self._serialize_descriptor(descriptor)
+        # each replica entry overrides connection params of the primary
+        self.replica_dsns = [
+            self._serialize_descriptor(dict(descriptor.items() + replica.items()))
+            for replica in descriptor.get(self._KEY_REPLICAS, [])
+        ]
         self._factory = factory
         self._model = None
+        self._meta_written = False # meta changed in request's transaction
         self._config = config  # Not sure we need to tuck away the config
 
     def _serialize_descriptor(self, descriptor):
@@ -217,17 +823,69 @@ class Catalog (object):
            form follows the libpq format.
         """
         if 'type' not in descriptor or descriptor['type'] == self._POSTGRES_REGISTRY:
-            return " ".join([ "%s=%s" % (key, descriptor[key]) for key in descriptor if key != 'type' ])
+            return " ".join([
+                "%s=%s" % (key, descriptor[key])
+                for key in descriptor
+                if key not in ('type', self._KEY_REPLICAS)
+            ])
         else:
             raise KeyError("Catalog descriptor type not supported: %(type)s" % descriptor)
 
+    @staticmethod
+    def replica_is_fresh(primary, replica, max_lag=0):
+        """Return True if replica versions are usable in place of primary versions.
+
+           Both are tuples whose first element is the model version,
+           which must match exactly, and whose remaining elements are
+           data versions, which may lag those of the primary by at
+           most max_lag.
+        """
+        if replica[0] != primary[0]:
+            return False
+        for r, p in zip(replica[1:], primary[1:]):
+            if p is not None and (r is None or r < p - max_lag):
+                return False
+        return True
+
     def get_model_version(self, cur):
-        cur.execute("""
-SELECT max(snap_txid) AS txid FROM %(schema)s.%(table)s WHERE snap_txid < txid_snapshot_xmin(txid_current_snapshot()) ;
-""" % dict(schema=self._SCHEMA_NAME, table=self._MODEL_VERSION_TABLE_NAME))
-        self._model_version = cur.next()[0]  # TODO: do we need self._model_version to be an instance var?
+        self._model_version = self.cached_version(
+            listener.MODEL,
+            [listener.MODEL],
+            lambda: self.query_model_version(cur)
+        )  # TODO: do we need self._model_version to be an instance var?
         return self._model_version
 
+    def cached_version(self, qkey, deps, query):
+        """Return txid from query() or an equivalent one remembered in process.
+
+           Only valid for queries on the primary catalog database
+           within the current web request's transaction.  Remembered
+           results are kept while the version listener is enabled and
+           sees no notifications for the deps keys that invalidate them.
+           Requests which may write always run query(), so they see
+           the version their own transaction will build upon.
+        """
+        if not web.ctx.get('ermrest_start_time') or web.ctx.get('method') not in ('GET', 'HEAD'):
+            return query()
+        cache = listener.versions.cache(self.dsn)
+        if cache is None:
+            return query()
+        return cache.version(qkey, deps, web.ctx.ermrest_start_time, query)
+
+    def note_write(self):
+        """Distrust versions remembered before a write this process just committed."""
+        cache = listener.versions.cache(self.dsn)
+        if cache is not None:
+            cache.note_write()
+
+    def query_model_version(self, cur):
+        """Return model version visible to cur without remembering it."""
+        cur.connection.execute_prepared(
+            cur, 'ermrest_model_version', [], """
+SELECT max(snap_txid) AS txid FROM %(schema)s.%(table)s WHERE snap_txid < txid_snapshot_xmin(txid_current_snapshot())
+""" % dict(schema=self._SCHEMA_NAME, table=self._MODEL_VERSION_TABLE_NAME))
+        return cur.next()[0]
+
     def get_model_update_version(self, cur):
         cur.execute("""
 SELECT txid_current(); 
@@ -239,28 +897,199 @@ SELECT txid_current();
         if config is None:
             config = self._config
         if not self._model:
-            cache_key = (str(self.descriptor), self.get_model_version(cur))
-            self._model = self.MODEL_CACHE.get(cache_key)
+            cache_key = str(self.descriptor)
+            version = self.get_model_version(cur)
+            self._model = self.MODEL_CACHE.get(cache_key, version)
             if self._model is None:
-                try:
-                    self._model = introspect(cur, config)
-                except ValueError, te:
-                    raise ValueError('Introspection on existing catalog failed (likely a policy mismatch): %s' % str(te))
-                self.MODEL_CACHE[cache_key] = self._model
+                snapshots = self._model_snapshots(config) if version is not None else None
+                data = None
+                if snapshots is not None:
+                    try:
+                        self._model, data = snapshots.load(cache_key, version) or (None, None)
+                    except Exception, e:
+                        web.debug('ignoring unreadable model snapshot', e)
+                incremental = (config or {}).get('incremental_model_refresh', True)
+                built = self._model is None
+                if built:
+                    if incremental:
+                        self._model = self._refresh_model(cur, config, cache_key, version)
+                    if self._model is None:
+                        try:
+                            self._model = introspect(cur, config)
+                        except ValueError, te:
+                            raise ValueError('Introspection on existing catalog failed (likely a policy mismatch): %s' % str(te))
+                        # upgrade catalogs in the field to notify version listeners
+                        self.create_change_notify(cur)
+                        # ... and to stamp meta changes for META_CACHE
+                        if not table_exists(cur, self._SCHEMA_NAME, self._META_VERSION_TABLE_NAME):
+                            self.create_meta_version(cur)
+                            self.META_CACHE.invalidate(cache_key)
+                # serialize before any request handler can patch the model
+                if built and (incremental or snapshots is not None):
+                    try:
+                        data = _dumps_flat(self._model)
+                    except Exception, e:
+                        web.debug('cannot serialize model for refresh or snapshot', e)
+                if built and snapshots is not None and data is not None:
+                    try:
+                        snapshots.save(cache_key, version, self._model, data)
+                    except Exception, e:
+                        web.debug('skipping model snapshot', e)
+                self.MODEL_CACHE.put(cache_key, version, self._model, data if incremental else None)
         return self._model
     
+    def create_change_notify(self, cur):
+        """Create triggers notifying version listeners of new model and data versions, if missing."""
+        cur.execute("""
+SELECT count(*) FROM pg_catalog.pg_trigger t
+JOIN pg_catalog.pg_class c ON (t.tgrelid = c.oid)
+JOIN pg_catalog.pg_namespace n ON (c.relnamespace = n.oid)
+WHERE n.nspname = %(schema)s AND t.tgname IN ('model_version_notify', 'data_version_notify')
+""" % dict(schema=sql_literal(self._SCHEMA_NAME)))
+        if cur.fetchone()[0] == 2:
+            return
+        # concurrent first requests would fail replacing the same triggers
+        lock_field_upgrades(cur)
+        cur.execute("""
+CREATE OR REPLACE FUNCTION %(schema)s.model_version_notify() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify(%(channel)s, json_build_array(NEW.snap_txid)::text);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION %(schema)s.data_version_notify() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify(%(channel)s, json_build_array(NEW.snap_txid, NEW."schema", NEW."table")::text);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS model_version_notify ON %(schema)s.%(model_table)s;
+CREATE TRIGGER model_version_notify AFTER INSERT ON %(schema)s.%(model_table)s
+  FOR EACH ROW EXECUTE PROCEDURE %(schema)s.model_version_notify();
+
+DROP TRIGGER IF EXISTS data_version_notify ON %(schema)s.%(data_table)s;
+CREATE TRIGGER data_version_notify AFTER INSERT ON %(schema)s.%(data_table)s
+  FOR EACH ROW EXECUTE PROCEDURE %(schema)s.data_version_notify();
+""" % dict(schema=self._SCHEMA_NAME,
+           model_table=self._MODEL_VERSION_TABLE_NAME,
+           data_table=self._DATA_VERSION_TABLE_NAME,
+           channel=sql_literal(listener.CHANNEL))
+        )
+
+    def create_meta_version(self, cur):
+        """Create the meta version stamp bumped by every change to the meta table."""
+        lock_field_upgrades(cur)
+        # to_regclass() sees tables created by transactions we waited for
+        cur.execute("""
+DO $$
+BEGIN
+  IF to_regclass('%(schema)s.%(version_table)s') IS NULL THEN
+    CREATE TABLE %(schema)s.%(version_table)s (
+        version bigint NOT NULL
+    );
+    INSERT INTO %(schema)s.%(version_table)s (version) VALUES (0);
+  END IF;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION %(schema)s.meta_change_trigger() RETURNS trigger AS $$
+BEGIN
+  UPDATE %(schema)s.%(version_table)s SET version = version + 1;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS meta_change ON %(schema)s.%(table)s;
+CREATE TRIGGER meta_change
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %(schema)s.%(table)s
+  FOR EACH STATEMENT EXECUTE PROCEDURE %(schema)s.meta_change_trigger();
+
+GRANT SELECT ON %(schema)s.%(version_table)s TO ermrest;
+""" % dict(schema=self._SCHEMA_NAME,
+           table=self._TABLE_NAME,
+           version_table=self._META_VERSION_TABLE_NAME)
+        )
+
+    def _refresh_model(self, cur, config, cache_key, version):
+        """Return model at version patched from an older cached model, or None.
+
+           Only possible when every model change since the cached
+           version logged the tables it affected.
+        """
+        base_version, base = self.MODEL_CACHE.pristine(cache_key)
+        if base is None or version is None or base_version >= version:
+            return None
+        scope = self.get_model_changes(cur, base_version, version)
+        if scope is None:
+            return None
+        model = _loads_flat(base)
+        try:
+            return reintrospect(cur, model, scope, config)
+        except ValueError, te:
+            raise ValueError('Introspection on existing catalog failed (likely a policy mismatch): %s' % str(te))
+
+    def get_model_changes(self, cur, from_version, to_version):
+        """Return set of (schema_name, table_name) pairs changed after from_version up to to_version.
+
+           A table_name of None stands for the schema itself.  Returns
+           None when some change was not logged with its scope.
+        """
+        if not table_exists(cur, self._SCHEMA_NAME, 'model_modified'):
+            return None
+        cur.execute("""
+SELECT v.snap_txid, m.snap_txid IS NOT NULL, m.schema_name, m.table_name
+FROM %(schema)s.%(table)s v
+LEFT OUTER JOIN %(schema)s.model_modified m ON (v.snap_txid = m.snap_txid)
+WHERE v.snap_txid > %(from_version)s AND v.snap_txid <= %(to_version)s
+""" % dict(schema=self._SCHEMA_NAME,
+           table=self._MODEL_VERSION_TABLE_NAME,
+           from_version=sql_literal(from_version),
+           to_version=sql_literal(to_version))
+        )
+        scope = set()
+        for txid, logged, sname, tname in cur:
+            if not logged or sname is None or sname == self._SCHEMA_NAME:
+                return None
+            for name in (sname, tname or ''):
+                try:
+                    # names are compared as raw strings with introspected ones
+                    name.decode('ascii')
+                except UnicodeError:
+                    return None
+                if '%' in name:
+                    return None
+            scope.add((sname, tname))
+        return scope
+
+    def _model_snapshots(self, config):
+        """Return ModelSnapshots store if configured and usable, else None."""
+        dirname = config.get('model_snapshot_dir') if config else None
+        if not dirname:
+            return None
+        if dirname not in self.MODEL_SNAPSHOTS:
+            try:
+                os.makedirs(dirname, 0700)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    web.debug('model snapshots disabled', e)
+                    return None
+            self.MODEL_SNAPSHOTS[dirname] = ModelSnapshots(dirname)
+        return self.MODEL_SNAPSHOTS[dirname]
+
     def destroy(self):
         """Destroys the catalog (i.e., drops the database).
         
-           This operation will fail if there are any other open connections to
-           the database.
+           This process's pooled connections to the database are
+           closed and other sessions are terminated first, but the
+           drop still fails if a client reconnects meanwhile.
            
            Important: THIS OPERATION IS PERMANENT... unless you have backups ;)
-
-           NOTE: This code is clearly b0rken
         """
-        # the database connection must be closed
-        sanepg2.pools[self._dbname].closeall() # TODO: this should reference the pool key not dbname
+        # the database connections must be closed
+        sanepg2.pools.discard(self.dsn)
+        listener.versions.stop(self.dsn)
             
         # drop db cannot be called by a connection to the db, so the factory
         # must do it
@@ -269,7 +1098,11 @@ SELECT txid_current();
         #       dirty imperfect workaround we retry 3 times here
         for i in range(3):
             try:
-                self._factory._destroy_catalog(self)
+                pc = sanepg2.PooledConnection(self._factory._dsn)
+                try:
+                    pc.perform(lambda conn, cur: self._factory._destroy_catalog(conn, cur, self)).next()
+                finally:
+                    pc.final()
                 return
             except RuntimeError, ev:
                 msg = str(ev)
@@ -463,6 +1296,11 @@ $$ LANGUAGE plpgsql;
            table=self._DATA_VERSION_TABLE_NAME)
                         )
 
+        create_model_change_log(cur)
+        self.create_change_notify(cur)
+        if not table_exists(cur, self._SCHEMA_NAME, self._META_VERSION_TABLE_NAME):
+            self.create_meta_version(cur)
+
         cur.execute("""
 GRANT SELECT -- INSERT, UPDATE, DELETE
   ON _ermrest.meta, _ermrest.model_pseudo_key, _ermrest.model_pseudo_keyref
@@ -474,13 +1312,26 @@ GRANT ALL ON ALL SEQUENCES IN SCHEMA _ermrest TO ermrest;
 """)
             
         ## initial meta values
+        self.set_owner(cur, owner)
+
+    def set_owner(self, cur, owner=None):
+        """Resets the catalog permissions to grant everything to 'owner'.
+
+           When 'owner' is None, it grants everything to the anonymous
+           ('*') role, including the ownership.
+        """
+        if type(owner) is dict:
+            owner = owner['id']
         owner = owner if owner else self.ANONYMOUS
-        self.add_meta(cur, self.META_OWNER, owner)
-        self.add_meta(cur, self.META_WRITE_USER, owner)
-        self.add_meta(cur, self.META_READ_USER, owner)
-        self.add_meta(cur, self.META_SCHEMA_WRITE_USER, owner)
-        self.add_meta(cur, self.META_CONTENT_READ_USER, owner)
-        self.add_meta(cur, self.META_CONTENT_WRITE_USER, owner)
+        for key in [
+                self.META_OWNER,
+                self.META_WRITE_USER,
+                self.META_READ_USER,
+                self.META_SCHEMA_WRITE_USER,
+                self.META_CONTENT_READ_USER,
+                self.META_CONTENT_WRITE_USER
+        ]:
+            self.set_meta(cur, key, owner)
         
     
     # TODO: change API to pass conn/cur through for request handler hot-path
@@ -488,29 +1339,83 @@ GRANT ALL ON ALL SEQUENCES IN SCHEMA _ermrest TO ermrest;
         """Gets metadata fields, optionally filtered by attribute key or by 
            key and value pair, to test existence of specific pair.
         """
+        name = 'ermrest_get_meta'
+        argtypes = []
+        args = []
         where = ''
         if key is not None:
-            where = "WHERE key = %s" % sql_literal(key)
+            name += '_key'
+            argtypes.append('text')
+            args.append(key)
+            where = "WHERE key = $1"
             if value is not None:
                 if hasattr(value, '__iter__'):
-                    where += " AND value = ANY (ARRAY[%s]::text[])" % (
-                        ','.join([sql_literal(v) for v in value]))
+                    name += '_values'
+                    argtypes.append('text[]')
+                    args.append(list(value))
+                    where += " AND value = ANY ($2)"
                 else:
-                    where += " AND value = %s" % sql_literal(value)
+                    name += '_value'
+                    argtypes.append('text')
+                    args.append(value)
+                    where += " AND value = $2"
 
-        cur.execute("""
+        cur.connection.execute_prepared(
+            cur, name, argtypes, """
 SELECT * FROM %(schema)s.%(table)s
 %(where)s
-;""" % dict(schema=self._SCHEMA_NAME,
-            table=self._TABLE_NAME,
-            where=where) 
-                    )
+""" % dict(schema=self._SCHEMA_NAME,
+           table=self._TABLE_NAME,
+           where=where),
+            args
+        )
         for k, v in cur:
             yield dict(k=k, v=v)
     
+    def get_meta_map(self, cur):
+        """Gets all metadata as a dictionary mapping key to set of values.
+
+           Results are cached in process memory and revalidated on
+           each call against the version stamp which a trigger bumps
+           for every change to the meta table.  Catalogs without the
+           stamp, and transactions which changed the metadata
+           themselves, bypass the cache.
+        """
+        cache_key = str(self.descriptor)
+        cached = None if self._meta_written else self.META_CACHE.get(cache_key)
+        if cached is None and not self._meta_written \
+           and not table_exists(cur, self._SCHEMA_NAME, self._META_VERSION_TABLE_NAME):
+            # remember that the catalog awaits its field upgrade in get_model()
+            cached = (None, None)
+            self.META_CACHE.put(cache_key, None, None)
+
+        stamp = None
+        if not self._meta_written and (cached is None or cached[0] is not None):
+            cur.connection.execute_prepared(
+                cur, 'ermrest_meta_version', [], """
+SELECT version FROM %(schema)s.%(table)s
+""" % dict(schema=self._SCHEMA_NAME, table=self._META_VERSION_TABLE_NAME))
+            stamp = cur.fetchone()[0]
+            if cached is not None and cached[0] == stamp:
+                self.META_CACHE.count(True)
+                return cached[1]
+
+        self.META_CACHE.count(False)
+        meta = dict()
+        for row in self.get_meta(cur):
+            meta.setdefault(row['k'], set()).add(row['v'])
+        if stamp is not None:
+            self.META_CACHE.put(cache_key, stamp, meta)
+        return meta
+
+    def _invalidate_meta(self):
+        # our stamp bump is uncommitted, so never cache what we read next
+        self._meta_written = True
+
     def add_meta(self, cur, key, value):
         """Adds a metadata (key, value) pair.
         """
+        self._invalidate_meta()
         cur.execute("""
 INSERT INTO %(schema)s.%(table)s
   (key, value)
@@ -527,6 +1432,7 @@ VALUES
     def set_meta(self, cur, key, value):
         """Sets a metadata (key, value) pair.
         """
+        self._invalidate_meta()
         cur.execute("""
 DELETE FROM %(schema)s.%(table)s
 WHERE key=%(key)s
@@ -547,6 +1453,7 @@ VALUES
         """Removes a metadata (key, value) pair or all pairs that match on the
            key alone.
         """
+        self._invalidate_meta()
         where = "WHERE key = %s" % sql_literal(key)
         if value:
             where += " AND value = %s" % sql_literal(value)
@@ -561,42 +1468,64 @@ DELETE FROM %(schema)s.%(table)s
            ) 
                     )
     
-    def _test_perm(self, cur, perm, roles):
-        """Tests whether the user roles have a permission.
+    def _test_perm(self, meta, perm, roles):
+        """Tests whether the user roles have a permission in meta map.
         """
         if not (type(roles) is set or type(roles) is list):
             roles = [roles]
         roles = set([ r['id'] if type(r) is dict else r for r in roles ])
-        return len(list(self.get_meta(cur, perm, roles.union(self.ANONYMOUS)))) > 0
+        roles.add(self.ANONYMOUS)
+        return len(meta.get(perm, set()) & roles) > 0
+
+    def get_rights(self, cur, roles):
+        """Returns bitmask of all catalog rights held by the user roles.
+
+           Ownership implies every right.  Costs at most one
+           round-trip to revalidate the cached metadata.
+        """
+        meta = self.get_meta_map(cur)
+        if self._test_perm(meta, self.META_OWNER, roles):
+            return self.RIGHTS_ALL
+        rights = 0
+        for right, perm in [
+                (self.RIGHT_READ, self.META_READ_USER),
+                (self.RIGHT_WRITE, self.META_WRITE_USER),
+                (self.RIGHT_SCHEMA_WRITE, self.META_SCHEMA_WRITE_USER),
+                (self.RIGHT_CONTENT_READ, self.META_CONTENT_READ_USER),
+                (self.RIGHT_CONTENT_WRITE, self.META_CONTENT_WRITE_USER)
+        ]:
+            if self._test_perm(meta, perm, roles):
+                rights |= right
+        return rights
                                   
     def has_read(self, cur, roles):
         """Tests whether the user roles have read permission.
         """
-        return self.is_owner(cur, roles) or self._test_perm(cur, self.META_READ_USER, roles)
+        return (self.get_rights(cur, roles) & self.RIGHT_READ) != 0
     
     def has_write(self, cur, roles):
         """Tests whether the user roles have write permission.
         """
-        return self.is_owner(cur, roles) or self._test_perm(cur, self.META_WRITE_USER, roles)
+        return (self.get_rights(cur, roles) & self.RIGHT_WRITE) != 0
     
     def has_schema_write(self, cur, roles):
         """Tests whether the user roles have schema write permission.
         """
-        return self.is_owner(cur, roles) or self._test_perm(cur, self.META_SCHEMA_WRITE_USER, roles)
+        return (self.get_rights(cur, roles) & self.RIGHT_SCHEMA_WRITE) != 0
                                   
     def has_content_read(self, cur, roles):
         """Tests whether the user roles have content read permission.
         """
-        return self.is_owner(cur, roles) or self._test_perm(cur, self.META_CONTENT_READ_USER, roles)
+        return (self.get_rights(cur, roles) & self.RIGHT_CONTENT_READ) != 0
     
     def has_content_write(self, cur, roles):
         """Tests whether the user roles have content write permission.
         """
-        return self.is_owner(cur, roles) or self._test_perm(cur, self.META_CONTENT_WRITE_USER, roles)
+        return (self.get_rights(cur, roles) & self.RIGHT_CONTENT_WRITE) != 0
     
     def is_owner(self, cur, roles):
         """Tests whether the user role is owner.
         """
-        return self._test_perm(cur, self.META_OWNER, roles)
+        return (self.get_rights(cur, roles) & self.RIGHT_OWNER) != 0
 
 
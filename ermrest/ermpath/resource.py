@@ -29,6 +29,7 @@ import json
 from psycopg2._json import JSON_OID, JSONB_OID
 
 from ..exception import *
+from .. import sanepg2, listener
 from ..util import sql_identifier, sql_literal, random_name
 from ..model import Type
 
@@ -89,8 +90,14 @@ def notify_data_change(cur, table):
 
     expand_table(table)
 
-    for table in tables:
-        cur.execute('SELECT _ermrest.data_change_event(%s, %s)' % (sql_literal(table.schema.name), sql_literal(table.name)))
+    tables = list(tables)
+    cur.connection.execute_prepared(
+        cur, 'ermrest_data_change_event', ['text[]', 'text[]'], """
+SELECT _ermrest.data_change_event(s.sname, s.tname)
+FROM unnest($1, $2) AS s(sname, tname)
+""",
+        [ [ table.schema.name for table in tables ], [ table.name for table in tables ] ]
+    )
 
 def page_filter_sql(keynames, descendings, types, boundary, is_before):
     """Return SQL WHERE clause to filter by page boundary.
@@ -183,6 +190,121 @@ def sort_components(sortvec, is_before):
     else:
         return (sortvec, norm_parts, None)
         
+# delimits slot numbers in SQL text, which can never contain NUL itself
+_SLOT_MARK = '\x00'
+
+class _NoShape (Exception):
+    """Raised for paths which sql_get_cached() cannot normalize."""
+    pass
+
+class _SqlSlot (object):
+    """Stand-in for a literal value while compiling an SqlTemplate.
+
+       Renders a numbered slot in place of the SQL literal, recording
+       which value and type the slot stands for.
+    """
+    def __init__(self, value, index, slots):
+        self.value = value
+        self.index = index
+        self.slots = slots
+
+    def is_null(self):
+        return self.value.is_null()
+
+    def sql_literal(self, etype):
+        self.slots.append((self.index, etype))
+        return '%s%d%s' % (_SLOT_MARK, len(self.slots) - 1, _SLOT_MARK)
+
+class SqlTemplate (object):
+    """SQL text compiled for one path shape with slots for literal values."""
+
+    def __init__(self, chunks, slots):
+        self.chunks = chunks
+        self.slots = slots
+
+    @staticmethod
+    def compile(sql, slots):
+        """Return SqlTemplate for sql rendered with _SqlSlot slots, or None.
+
+           None means the slots did not survive SQL generation intact,
+           so the SQL cannot be reused.
+        """
+        parts = sql.split(_SLOT_MARK)
+        order = parts[1::2]
+        # slots are numbered in rendering order, which need not be text
+        # order, and rendered SQL fragments may be embedded repeatedly
+        if len(parts) % 2 != 1 \
+           or set(order) != set([ str(i) for i in range(len(slots)) ]):
+            return None
+        return SqlTemplate(parts[0::2], [ slots[int(i)] for i in order ])
+
+    def bind(self, values):
+        """Return SQL text with literals of values filled into slots."""
+        sql = [ self.chunks[0] ]
+        for (index, etype), chunk in zip(self.slots, self.chunks[1:]):
+            sql.append(values[index].sql_literal(etype))
+            sql.append(chunk)
+        return ''.join(sql)
+
+def _get_literal(location):
+    container, key = location
+    if isinstance(container, list):
+        return container[key]
+    return getattr(container, key)
+
+def _set_literal(location, value):
+    container, key = location
+    if isinstance(container, list):
+        container[key] = value
+    else:
+        setattr(container, key, value)
+
+def _column_shape(col):
+    return (type(col), col.name)
+
+def _filter_shape(filt, literals):
+    """Return shape of filt, appending locations of its literal values to literals."""
+    if hasattr(filt, 'pred'):
+        # path filter element
+        return (type(filt), _filter_shape(filt.pred, literals))
+    elif isinstance(filt, list):
+        # conjunction or disjunction
+        return (type(filt),) + tuple([ _filter_shape(f, literals) for f in filt ])
+    elif hasattr(filt, 'predicate'):
+        # negation
+        return (type(filt), _filter_shape(filt.predicate, literals))
+    elif hasattr(filt, 'left_col') and hasattr(filt, 'right_expr'):
+        expr = filt.right_expr
+        if expr is not None:
+            if len(getattr(expr, 'nameparts', [None])) != 1:
+                # sql_get() raises for qualified names as values
+                raise _NoShape()
+            literals.append((filt, 'right_expr'))
+        return (type(filt), _column_shape(filt.left_col), filt.left_elem.pos, type(expr))
+    raise _NoShape()
+
+def _attributes_shape(epath, attributes):
+    return tuple([
+        (type(attribute), attribute.alias, getattr(attribute, 'aggfunc', None), _column_shape(col), None if base == epath else base)
+        for attribute, col, base in attributes
+    ])
+
+def _sort_shape(path, literals):
+    """Return shape of sort and paging of path, appending locations of page key values to literals."""
+    if path.sort is None:
+        sort = None
+    else:
+        sort = tuple([ (key.keyname, key.descending) for key in path.sort ])
+    pages = []
+    for page in [ path.after, path.before ]:
+        if page is None:
+            pages.append(None)
+        else:
+            # page_filter_sql() generates different SQL for NULL keys
+            pages.append(tuple([ v.is_null() for v in page ]))
+            literals.extend([ (page, i) for i in range(len(page)) ])
+    return (sort,) + tuple(pages)
+
 class EntityElem (object):
     """Wrapper for instance of entity table in path.
 
@@ -470,7 +592,8 @@ class EntityElem (object):
                               % ', '.join([ '"%s"' % cn for cn in inputcol_names ]))
 
             try:
-                cur.copy_expert(
+                sanepg2.copy_expert(
+                    cur,
                 """
 COPY %s (%s) 
 FROM STDIN WITH (
@@ -511,7 +634,7 @@ FROM (
 
         elif in_content_type == 'application/x-json-stream':
             try:
-                cur.copy_expert( "COPY %s (j) FROM STDIN" % sql_identifier(input_json_table), input_data )
+                sanepg2.copy_expert( cur, "COPY %s (j) FROM STDIN" % sql_identifier(input_json_table), input_data )
                 cur.execute(
                 """
 INSERT INTO %(input_table)s (%(cols)s)
@@ -717,6 +840,56 @@ class AnyPath (object):
         """
         raise NotImplementedError('sql_get on abstract class ermpath.AnyPath')
 
+    def sql_shape(self, literals):
+        """Return hashable shape of this path for sql_get(), appending literal value locations to literals.
+
+           The shape normalizes the tables, links, predicates,
+           projection, sort, and paging that determine the SQL text,
+           leaving out literal values.  Each location is a (container,
+           key) pair holding one literal value in this path.
+        """
+        raise _NoShape()
+
+    def sql_get_cached(self, row_content_type='application/json', limit=None):
+        """Return the same SQL as sql_get() using a template cached for the path shape.
+
+           Templates are cached with the model, i.e. per model version,
+           and only the literal values of the path are rendered for
+           each request.  Paths without a shape use sql_get() directly.
+        """
+        model = getattr(self, '_model', None) or self.epath._model
+        cache = model.sql_templates
+        if not cache.enabled:
+            return self.sql_get(row_content_type=row_content_type, limit=limit)
+
+        literals = []
+        try:
+            key = (type(self), row_content_type, limit, self.sql_shape(literals))
+        except _NoShape:
+            return self.sql_get(row_content_type=row_content_type, limit=limit)
+        values = [ _get_literal(location) for location in literals ]
+
+        generation = cache.generation
+        template = cache.get(key)
+        if template is None:
+            slots = []
+            for i in range(len(literals)):
+                _set_literal(literals[i], _SqlSlot(values[i], i, slots))
+            try:
+                sql = self.sql_get(row_content_type=row_content_type, limit=limit)
+            except Exception:
+                # let sql_get() raise its own errors with real values in place
+                sql = None
+            finally:
+                for i in range(len(literals)):
+                    _set_literal(literals[i], values[i])
+            template = sql is not None and SqlTemplate.compile(sql, slots)
+            if not template:
+                return self.sql_get(row_content_type=row_content_type, limit=limit)
+            cache.put(key, template, generation)
+
+        return template.bind(values)
+
     def _sql_get_agg_attributes(self, allow_extra=True):
         """Process attribute lists for aggregation APIs.
         """
@@ -785,7 +958,7 @@ class AnyPath (object):
         """
         # TODO: refactor this common code between 
 
-        sql = self.sql_get(row_content_type=content_type, limit=limit)
+        sql = self.sql_get_cached(row_content_type=content_type, limit=limit)
 
         #web.debug(sql)
 
@@ -800,7 +973,7 @@ class AnyPath (object):
             else:
                 raise NotImplementedError('content_type %s with output_file.write()' % content_type)
 
-            cur.copy_expert(sql, output_file)
+            sanepg2.copy_expert(cur, sql, output_file)
 
         else:
             # generate rows to caller
@@ -876,27 +1049,37 @@ class EntityPath (AnyPath):
         """Change path entity context to existing context referenced by alias."""
         self._context_index = self.aliases[alias]
 
-    def get_data_version(self, cur):
-        """Get data version txid considering all tables in entity path."""
-        preds = [
-            elem.table.kind == 'r'
-            and
-            '("schema" = %s AND "table" = %s)' % (
-                sql_literal(elem.table.schema.name), 
-                sql_literal(elem.table.name)
-                )
-            or
-            'True'
-            for elem in self._path
-            ]
-        cur.execute("""
+    def get_data_version(self, cur, cached_version=None):
+        """Get data version txid considering all tables in entity path.
+
+           The optional cached_version(qkey, deps, query) function
+           may answer from memory instead of running query(), see
+           Catalog.cached_version().
+        """
+        tables = [ elem.table for elem in self._path if elem.table.kind == 'r' ]
+        # non-table elements (e.g. views) depend on any data version
+        anytable = len(tables) < len(self._path)
+
+        def query():
+            cur.connection.execute_prepared(
+                cur, 'ermrest_data_version', ['text[]', 'text[]', 'boolean'], """
 SELECT COALESCE(max(snap_txid), 0) AS snap_txid 
 FROM _ermrest.data_version
-WHERE %(pred)s
-""" % dict(pred=' OR '.join(preds))
-                    )
-        version = next(cur)
-        return version
+WHERE $3 OR ("schema", "table") IN (SELECT * FROM unnest($1, $2))
+""",
+                [ [ t.schema.name for t in tables ], [ t.name for t in tables ], anytable ]
+            )
+            return next(cur)[0]
+
+        if cached_version is None:
+            return (query(),)
+
+        if anytable:
+            deps = [ listener.ANY_TABLE ]
+        else:
+            deps = [ listener.table_key(t.schema.name, t.name) for t in tables ]
+        deps.sort()
+        return (cached_version(('data',) + tuple(deps), deps, query),)
 
     def add_filter(self, filt):
         """Add a filter condition to the current path.
@@ -964,6 +1147,22 @@ WHERE %(pred)s
             self.aliases[ralias] = rpos
 
 
+    def sql_shape(self, literals):
+        elems = tuple([
+            (
+                elem.table,
+                elem.alias,
+                elem.pos,
+                elem.context_pos,
+                elem.keyref,
+                elem.refop,
+                elem.keyref_alias,
+                tuple([ _filter_shape(f, literals) for f in elem.filters ])
+            )
+            for elem in self._path
+        ])
+        return (elems, self._context_index) + _sort_shape(self, literals)
+
     def sql_get(self, selects=None, distinct_on=True, row_content_type='application/json', limit=None):
         """Generate SQL query to get the entities described by this epath.
 
@@ -1171,6 +1370,12 @@ class AttributePath (AnyPath):
         self.after = after
         self.before = before
             
+    def sql_shape(self, literals):
+        return (
+            self.epath.sql_shape(literals),
+            _attributes_shape(self.epath, self.attributes)
+        ) + _sort_shape(self, literals)
+
     def sql_get(self, split_sort=False, distinct_on=True, row_content_type='application/json', limit=None):
         """Generate SQL query to get the resources described by this apath.
 
@@ -1360,6 +1565,13 @@ class AttributeGroupPath (AnyPath):
         self.after = after
         self.before = before
             
+    def sql_shape(self, literals):
+        return (
+            self.epath.sql_shape(literals),
+            _attributes_shape(self.epath, self.groupkeys),
+            _attributes_shape(self.epath, self.attributes)
+        ) + _sort_shape(self, literals)
+
     def sql_get(self, row_content_type='application/json', limit=None):
         """Generate SQL query to get the resources described by this apath.
 
@@ -1560,6 +1772,12 @@ class AggregatePath (AnyPath):
         # to honour generic API.  actually gated on self.add_sort() above so no need to test again
         pass
         
+    def sql_shape(self, literals):
+        return (
+            self.epath.sql_shape(literals),
+            _attributes_shape(self.epath, self.attributes)
+        )
+
     def sql_get(self, row_content_type='application/json', limit=None):
         """Generate SQL query to get the resources described by this apath.
 
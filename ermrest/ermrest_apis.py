@@ -70,13 +70,16 @@ import psycopg2
 import webauthn2
 
 from .apicore import global_env, webauthn2_manager, web_method, registry, catalog_factory
-from .url import url_parse_func, ast
+from .url import url_parse_func, url_parse_cache, ast
 from .exception import *
 
 from .registry import get_registry
 from .catalog import get_catalog_factory
 from .util import negotiated_content_type, urlquote
 
+# bound the per-process cache of parsed request URLs
+url_parse_cache.configure(global_env.get('url_parse_cache', {}))
+
 # expose webauthn REST APIs
 webauthn2_handler_factory = webauthn2.RestHandlerFactory(manager=webauthn2_manager)
 UserSession = webauthn2_handler_factory.UserSession
@@ -124,6 +127,7 @@ class Dispatcher (object):
     @web_method()
     def METHOD(self, methodname):
         ast = None
+        result = None
         try:
             uri, ast = self.prepareDispatch()
 
@@ -139,6 +143,9 @@ class Dispatcher (object):
             else:
                 yield result
         finally:
+            if hasattr(result, 'close'):
+                # abort any database work deferred in an abandoned iterator
+                result.close()
             if ast is not None:
                 ast.final()
             elif web.ctx.ermrest_catalog_pc is not None:
@@ -185,6 +192,10 @@ def web_urls():
 
         # the catalog factory
         '/catalog/?', ast.Catalogs,
+
+        # service administration
+        '/service/connection_pools/?', ast.ConnectionPools,
+        '/service/model_cache/?', ast.ModelCache,
         
         # core parser-based REST dispatcher
         '(?s).*', Dispatcher
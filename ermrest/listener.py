@@ -0,0 +1,333 @@
+# 
+# Copyright 2013-2016 University of Southern California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Push-based validation of catalog version lookups.
+
+Catalog databases NOTIFY on the ermrest_changes channel whenever a row
+is added to _ermrest.model_version or _ermrest.data_version.  A
+listener thread in each web service process LISTENs to every catalog
+database the process has recently used, so that repeated model and
+data version lookups can be answered from memory.
+
+A remembered version stays valid only while:
+
+   1. the listener connection has been up since it was queried;
+   2. no notification newer than it has arrived for the model or for
+      any table it depends on;
+   3. it was queried before the current request began, so it cannot
+      reflect changes newer than the request's own snapshot;
+   4. it was queried by a request which began after the last write
+      committed by this process to the catalog, since notifications
+      of our own writes may still be in flight.
+
+Otherwise callers query the database as usual, which is also how the
+service behaves whenever a listener connection is down or the
+catalog cannot be listened to within the connection budget.
+
+"""
+
+import psycopg2
+import psycopg2.pool
+import web
+import threading
+import datetime
+import pytz
+import json
+import os
+import time
+
+import sanepg2
+
+CHANNEL = 'ermrest_changes'
+
+# notification keys for model changes and changes to any table
+MODEL = 'model'
+ANY_TABLE = '*'
+
+def _utf8(s):
+    if type(s) is unicode:
+        return s.encode('utf8')
+    return s
+
+def table_key(sname, tname):
+    """Return notification key for data changes to table sname:tname."""
+    return (_utf8(sname), _utf8(tname))
+
+def _now():
+    return datetime.datetime.now(pytz.timezone('UTC'))
+
+class VersionCache (object):
+    """Remembered version lookups of one catalog database."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connected = False
+        self.generation = 0
+        self.last_used = time.time()
+        # notification key -> max txid notified during this generation
+        self.notified = dict()
+        # lookup key -> (txid, deps, generation, stored_at, since)
+        self.entries = dict()
+        # completion time of the last write committed by this process
+        self.written_at = None
+        self.hits = 0
+        self.misses = 0
+
+    def set_connected(self, connected):
+        """Record listener connection state, starting a new generation."""
+        with self._lock:
+            self.connected = connected
+            self.generation += 1
+            self.notified.clear()
+            self.entries.clear()
+
+    def notify(self, txid, key):
+        """Record notification of txid changing the resource key."""
+        with self._lock:
+            if txid > self.notified.get(key, -1):
+                self.notified[key] = txid
+
+    def note_write(self):
+        """Record that this process just committed a write to the catalog.
+
+           Remembered versions looked up by requests which began
+           before now are no longer trusted.
+        """
+        with self._lock:
+            self.written_at = _now()
+
+    def version(self, qkey, deps, since, query):
+        """Return txid from query() or an equivalent remembered result.
+
+           qkey: hashable key for the lookup performed by query()
+           deps: notification keys whose changes the result reflects
+           since: start time of the current request
+           query: function returning a txid number or None
+        """
+        with self._lock:
+            self.last_used = time.time()
+            entry = self.entries.get(qkey)
+            if entry is not None and self.connected:
+                txid, edeps, generation, stored_at, esince = entry
+                if generation == self.generation \
+                   and stored_at <= since \
+                   and (self.written_at is None or esince >= self.written_at) \
+                   and max([ self.notified.get(k, -1) for k in edeps ]) <= (txid if txid is not None else -1):
+                    self.hits += 1
+                    return txid
+            self.misses += 1
+            generation = self.generation if self.connected else None
+
+        txid = query()
+
+        if generation is not None:
+            stored_at = _now()
+            with self._lock:
+                if generation == self.generation:
+                    self.entries[qkey] = (txid, list(deps), generation, stored_at, since)
+        return txid
+
+class VersionListener (object):
+    """Background LISTEN on catalog databases feeding VersionCache instances.
+
+       Each listening connection takes a free slot of the
+       sanepg2.pools connection budget, never evicting idle pooled
+       connections for it, and at most max_catalogs catalogs are
+       listened to at once.  A catalog whose connection was dropped
+       or could not be opened is retried no sooner than
+       retry_interval seconds later.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.retry_interval = 5.0
+        self.max_idle_seconds = 900
+        self.max_catalogs = 32
+        self._lock = threading.Lock()
+        # map dsn -> VersionCache
+        self.caches = dict()
+        # map dsn -> (listening connection, cache), only touched by listener thread
+        self._conns = dict()
+        # map dsn -> time its connection was last dropped or refused
+        self._dropped = dict()
+        self._thread = None
+        self._wakeup = None
+
+    def configure(self, config):
+        """Update settings from config dictionary."""
+        self.enabled = config.get('enabled', self.enabled)
+        self.retry_interval = config.get('retry_interval', self.retry_interval)
+        self.max_idle_seconds = config.get('max_idle_seconds', self.max_idle_seconds)
+        self.max_catalogs = config.get('max_catalogs', self.max_catalogs)
+
+    def cache(self, dsn):
+        """Return VersionCache for catalog dsn or None if disabled or full."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            cache = self.caches.get(dsn)
+            if cache is None:
+                if len(self.caches) >= self.max_catalogs:
+                    return None
+                cache = VersionCache()
+                self.caches[dsn] = cache
+                self._start()
+                os.write(self._wakeup[1], 'x')
+            return cache
+
+    def stop(self, dsn):
+        """Stop listening to catalog dsn for at least retry_interval seconds.
+
+           Its VersionCache is forgotten at once, and the listening
+           connection, if any, is closed by the listener thread.
+           Requests query versions as usual until a later one brings
+           the catalog back after the backoff.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._dropped[dsn] = time.time()
+            cache = self.caches.pop(dsn, None)
+            if cache is not None:
+                cache.set_connected(False)
+                os.write(self._wakeup[1], 'x')
+
+    def _start(self):
+        # caller must hold self._lock
+        if self._thread is None:
+            self._wakeup = os.pipe()
+            self._thread = threading.Thread(target=self._run, name='ermrest-version-listener')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self._cycle()
+            except Exception, e:
+                web.debug('ERMrest version listener error', e)
+                time.sleep(self.retry_interval)
+
+    def _cycle(self):
+        now = time.time()
+        with self._lock:
+            caches = dict(self.caches)
+            for dsn, dropped in self._dropped.items():
+                if now - dropped >= self.retry_interval:
+                    del self._dropped[dsn]
+            backoff = set(self._dropped)
+
+        for dsn, (conn, cache) in self._conns.items():
+            if caches.get(dsn) is not cache:
+                # stopped since it connected
+                self._disconnect(dsn, cache)
+
+        for dsn, cache in caches.items():
+            if now - cache.last_used > self.max_idle_seconds:
+                with self._lock:
+                    if self.caches.get(dsn) is cache:
+                        del self.caches[dsn]
+                self._disconnect(dsn, cache)
+            elif dsn not in self._conns and dsn not in backoff:
+                self._connect(dsn, cache)
+
+        conns = dict([ (conn.fileno(), dsn) for dsn, (conn, cache) in self._conns.items() ])
+        for fd in self._wait(conns.keys() + [self._wakeup[0]]):
+            if fd == self._wakeup[0]:
+                os.read(fd, 4096)
+                continue
+            dsn = conns[fd]
+            conn, cache = self._conns[dsn]
+            try:
+                self._drain(conn, cache)
+            except psycopg2.Error, e:
+                web.debug('ERMrest version listener lost connection', e)
+                self._disconnect(dsn, cache)
+
+    def _wait(self, fds):
+        """Return fds readable within retry_interval seconds."""
+        return sanepg2.wait_readable(fds, self.retry_interval)
+
+    def _connect(self, dsn, cache):
+        with self._lock:
+            if self.caches.get(dsn) is not cache or dsn in self._dropped:
+                # stopped meanwhile
+                return
+        try:
+            # never wait for budget nor evict pooled connections, since callers just keep querying
+            sanepg2.pools.acquire_slot(None, timeout=0, evict=False)
+        except psycopg2.pool.PoolError, e:
+            web.debug('ERMrest version listener has no connection budget', e)
+            self._note_dropped(dsn)
+            return
+        try:
+            conn = psycopg2.connect(dsn=dsn)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            conn.cursor().execute('LISTEN %s;' % CHANNEL)
+        except psycopg2.Error, e:
+            # callers keep querying until a later retry succeeds
+            web.debug('ERMrest version listener cannot connect', e)
+            sanepg2.pools.release_slot()
+            self._note_dropped(dsn)
+            return
+        self._conns[dsn] = (conn, cache)
+        cache.set_connected(True)
+
+    def _disconnect(self, dsn, cache):
+        cache.set_connected(False)
+        conn, ignored = self._conns.pop(dsn, (None, None))
+        if conn is not None:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+            sanepg2.pools.release_slot()
+            self._note_dropped(dsn)
+
+    def _note_dropped(self, dsn):
+        with self._lock:
+            self._dropped[dsn] = time.time()
+
+    def _drain(self, conn, cache):
+        conn.poll()
+        while conn.notifies:
+            notify = conn.notifies.pop(0)
+            try:
+                payload = json.loads(notify.payload)
+                txid = int(payload[0])
+            except (ValueError, TypeError, IndexError), e:
+                web.debug('ERMrest version listener ignoring notification', notify.payload, e)
+                continue
+            if len(payload) == 1:
+                cache.notify(txid, MODEL)
+            else:
+                cache.notify(txid, table_key(payload[1], payload[2]))
+                cache.notify(txid, ANY_TABLE)
+
+    def stats(self):
+        """Return dictionary of per-process listener statistics."""
+        with self._lock:
+            caches = self.caches.values()
+        return dict(
+            enabled=self.enabled,
+            catalogs=len(caches),
+            max_catalogs=self.max_catalogs,
+            connected=len([ c for c in caches if c.connected ]),
+            hits=sum([ c.hits for c in caches ]),
+            misses=sum([ c.misses for c in caches ])
+        )
+
+versions = VersionListener()
@@ -27,8 +27,8 @@ needed by other modules of the ermrest project.
 from .type import Type
 from .column import Column
 from .table import Table
-from .misc import Model, Schema
+from .misc import Model, Schema, SqlTemplateCache
 from .introspect import introspect
 
-__all__ = ["introspect", "Model", "Schema", "Table", "Column", "Type"]
+__all__ = ["introspect", "Model", "Schema", "Table", "Column", "Type", "SqlTemplateCache"]
 
@@ -27,8 +27,8 @@ needed by other modules of the ermrest project.
 import web
 
 from .. import exception
-from ..util import table_exists, view_exists, column_exists
-from .misc import frozendict, Model, Schema, annotatable_classes
+from ..util import table_exists, view_exists, column_exists, lock_field_upgrades
+from .misc import frozendict, Model, Schema, annotatable_classes, scope_sql, create_model_change_log
 from .type import Type, ArrayType, canonicalize_column_type
 from .column import Column
 from .table import Table
@@ -44,7 +44,66 @@ def introspect(cur, config=None):
     
     Returns the introspected Model instance.
     """
-    
+    return _introspect(cur, config, Model())
+
+def reintrospect(cur, model, scope, config=None):
+    """Re-introspects the parts of a model affected by a change scope.
+
+    The 'model' must be a private copy of an introspected model, which
+    is patched in place.  The 'scope' is a set of (schema_name,
+    table_name) pairs as logged by model_change_sql(), where
+    table_name None stands for the schema itself.
+
+    Tables in scope are rebuilt along with every key reference to or
+    from them, while other tables keep their existing objects.
+
+    Returns the patched Model instance.
+    """
+    tables = []
+    for schema in model.schemas.values():
+        tables.extend(schema.tables.values())
+    tables.extend(model.ermrest_schema.tables.values())
+
+    # detach stale tables and all key references touching them
+    stale = set([
+        table for table in tables
+        if (table.schema.name, table.name) in scope
+    ])
+    for table in stale:
+        del table.schema.tables[table.name]
+    for table in tables:
+        if table in stale:
+            continue
+        for fkey in table.fkeys.values():
+            for fk_ref_map, fkr in fkey.references.items():
+                if fkr.unique.table in stale:
+                    del fkey.references[fk_ref_map]
+            for rtable in fkey.table_references.keys():
+                if rtable in stale:
+                    del fkey.table_references[rtable]
+        for unique in table.uniques.values():
+            for ftable in unique.table_references.keys():
+                if ftable in stale:
+                    del unique.table_references[ftable]
+
+    for sname, tname in scope:
+        if tname is None and sname in model.schemas:
+            model.schemas[sname].annotations.clear()
+
+    _introspect(cur, config, model, scope)
+
+    # drop foreign keys left without references
+    for schema in model.schemas.values():
+        for table in schema.tables.values():
+            for fk_colset, fkey in table.fkeys.items():
+                if not fkey.references:
+                    del table.fkeys[fk_colset]
+
+    return model
+
+def _introspect(cur, config, model, scope=None):
+    """Introspect into model, everything or only the given change scope."""
+
     # this postgres-specific code borrows bits from its information_schema view definitions
     # but is trimmed down to be a cheaper query to execute
 
@@ -58,7 +117,8 @@ FROM
   pg_catalog.pg_namespace nc
 WHERE
   nc.nspname NOT IN ('pg_catalog', 'information_schema', 'pg_toast')
-  AND NOT pg_is_other_temp_schema(nc.oid);
+  AND NOT pg_is_other_temp_schema(nc.oid)
+  AND %(schemas)s;
     '''
 
     # Select all column metadata from database, excluding system schemas
@@ -76,6 +136,7 @@ WHERE nc.nspname NOT IN ('information_schema', 'pg_catalog', 'pg_toast')
   AND NOT pg_is_other_temp_schema(nc.oid) 
   AND (c.relkind = ANY (ARRAY['r'::"char", 'v'::"char", 'f'::"char", 'm'::"char"]))
   AND (pg_has_role(c.relowner, 'USAGE'::text) OR has_column_privilege(c.oid, a.attnum, 'SELECT, INSERT, UPDATE, REFERENCES'::text))
+  AND %(tables)s
 GROUP BY nc.nspname, c.relname, c.relkind, c.oid
     '''
 
@@ -145,6 +206,7 @@ WHERE nc.nspname NOT IN ('information_schema', 'pg_catalog', 'pg_toast')
   AND NOT a.attisdropped
   AND (c.relkind = ANY (ARRAY['r'::"char", 'v'::"char", 'f'::"char", 'm'::"char"]))
   AND (pg_has_role(c.relowner, 'USAGE'::text) OR has_column_privilege(c.oid, a.attnum, 'SELECT, INSERT, UPDATE, REFERENCES'::text))
+  AND %(tables)s
 GROUP BY nc.nspname, c.relname, c.relkind, c.oid
     '''
     
@@ -164,7 +226,8 @@ GROUP BY nc.nspname, c.relname, c.relkind, c.oid
   JOIN pg_constraint con ON ncon.oid = con.connamespace
   JOIN pg_class pkcl ON con.conrelid = pkcl.oid AND con.contype = ANY (ARRAY['u'::"char",'p'::"char"])
   JOIN pg_namespace npk ON pkcl.relnamespace = npk.oid
-  WHERE has_table_privilege(pkcl.oid, 'INSERT, UPDATE, DELETE, TRUNCATE, REFERENCES, TRIGGER'::text) OR has_any_column_privilege(pkcl.oid, 'INSERT, UPDATE, REFERENCES'::text) 
+  WHERE (has_table_privilege(pkcl.oid, 'INSERT, UPDATE, DELETE, TRUNCATE, REFERENCES, TRIGGER'::text) OR has_any_column_privilege(pkcl.oid, 'INSERT, UPDATE, REFERENCES'::text))
+    AND %(pk_tables)s
  ;
 '''
 
@@ -175,7 +238,8 @@ SELECT
   table_name AS pk_table_name,
   column_names AS pk_column_names,
   comment AS constraint_comment
-FROM _ermrest.model_pseudo_key ;
+FROM _ermrest.model_pseudo_key
+WHERE %(pseudo_pk_tables)s ;
 '''
     
     # Select the foreign key reference columns
@@ -222,6 +286,7 @@ FROM _ermrest.model_pseudo_key ;
          OR has_table_privilege(kcl.oid, 'INSERT, UPDATE, DELETE, TRUNCATE, REFERENCES, TRIGGER'::text) OR has_any_column_privilege(kcl.oid, 'INSERT, UPDATE, REFERENCES'::text))
     AND (pg_has_role(fkcl.relowner, 'USAGE'::text) 
          OR has_table_privilege(fkcl.oid, 'INSERT, UPDATE, DELETE, TRUNCATE, REFERENCES, TRIGGER'::text) OR has_any_column_privilege(fkcl.oid, 'INSERT, UPDATE, REFERENCES'::text))
+    AND (%(fk_tables)s OR %(uq_tables)s)
  ;
 '''
 
@@ -236,7 +301,8 @@ SELECT
   to_table_name AS uq_table_name,
   to_column_names AS uq_column_names,
   comment AS constraint_comment
-FROM _ermrest.model_pseudo_keyref ;
+FROM _ermrest.model_pseudo_keyref
+WHERE %(pseudo_fk_tables)s OR %(pseudo_uq_tables)s ;
 '''
 
     # PostgreSQL denotes array types with the string 'ARRAY'
@@ -250,28 +316,78 @@ FROM _ermrest.model_pseudo_keyref ;
     fkeys    = dict()
     fkeyrefs = dict()
 
-    model = Model()
+    if scope is None:
+        filters = dict([
+            (k, 'True') for k in [
+                'schemas', 'tables', 'pk_tables', 'pseudo_pk_tables',
+                'fk_tables', 'uq_tables', 'pseudo_fk_tables', 'pseudo_uq_tables'
+            ]
+        ])
+
+        # upgrade catalogs in the field to support named pseudo keyrefs
+        if table_exists(cur, "_ermrest", "model_pseudo_keyref") \
+           and not column_exists(cur, "_ermrest", "model_pseudo_keyref", "name"):
+            web.debug('NOTICE: adding _ermrest.model_psuedo_keyref.name column during model introspection')
+            cur.execute('ALTER TABLE _ermrest.model_pseudo_keyref ADD COLUMN "name" text UNIQUE;')
 
-    # upgrade catalogs in the field to support named pseudo keyrefs
-    if table_exists(cur, "_ermrest", "model_pseudo_keyref") \
-       and not column_exists(cur, "_ermrest", "model_pseudo_keyref", "name"):
-        web.debug('NOTICE: adding _ermrest.model_psuedo_keyref.name column during model introspection')
-        cur.execute('ALTER TABLE _ermrest.model_pseudo_keyref ADD COLUMN "name" text UNIQUE;')
+        # upgrade catalogs in the field to log the scope of model changes
+        if table_exists(cur, "_ermrest", "model_version") \
+           and not table_exists(cur, "_ermrest", "model_modified"):
+            web.debug('NOTICE: adding _ermrest.model_modified table during model introspection')
+            lock_field_upgrades(cur)
+            create_model_change_log(cur)
+    else:
+        filters = dict(
+            schemas=scope_sql(scope, 'nc.nspname'),
+            tables=scope_sql(scope, 'nc.nspname', 'c.relname'),
+            pk_tables=scope_sql(scope, 'npk.nspname', 'pkcl.relname'),
+            pseudo_pk_tables=scope_sql(scope, 'schema_name', 'table_name'),
+            fk_tables=scope_sql(scope, 'nfk.nspname', 'fkcl.relname'),
+            uq_tables=scope_sql(scope, 'nk.nspname', 'kcl.relname'),
+            pseudo_fk_tables=scope_sql(scope, 'from_schema_name', 'from_table_name'),
+            pseudo_uq_tables=scope_sql(scope, 'to_schema_name', 'to_table_name')
+        )
+
+        # reuse retained parts of the model
+        cur.execute("SELECT current_database();")
+        dname = cur.fetchone()[0]
+        for schema in model.schemas.values():
+            schemas[(dname, schema.name)] = schema
+        for schema in model.schemas.values() + [model.ermrest_schema]:
+            for table in schema.tables.values():
+                for column in table.columns.values():
+                    # key like introspected rows, which carry raw utf8 names
+                    cname = column.name.encode('utf8') if type(column.name) is unicode else column.name
+                    columns[(dname, schema.name, table.name, cname)] = column
+                for unique in table.uniques.values():
+                    pkeys[unique.columns] = unique
+                for fkey in table.fkeys.values():
+                    fkeys[fkey.columns] = fkey
 
-    cur.execute(HEAL_DATA_VERSIONS);
+    cur.execute(HEAL_DATA_VERSIONS % filters);
     
     #
     # Introspect schemas, tables, columns
     #
     
     # get schemas (including empty ones)
-    cur.execute(SELECT_SCHEMAS);
+    cur.execute(SELECT_SCHEMAS % filters);
+    found_schemas = set()
     for dname, sname, scomment in cur:
+        found_schemas.add(sname)
         if (dname, sname) not in schemas:
             schemas[(dname, sname)] = Schema(model, sname, scomment)
+        else:
+            schemas[(dname, sname)].comment = scomment
+
+    if scope is not None:
+        # forget dropped schemas
+        for sname, tname in scope:
+            if tname is None and sname not in found_schemas and sname in model.schemas:
+                del model.schemas[sname]
 
     # get columns
-    cur.execute(SELECT_COLUMNS)
+    cur.execute(SELECT_COLUMNS % filters)
     for dname, sname, tname, tkind, tcomment, cnames, default_values, data_types, element_types, notnull, comments in cur:
 
         cols = []
@@ -301,7 +417,7 @@ FROM _ermrest.model_pseudo_keyref ;
         tables[(dname, sname, tname)] = Table(schemas[(dname, sname)], tname, cols, tkind, tcomment)
 
     # also get empty tables
-    cur.execute(SELECT_TABLES)
+    cur.execute(SELECT_TABLES % filters)
     for dname, sname, tname, tkind, tcomment in cur:
         if (dname, sname) not in schemas:
             schemas[(dname, sname)] = Schema(model, sname)
@@ -330,14 +446,14 @@ FROM _ermrest.model_pseudo_keyref ;
                 # save at least one comment in case multiple constraints have same key columns
                 pkeys[pk_colset].comment = pk_comment
     
-    cur.execute(PKEY_COLUMNS)
+    cur.execute(PKEY_COLUMNS % filters)
     for pk_schema, pk_name, pk_table_schema, pk_table_name, pk_column_names, pk_comment in cur:
         _introspect_pkey(
             pk_table_schema, pk_table_name, pk_column_names, pk_comment,
             lambda pk_colset: Unique(pk_colset, (pk_schema, pk_name), pk_comment)
         )
 
-    cur.execute(PSEUDO_PKEY_COLUMNS)
+    cur.execute(PSEUDO_PKEY_COLUMNS % filters)
     for pk_id, pk_table_schema, pk_table_name, pk_column_names, pk_comment in cur:
         _introspect_pkey(
             pk_table_schema, pk_table_name, pk_column_names, pk_comment,
@@ -382,7 +498,7 @@ FROM _ermrest.model_pseudo_keyref ;
                 fk.references[fk_ref_map].comment = fk_comment
 
     
-    cur.execute(FKEY_COLUMNS)
+    cur.execute(FKEY_COLUMNS % filters)
     for fk_schema, fk_name, fk_table_schema, fk_table_name, fk_column_names, \
             uq_table_schema, uq_table_name, uq_column_names, on_delete, on_update, fk_comment \
             in cur:
@@ -392,7 +508,7 @@ FROM _ermrest.model_pseudo_keyref ;
             lambda fk, pk, fk_ref_map: KeyReference(fk, pk, fk_ref_map, on_delete, on_update, (fk_schema, fk_name), comment=fk_comment)
         )
         
-    cur.execute(PSEUDO_FKEY_COLUMNS)
+    cur.execute(PSEUDO_FKEY_COLUMNS % filters)
     for fk_id, fk_constraint_name, fk_table_schema, fk_table_name, fk_column_names, \
             uq_table_schema, uq_table_name, uq_column_names, fk_comment \
             in cur:
@@ -408,7 +524,10 @@ FROM _ermrest.model_pseudo_keyref ;
     #
     for klass in annotatable_classes:
         if hasattr(klass, 'introspect_helper'):
-            klass.introspect_helper(cur, model)
+            klass.introspect_helper(cur, model, scope)
+
+    if scope is not None:
+        return model
 
     # save our private schema in case we want to unhide it later...
     model.ermrest_schema = model.schemas['_ermrest']
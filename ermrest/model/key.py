@@ -16,7 +16,7 @@
 
 from .. import exception
 from ..util import sql_identifier, sql_literal, constraint_exists
-from .misc import frozendict, AltDict, annotatable, commentable
+from .misc import frozendict, AltDict, KeyConflict, annotatable, commentable, model_change_sql
 
 import json
 
@@ -56,12 +56,13 @@ class Unique (object):
             pk_schema, pk_name = self.constraint_name
             cur.execute("""
 COMMENT ON CONSTRAINT %s ON %s.%s IS %s;
-SELECT _ermrest.model_change_event();
+%s
 """ % (
     sql_identifier(unicode(pk_name)),
     sql_identifier(unicode(self.table.schema.name)),
     sql_identifier(unicode(self.table.name)),
-    sql_literal(comment)
+    sql_literal(comment),
+    model_change_sql(self.model_change_scope())
 )
         )
         # also update other constraints sharing same key colset
@@ -187,10 +188,11 @@ class PseudoUnique (object):
 UPDATE _ermrest.model_pseudo_key
 SET comment = %s
 WHERE id = %s ;
-SELECT _ermrest.model_change_event();
+%s
 """ % (
     sql_literal(comment),
-    sql_literal(self.id)
+    sql_literal(self.id),
+    model_change_sql(self.model_change_scope())
 )
         )
         # also update other constraints sharing same key colset
@@ -223,11 +225,13 @@ SELECT _ermrest.model_change_event();
 INSERT INTO _ermrest.model_pseudo_key 
   (schema_name, table_name, column_names, comment)
   VALUES (%s, %s, ARRAY[%s], %s) ;
+%s
 """ % (
     sql_literal(unicode(self.table.schema.name)),
     sql_literal(unicode(self.table.name)),
     ','.join([ sql_literal(unicode(c.name)) for c in self.columns ]),
-    sql_literal(self.comment)
+    sql_literal(self.comment),
+    model_change_sql(self.model_change_scope())
 )
         )
                 
@@ -236,8 +240,8 @@ INSERT INTO _ermrest.model_pseudo_key
         if self.id:
             cur.execute("""
 DELETE FROM _ermrest.model_pseudo_key WHERE id = %s;
-SELECT _ermrest.model_change_event();
-""" % sql_literal(self.id)
+%s
+""" % (sql_literal(self.id), model_change_sql(self.model_change_scope()))
             )
         for pk in self.constraints:
             if pk != self:
@@ -252,7 +256,7 @@ class ForeignKey (object):
         assert len(tables) == 1
         self.table = tables.pop()
         self.columns = cols
-        self.references = AltDict(lambda k: exception.ConflictModel(u"Primary key %s not referenced by foreign key %s." % (k, self)))
+        self.references = AltDict(KeyConflict(u"Primary key %s not referenced by foreign key %s.", self))
         self.table_references = dict()
         
         if cols not in self.table.fkeys:
@@ -397,12 +401,13 @@ class KeyReference (object):
             fkr_schema, fkr_name = self.constraint_name
             cur.execute("""
 COMMENT ON CONSTRAINT %s ON %s.%s IS %s;
-SELECT _ermrest.model_change_event();
+%s
 """ % (
     sql_identifier(unicode(fkr_name)),
     sql_identifier(unicode(self.foreign_key.table.schema.name)),
     sql_identifier(unicode(self.foreign_key.table.name)),
-    sql_literal(comment)
+    sql_literal(comment),
+    model_change_sql(self.model_change_scope())
 )
             )
         # also update other constraints sharing same mapping
@@ -597,11 +602,12 @@ class PseudoKeyReference (object):
             cur.execute("""
 UPDATE _ermrest.model_pseudo_keyref
 SET comment = %s
-WHERE id = %s
-SELECT _ermrest.model_change_event();
+WHERE id = %s ;
+%s
 """ % (
     sql_literal(comment),
-    sql_literal(self.id)
+    sql_literal(self.id),
+    model_change_sql(self.model_change_scope())
 )
             )
         # also update other constraints sharing same mapping
@@ -638,12 +644,13 @@ SELECT _ermrest.model_change_event();
     def add(self, conn, cur):
         fk_cols = list(self.foreign_key.columns)
         cur.execute("""
-SELECT _ermrest.model_change_event();
+%s
 INSERT INTO _ermrest.model_pseudo_keyref
   (from_schema_name, from_table_name, from_column_names, to_schema_name, to_table_name, to_column_names, comment, name)
-  VALUES (%s, %s, ARRAY[%s], %s, %s, ARRAY[%s], %s)
+  VALUES (%s, %s, ARRAY[%s], %s, %s, ARRAY[%s], %s, %s)
   RETURNING id
 """ % (
+    model_change_sql(self.model_change_scope()),
     sql_literal(unicode(self.foreign_key.table.schema.name)),
     sql_literal(unicode(self.foreign_key.table.name)),
     ', '.join([ sql_literal(unicode(fk_cols[i].name)) for i in range(len(fk_cols)) ]),
@@ -665,8 +672,8 @@ INSERT INTO _ermrest.model_pseudo_keyref
         if self.id:
             cur.execute("""
 DELETE FROM _ermrest.model_pseudo_keyref WHERE id = %s;
-SELECT _ermrest.model_change_event();
-""" % sql_literal(self.id)
+%s
+""" % (sql_literal(self.id), model_change_sql(self.model_change_scope()))
             )
         for fkr in self.constraints:
             if fkr != self:
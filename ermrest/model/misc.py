@@ -20,6 +20,8 @@ from .type import _default_config
 
 import json
 import web
+import threading
+import collections
 
 def frozendict (d):
     """Convert a dictionary to a canonical and immutable form."""
@@ -35,6 +37,98 @@ def _get_ermrest_config():
     else:
         return _default_config
 
+def model_change_sql(scope=None):
+    """Return SQL statements recording a model change affecting scope.
+
+       The scope is a list of (schema_name, table_name) pairs, where a
+       table_name of None stands for the schema itself.  Without a
+       scope, the whole model is considered changed.
+    """
+    if not scope:
+        return "SELECT _ermrest.model_change_event();"
+    return '\n'.join([
+        "SELECT _ermrest.model_change_event(%s, %s::text);" % (sql_literal(sname), sql_literal(tname))
+        for sname, tname in scope
+    ])
+
+def scope_sql(scope, sname_expr, tname_expr=None):
+    """Return SQL condition matching rows within a model change scope.
+
+       With tname_expr, rows match the (schema_name, table_name) pairs
+       of scope.  Without it, rows match the schemas whose own scope
+       entries have table_name None.
+    """
+    if tname_expr is None:
+        snames = [ sname for sname, tname in scope if tname is None ]
+        if not snames:
+            return 'False'
+        return '%s::text = ANY (%s::text[])' % (sname_expr, sql_literal(snames))
+    pairs = [ (sname, tname) for sname, tname in scope if tname is not None ]
+    if not pairs:
+        return 'False'
+    return '(%s::text, %s::text) IN (SELECT * FROM unnest(%s::text[], %s::text[]))' % (
+        sname_expr,
+        tname_expr,
+        sql_literal([ sname for sname, tname in pairs ]),
+        sql_literal([ tname for sname, tname in pairs ])
+    )
+
+def create_model_change_log(cur):
+    """Create per-table model change log and functions maintaining it.
+
+       Safe to run repeatedly, also as a field upgrade of existing
+       catalogs whose model_change_event() only bumped the version.
+    """
+    if not table_exists(cur, '_ermrest', 'model_modified'):
+        # IF NOT EXISTS sees tables created by field upgrades we waited for
+        cur.execute("""
+CREATE TABLE IF NOT EXISTS _ermrest.model_modified (
+  snap_txid bigint NOT NULL,
+  schema_name text,
+  table_name text,
+  UNIQUE (snap_txid, schema_name, table_name)
+);
+GRANT SELECT, INSERT ON _ermrest.model_modified TO ermrest;
+""")
+    cur.execute("""
+CREATE OR REPLACE FUNCTION _ermrest.model_change_event(sname text, tname text) RETURNS void AS $$
+BEGIN
+  IF NOT EXISTS (SELECT snap_txid FROM _ermrest.model_version WHERE snap_txid = txid_current()) THEN
+    INSERT INTO _ermrest.model_version (snap_txid) SELECT txid_current();
+  END IF;
+  IF NOT EXISTS (SELECT snap_txid FROM _ermrest.model_modified
+                 WHERE snap_txid = txid_current()
+                   AND schema_name IS NOT DISTINCT FROM sname
+                   AND table_name IS NOT DISTINCT FROM tname) THEN
+    INSERT INTO _ermrest.model_modified (snap_txid, schema_name, table_name)
+      SELECT txid_current(), sname, tname;
+  END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- untracked changes are logged with NULL schema_name, affecting the whole model
+CREATE OR REPLACE FUNCTION _ermrest.model_change_event() RETURNS void AS $$
+BEGIN
+  PERFORM _ermrest.model_change_event(NULL, NULL);
+END;
+$$ LANGUAGE plpgsql;
+""")
+
+class KeyConflict (object):
+    """Picklable AltDict keyerror producing ConflictModel errors.
+
+       The message template is interpolated with the missing key, and
+       with the context object too when one is given.
+    """
+    def __init__(self, template, context=None):
+        self.template = template
+        self.context = context
+
+    def __call__(self, k):
+        if self.context is None:
+            return exception.ConflictModel(self.template % k)
+        return exception.ConflictModel(self.template % (k, self.context))
+
 class AltDict (dict):
     """Alternative dict that raises custom errors."""
     def __init__(self, keyerror):
@@ -59,8 +153,8 @@ def commentable():
         for resource in resources:
             cur.execute("""
 COMMENT ON %s IS %s;
-SELECT _ermrest.model_change_event();
-""" % (resource, sql_literal(comment))
+%s
+""" % (resource, sql_literal(comment), model_change_sql(self.model_change_scope()))
             )
     
     def helper(orig_class):
@@ -92,6 +186,18 @@ def annotatable(restype, keying):
             ('annotation_uri', sql_wrap(key))
         ])
         
+    def model_change_scope(self):
+        """Return list of (schema_name, table_name) pairs affected by changes to this resource."""
+        if 'from_table_name' in keying:
+            return [
+                (keying['from_schema_name'][1](self), keying['from_table_name'][1](self)),
+                (keying['to_schema_name'][1](self), keying['to_table_name'][1](self))
+            ]
+        elif 'table_name' in keying:
+            return [ (keying['schema_name'][1](self), keying['table_name'][1](self)) ]
+        else:
+            return [ (keying['schema_name'][1](self), None) ]
+
     def set_annotation(self, conn, cur, key, value):
         """Set annotation on %s, returning previous value for updates or None.""" % restype
         assert key is not None
@@ -103,12 +209,12 @@ def annotatable(restype, keying):
             for k, v in interp.items()
         ])
         cur.execute("""
-SELECT _ermrest.model_change_event();
+%s
 UPDATE _ermrest.model_%s_annotation 
 SET annotation_value = %s
 WHERE %s 
 RETURNING annotation_value;
-""" % (restype, sql_literal(json.dumps(value)), where)
+""" % (model_change_sql(self.model_change_scope()), restype, sql_literal(json.dumps(value)), where)
         )
         for oldvalue in cur:
             # happens zero or one time
@@ -133,9 +239,9 @@ INSERT INTO _ermrest.model_%s_annotation (%s) VALUES (%s);
             for k, v in interp.items()
         ])
         cur.execute("""
-SELECT _ermrest.model_change_event();
+%s
 DELETE FROM _ermrest.model_%s_annotation WHERE %s;
-""" % (restype, where)
+""" % (model_change_sql(self.model_change_scope()), restype, where)
         )
 
     @classmethod
@@ -158,14 +264,30 @@ GRANT SELECT ON _ermrest.model_%(restype)s_annotation TO ermrest;
         )
         
     @classmethod
-    def introspect_helper(orig_class, cur, model):
-        """Introspect annotations on %s, adding them to model.""" % restype
+    def introspect_helper(orig_class, cur, model, scope=None):
+        """Introspect annotations on %s, adding them to model.
+
+           With a scope, only annotations of resources in the scope
+           are introspected.
+        """ % restype
         keys = keying.keys() + ['annotation_uri', 'annotation_value']
+        if scope is None:
+            where = 'True'
+        elif 'from_table_name' in keying:
+            where = '%s OR %s' % (
+                scope_sql(scope, '"from_schema_name"', '"from_table_name"'),
+                scope_sql(scope, '"to_schema_name"', '"to_table_name"')
+            )
+        elif 'table_name' in keying:
+            where = scope_sql(scope, '"schema_name"', '"table_name"')
+        else:
+            where = scope_sql(scope, '"schema_name"')
         cur.execute("""
-SELECT %s FROM _ermrest.model_%s_annotation;
+SELECT %s FROM _ermrest.model_%s_annotation WHERE %s;
 """ % (
     ','.join([ sql_identifier(k) for k in keys]),
-    restype
+    restype,
+    where
 )
         )
         for row in cur:
@@ -179,6 +301,7 @@ SELECT %s FROM _ermrest.model_%s_annotation;
                 
     def helper(orig_class):
         setattr(orig_class, '_interp_annotation', _interp_annotation)
+        setattr(orig_class, 'model_change_scope', model_change_scope)
         setattr(orig_class, 'set_annotation', set_annotation)
         setattr(orig_class, 'delete_annotation', delete_annotation)
         setattr(orig_class, '_annotation_keying', keying)
@@ -189,6 +312,68 @@ SELECT %s FROM _ermrest.model_%s_annotation;
         return orig_class
     return helper
 
+class SqlTemplateCache (object):
+    """Bounded LRU cache of SQL templates compiled against one model.
+
+       Each Model owns one, so templates never outlive the model
+       version they were compiled for.  Keys and templates are opaque
+       here, see ermrest.ermpath.AnyPath.sql_get_cached().
+
+       Settings are process-wide class attributes updated by
+       configure().
+    """
+    enabled = True
+    max_entries = 1000
+
+    @classmethod
+    def configure(cls, config):
+        """Update process-wide settings from config dictionary."""
+        cls.enabled = config.get('enabled', cls.enabled)
+        cls.max_entries = config.get('max_entries', cls.max_entries)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        # advanced by clear() so racing put() calls cannot store stale templates
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return template cached for key or None."""
+        with self._lock:
+            template = self._entries.pop(key, None)
+            if template is not None:
+                self._entries[key] = template
+                self.hits += 1
+            else:
+                self.misses += 1
+            return template
+
+    def put(self, key, template, generation):
+        """Cache template for key if compiled during generation."""
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = template
+            while len(self._entries) > max(self.max_entries, 0):
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Discard all templates, e.g. when the model changed in place."""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        """Return dictionary of cache statistics."""
+        with self._lock:
+            return dict(
+                entries=len(self._entries),
+                hits=self.hits,
+                misses=self.misses
+            )
+
 class Model (object):
     """Represents a database model.
     
@@ -198,8 +383,19 @@ class Model (object):
     
     def __init__(self, schemas=None):
         if schemas is None:
-            schemas = AltDict(lambda k: exception.ConflictModel(u"Schema %s does not exist." % k))
+            schemas = AltDict(KeyConflict(u"Schema %s does not exist."))
         self.schemas = schemas
+        self.sql_templates = SqlTemplateCache()
+
+    def __getstate__(self):
+        # copies for incremental refresh and snapshots start without templates
+        state = dict(self.__dict__)
+        state.pop('sql_templates', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.sql_templates = SqlTemplateCache()
     
     def verbose(self):
         return json.dumps(self.prejson(), indent=2)
@@ -235,8 +431,8 @@ class Model (object):
         cur.execute("""
 CREATE SCHEMA %(schema)s ;
 GRANT USAGE ON SCHEMA %(schema)s TO ermrest;
-SELECT _ermrest.model_change_event();
-""" % dict(schema=sql_identifier(sname)))
+%(change)s
+""" % dict(schema=sql_identifier(sname), change=model_change_sql([(sname, None)])))
         return Schema(self, sname)
 
     def delete_schema(self, conn, cur, sname):
@@ -245,8 +441,8 @@ SELECT _ermrest.model_change_event();
             raise exception.ConflictModel('Requested schema %s does not exist.' % sname)
         cur.execute("""
 DROP SCHEMA %s ;
-SELECT _ermrest.model_change_event();
-""" % sql_identifier(sname))
+%s
+""" % (sql_identifier(sname), model_change_sql([(sname, None)])))
         self.schemas[sname].delete_annotation(conn, cur, None)
         del self.schemas[sname]
 
@@ -292,7 +488,7 @@ class Schema (object):
         self.model = model
         self.name = name
         self.comment = comment
-        self.tables = AltDict(lambda k: exception.ConflictModel(u"Table %s does not exist in schema %s." % (k, self)))
+        self.tables = AltDict(KeyConflict(u"Table %s does not exist in schema %s.", self))
         self.annotations = dict()
         self.annotations.update(annotations)
         
@@ -26,7 +26,7 @@ needed by other modules of the ermrest project.
 
 from .. import exception
 from ..util import sql_identifier, sql_literal
-from .misc import AltDict, annotatable, commentable
+from .misc import AltDict, KeyConflict, annotatable, commentable, model_change_sql
 from .column import Column, FreetextColumn
 from .key import Unique, ForeignKey, KeyReference
 
@@ -51,9 +51,9 @@ class Table (object):
         self.name = name
         self.kind = kind
         self.comment = comment
-        self.columns = AltDict(lambda k: exception.ConflictModel(u"Requested column %s does not exist in table %s." % (k, self)))
-        self.uniques = AltDict(lambda k: exception.ConflictModel(u"Requested key %s does not exist in table %s." % (k, self)))
-        self.fkeys = AltDict(lambda k: exception.ConflictModel(u"Requested foreign-key %s does not exist in table %s." % (k, self)))
+        self.columns = AltDict(KeyConflict(u"Requested column %s does not exist in table %s.", self))
+        self.uniques = AltDict(KeyConflict(u"Requested key %s does not exist in table %s.", self))
+        self.fkeys = AltDict(KeyConflict(u"Requested foreign-key %s does not exist in table %s.", self))
         self.annotations = dict()
         self.annotations.update(annotations)
 
@@ -128,12 +128,13 @@ CREATE TABLE %(sname)s.%(tname)s (
 COMMENT ON TABLE %(sname)s.%(tname)s IS %(comment)s;
 GRANT ALL ON TABLE %(sname)s.%(tname)s TO ermrest;
 GRANT ALL ON ALL SEQUENCES IN SCHEMA %(sname)s TO ermrest;
-SELECT _ermrest.model_change_event();
+%(change)s
 SELECT _ermrest.data_change_event(%(snamestr)s, %(tnamestr)s);
 """ % dict(sname=sql_identifier(sname),
            tname=sql_identifier(tname),
            snamestr=sql_literal(sname),
            tnamestr=sql_literal(tname),
+           change=model_change_sql(table.model_change_scope()),
            clauses=',\n'.join(clauses),
            comment=sql_literal(comment),
            )
@@ -164,10 +165,11 @@ SELECT _ermrest.data_change_event(%(snamestr)s, %(tnamestr)s);
         self.pre_delete(conn, cur)
         cur.execute("""
 DROP %(kind)s %(sname)s.%(tname)s ;
-SELECT _ermrest.model_change_event();
+%(change)s
 SELECT _ermrest.data_change_event(%(snamestr)s, %(tnamestr)s);
 """ % dict(
     kind={'r': 'TABLE', 'v': 'VIEW', 'f': 'FOREIGN TABLE'}[self.kind],
+    change=model_change_sql(self.model_change_scope()),
     sname=sql_identifier(self.schema.name), 
     tname=sql_identifier(self.name),
     snamestr=sql_literal(self.schema.name), 
@@ -190,9 +192,10 @@ SELECT _ermrest.data_change_event(%(snamestr)s, %(tnamestr)s);
         """Generic ALTER TABLE ... wrapper"""
         cur.execute("""
 ALTER TABLE %(sname)s.%(tname)s  %(alter)s ;
-SELECT _ermrest.model_change_event();
+%(change)s
 SELECT _ermrest.data_change_event(%(snamestr)s, %(tnamestr)s);
-""" % dict(sname=sql_identifier(self.schema.name), 
+""" % dict(change=model_change_sql(self.model_change_scope()),
+           sname=sql_identifier(self.schema.name), 
            tname=sql_identifier(self.name),
            snamestr=sql_literal(self.schema.name), 
            tnamestr=sql_literal(self.name),
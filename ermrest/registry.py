@@ -26,6 +26,11 @@ that may be more sophisticated than the SimpleRegistry implementation.
 """
 
 import json
+import threading
+import time
+import psycopg2
+import psycopg2.pool
+import web
 
 from .util import *
 from . import sanepg2
@@ -33,7 +38,8 @@ from . import sanepg2
 __all__ = ['get_registry']
 
 _DEFAULT_ACLS = {
-    "create_catalog_permit": ["admin"]
+    "create_catalog_permit": ["admin"],
+    "service_admin_permit": ["admin"]
 }
 
 def get_registry(config):
@@ -45,7 +51,8 @@ def get_registry(config):
 
     return SimpleRegistry(
         dsn=config.get("dsn"),
-        acls=config.get("acls")
+        acls=config.get("acls"),
+        lookup_cache=config.get("lookup_cache", {})
         )
 
 
@@ -87,6 +94,14 @@ class Registry(object):
         acl = set(acl) if acl else set()
         return len(roles & acl) > 0
 
+    def can_admin(self, roles):
+        """Tests if one of roles can access service administration resources.
+        """
+        roles = set([r['id'] if type(r) is dict else r for r in roles]) | self.ANONYMOUS
+        acl = self.acls.get('service_admin_permit', _DEFAULT_ACLS['service_admin_permit'])
+        acl = set(acl) if acl else set()
+        return len(roles & acl) > 0
+
     def lookup(self, id=None):
         """Lookup a registry and retrieve its description.
 
@@ -97,6 +112,22 @@ class Registry(object):
         """
         raise NotImplementedError()
 
+    def listing(self, deleted=False, deleted_since=None, deleted_for=None, host=None, page_size=1000):
+        """Generate registry entries in id order without loading them all.
+
+           'deleted' : False for live catalogs, True for deleted
+                       catalogs, or None for both.
+           'deleted_since' : only catalogs deleted at or after this
+                             timestamp.
+           'deleted_for' : only catalogs deleted longer ago than this
+                           Postgres interval, e.g. '5 weeks'.
+           'host' : only catalogs whose descriptor names this host.
+           'page_size' : number of entries fetched per transaction.
+
+           yields : mappings in the form (id, descriptor, deleted_on)
+        """
+        raise NotImplementedError()
+
     def register(self, descriptor, id=None):
         """Register a catalog description.
 
@@ -114,20 +145,200 @@ class Registry(object):
         """
         raise NotImplementedError()
 
+    def purge(self, id):
+        """Remove a live or unregistered catalog description permanently.
+
+           This does not drop the catalog.
+
+           'id' : the id of the catalog to purge.
+        """
+        raise NotImplementedError()
+
+    def claim_spare(self):
+        """Claim one pre-created spare catalog.
+
+           returns : the spare catalog descriptor or None if none are ready.
+
+           The claimed catalog is removed from the spare pool but it
+           is not registered.
+        """
+        return None
+
+    def reserve_spare(self, count, max_pending_seconds):
+        """Reserve a slot to create one more spare catalog.
+
+           'count' : the target number of ready and pending spares.
+           'max_pending_seconds' : age after which abandoned
+                                   reservations are discarded.
+
+           returns : a reservation id or None if the pool is full.
+        """
+        return None
+
+    def fill_spare(self, reservation, descriptor):
+        """Make a spare catalog ready for claiming.
+
+           'reservation' : an id returned by reserve_spare().
+           'descriptor' : the spare catalog connection descriptor.
+
+           returns : True if the reservation was still held.
+        """
+        raise NotImplementedError()
+
+    def release_spare(self, reservation):
+        """Abandon a reservation made by reserve_spare().
+        """
+        raise NotImplementedError()
+
+
+class LookupCache(object):
+    """Process-local cache of registry lookups by catalog id.
+
+       Entries expire after 'ttl' seconds, or 'negative_ttl' seconds
+       for unknown ids.  When 'listen' is true, a thread LISTENs for
+       the change notifications sent by the registry table, any change
+       drops all entries, and the cache is bypassed while that
+       connection is down.  Otherwise, other processes' changes may
+       go unnoticed for up to 'ttl' seconds.
+
+       The listening connection takes a free slot of the sanepg2.pools
+       connection budget, never evicting idle pooled connections for
+       it.  Failures are retried every 'retry_interval' seconds and
+       logged once per outage.  A registry whose change notification
+       is not deployed is checked once and then never listened to.
+    """
+
+    CHANNEL = 'ermrest_registry'
+
+    def __init__(self, dsn, config={}):
+        self.dsn = dsn
+        self.ttl = config.get('ttl', 60)
+        self.negative_ttl = config.get('negative_ttl', 5)
+        self.max_entries = config.get('max_entries', 10000)
+        self.listen = config.get('listen', True)
+        self.retry_interval = config.get('retry_interval', 5.0)
+        self.connected = False
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._generation = 0
+        # map str(id) -> (expires, generation, rows)
+        self._entries = dict()
+        self._thread = None
+
+    def get(self, id, query):
+        """Return rows from query() or an equivalent cached result for id."""
+        key = str(id)
+        now = time.time()
+        with self._lock:
+            if self.listen and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ermrest-registry-listener')
+                self._thread.daemon = True
+                self._thread.start()
+            usable = self.ttl > 0 and (self.connected or not self.listen)
+            entry = self._entries.get(key) if usable else None
+            if entry is not None and entry[0] > now and entry[1] == self._generation:
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            generation = self._generation if usable else None
+
+        rows = query()
+
+        if generation is not None:
+            with self._lock:
+                if generation == self._generation:
+                    if len(self._entries) >= self.max_entries:
+                        self._prune(now)
+                    self._entries[key] = (now + (self.ttl if rows else self.negative_ttl), generation, rows)
+        return rows
+
+    def invalidate(self):
+        """Drop all entries, including lookups still in progress."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def _prune(self, now):
+        # caller must hold self._lock
+        for key, entry in self._entries.items():
+            if entry[0] <= now:
+                del self._entries[key]
+        if len(self._entries) >= self.max_entries:
+            self._entries.clear()
+
+    def _set_connected(self, connected):
+        with self._lock:
+            self.connected = connected
+            self._generation += 1
+            self._entries.clear()
+
+    def _run(self):
+        failing = False
+        while True:
+            conn = None
+            try:
+                # never wait for budget nor evict pooled connections, since lookups just keep querying
+                sanepg2.pools.acquire_slot(None, timeout=0, evict=False)
+            except psycopg2.pool.PoolError, e:
+                if not failing:
+                    web.debug('ERMrest registry listener has no connection budget, retrying', e)
+                failing = True
+                time.sleep(self.retry_interval)
+                continue
+            try:
+                conn = psycopg2.connect(dsn=self.dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cur = conn.cursor()
+                cur.execute("""
+SELECT EXISTS (
+  SELECT 1 FROM pg_trigger
+  WHERE tgrelid = 'ermrest.simple_registry'::regclass AND tgname = 'simple_registry_notify'
+);
+""")
+                if not cur.fetchone()[0]:
+                    # lookups keep bypassing the cache, as when disconnected
+                    web.debug('ERMrest registry change notification is not deployed; rerun ermrest-registry-deploy to cache lookups')
+                    return
+                cur.execute('LISTEN %s;' % self.CHANNEL)
+                self._set_connected(True)
+                failing = False
+                while True:
+                    if sanepg2.wait_readable([conn.fileno()], self.retry_interval):
+                        conn.poll()
+                        if conn.notifies:
+                            del conn.notifies[:]
+                            self.invalidate()
+            except Exception, e:
+                if not failing:
+                    web.debug('ERMrest registry listener error, retrying', e)
+                failing = True
+            finally:
+                self._set_connected(False)
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except psycopg2.Error:
+                        pass
+                sanepg2.pools.release_slot()
+            time.sleep(self.retry_interval)
+
 
 class SimpleRegistry(Registry):
     """A simple registry implementation with a database backend.
 
        Operations use basic connection-pooling but each does its own
        transaction since requests are usually independent and simple
-       lookup is the hot path.
+       lookup is the hot path.  Lookups by id are answered from a
+       LookupCache when possible.
     """
 
-    def __init__(self, dsn, acls):
+    def __init__(self, dsn, acls, lookup_cache={}):
         """Initialized the SimpleRegistry.
         """
         super(SimpleRegistry, self).__init__(acls)
         self.dsn = dsn
+        self.lookup_cache = LookupCache(dsn, lookup_cache)
 
     def pooled_perform(self, body, post_commit=lambda x: x):
         pc = sanepg2.PooledConnection(self.dsn)
@@ -159,6 +370,30 @@ CREATE TABLE ermrest.simple_registry (
 CREATE INDEX ON ermrest.simple_registry (deleted_on);
 CREATE INDEX ON ermrest.simple_registry (id, deleted_on);
 GRANT SELECT ON ermrest.simple_registry TO ermrest;
+""")
+
+            # notify service processes caching lookups of any change
+            cur.execute("""
+CREATE OR REPLACE FUNCTION ermrest.simple_registry_notify() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('%(channel)s', '');
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS simple_registry_notify ON ermrest.simple_registry;
+CREATE TRIGGER simple_registry_notify
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON ermrest.simple_registry
+  FOR EACH STATEMENT EXECUTE PROCEDURE ermrest.simple_registry_notify();
+""" % dict(channel=LookupCache.CHANNEL))
+
+            # create spare catalog table, if it doesn't exist
+            if not table_exists(cur, "ermrest", "spare_catalog"):
+                cur.execute("""
+CREATE TABLE ermrest.spare_catalog (
+    id bigserial PRIMARY KEY,
+    descriptor text DEFAULT NULL,
+    created_on timestamp with time zone NOT NULL DEFAULT current_timestamp
+);
 """)
             return None
         return self.pooled_perform(body)
@@ -166,22 +401,72 @@ GRANT SELECT ON ermrest.simple_registry TO ermrest;
     def lookup(self, id=None):
         """See Registry.lookup()"""
         def body(conn, cur):
-            filter = " AND id = %s" % sql_literal(id) if id else ""
-
-            cur.execute("""
+            if id:
+                conn.execute_prepared(cur, 'ermrest_registry_lookup_id', ['bigint'], """
+SELECT id, descriptor
+FROM ermrest.simple_registry
+WHERE deleted_on IS NULL AND id = $1
+""", [id])
+            else:
+                conn.execute_prepared(cur, 'ermrest_registry_lookup', [], """
 SELECT id, descriptor
 FROM ermrest.simple_registry
 WHERE deleted_on IS NULL
-%(filter)s;
-"""         % dict(filter=filter))
-
-            # return results as a list of dictionaries
-            return [
-                dict(id=eid, descriptor=json.loads(descriptor))
-                for eid, descriptor in cur
-            ]
-
-        return self.pooled_perform(body)
+""")
+            return list(cur)
+
+        if id:
+            rows = self.lookup_cache.get(id, lambda : self.pooled_perform(body))
+        else:
+            rows = self.pooled_perform(body)
+
+        # return results as a list of dictionaries, decoded afresh
+        # so callers cannot modify cached descriptors
+        return [
+            dict(id=eid, descriptor=json.loads(descriptor))
+            for eid, descriptor in rows
+        ]
+
+    def listing(self, deleted=False, deleted_since=None, deleted_for=None, host=None, page_size=1000):
+        """See Registry.listing()"""
+        filters = []
+        if deleted is True:
+            filters.append("deleted_on IS NOT NULL")
+        elif deleted is False:
+            filters.append("deleted_on IS NULL")
+        if deleted_since is not None:
+            filters.append("deleted_on >= %s::timestamptz" % sql_literal(deleted_since))
+        if deleted_for is not None:
+            filters.append("deleted_on < current_timestamp - %s::interval" % sql_literal(deleted_for))
+        if host is not None:
+            filters.append("descriptor::json->>'host' = %s" % sql_literal(host))
+
+        def page(after):
+            def body(conn, cur):
+                # keyset pagination resumes each page from the last id seen
+                where = list(filters)
+                if after is not None:
+                    where.append("id > %s" % sql_literal(after))
+                cur.execute("""
+SELECT id, descriptor, deleted_on
+FROM ermrest.simple_registry
+%(where)s
+ORDER BY id
+LIMIT %(limit)d;
+""" % dict(where=('WHERE ' + ' AND '.join(where)) if where else '',
+           limit=page_size))
+                return list(cur)
+
+            return self.pooled_perform(body)
+
+        after = None
+        while True:
+            rows = page(after)
+            for eid, descriptor, deleted_on in rows:
+                yield dict(id=eid, descriptor=json.loads(descriptor), deleted_on=deleted_on)
+            if len(rows) < page_size:
+                break
+            after = rows[-1][0]
 
     def register(self, descriptor, id=None):
         """See Registry.register()"""
@@ -199,6 +484,7 @@ RETURNING id;
             return cur.fetchone()[0]
 
         def post_commit(id):
+            self.lookup_cache.invalidate()
             return dict(id=id, descriptor=descriptor)
 
         return self.pooled_perform(body, post_commit)
@@ -217,7 +503,98 @@ WHERE deleted_on IS NULL AND id = %(id)s;
             return cur.rowcount > 0
 
         def post_commit(deleted):
+            self.lookup_cache.invalidate()
             if not deleted:
                 raise KeyError("catalog identifier ("+id+") does not exist")
 
         return self.pooled_perform(body, post_commit)
+
+    def purge(self, id):
+        """See Registry.purge()"""
+        assert id is not None
+
+        def body(conn, cur):
+            """Returns True if row deleted, false if not"""
+            cur.execute("""
+DELETE FROM ermrest.simple_registry
+WHERE id = %(id)s;
+"""          % dict(id=sql_literal(id)))
+            return cur.rowcount > 0
+
+        def post_commit(deleted):
+            self.lookup_cache.invalidate()
+            if not deleted:
+                raise KeyError("catalog identifier ("+id+") does not exist")
+
+        return self.pooled_perform(body, post_commit)
+
+    def claim_spare(self):
+        """See Registry.claim_spare()"""
+        def body(conn, cur):
+            if not table_exists(cur, "ermrest", "spare_catalog"):
+                return None
+            # SKIP LOCKED lets concurrent claims take different spares
+            cur.execute("""
+DELETE FROM ermrest.spare_catalog
+WHERE id = (
+  SELECT id
+  FROM ermrest.spare_catalog
+  WHERE descriptor IS NOT NULL
+  ORDER BY id
+  LIMIT 1
+  FOR UPDATE SKIP LOCKED
+)
+RETURNING descriptor;
+""")
+            row = cur.fetchone()
+            return json.loads(row[0]) if row else None
+
+        return self.pooled_perform(body)
+
+    def reserve_spare(self, count, max_pending_seconds):
+        """See Registry.reserve_spare()"""
+        def body(conn, cur):
+            if not table_exists(cur, "ermrest", "spare_catalog"):
+                return None
+            # serialize replenishers of all service processes
+            cur.execute("""
+LOCK TABLE ermrest.spare_catalog IN SHARE ROW EXCLUSIVE MODE;
+DELETE FROM ermrest.spare_catalog
+WHERE descriptor IS NULL
+  AND created_on < current_timestamp - %(age)s::integer * interval '1 second';
+SELECT count(*) FROM ermrest.spare_catalog;
+""" % dict(age=sql_literal(int(max_pending_seconds))))
+            if cur.fetchone()[0] >= count:
+                return None
+            cur.execute("""
+INSERT INTO ermrest.spare_catalog DEFAULT VALUES
+RETURNING id;
+""")
+            return cur.fetchone()[0]
+
+        return self.pooled_perform(body)
+
+    def fill_spare(self, reservation, descriptor):
+        """See Registry.fill_spare()"""
+        assert isinstance(descriptor, dict)
+
+        def body(conn, cur):
+            cur.execute("""
+UPDATE ermrest.spare_catalog
+SET descriptor = %(descriptor)s
+WHERE descriptor IS NULL AND id = %(id)s;
+""" % dict(descriptor=sql_literal(json.dumps(descriptor)),
+           id=sql_literal(reservation)))
+            return cur.rowcount > 0
+
+        return self.pooled_perform(body)
+
+    def release_spare(self, reservation):
+        """See Registry.release_spare()"""
+        def body(conn, cur):
+            cur.execute("""
+DELETE FROM ermrest.spare_catalog
+WHERE descriptor IS NULL AND id = %(id)s;
+""" % dict(id=sql_literal(reservation)))
+
+        return self.pooled_perform(body)
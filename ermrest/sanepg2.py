@@ -20,8 +20,13 @@
 This module provides a customized psycopg2 connection class that can
 be used as a connection_factory parameter to the normal
 psycopg2.connect() factory.  Also provided is a convenience pool()
-factory to create a ThreadedConnectionPool that will use this
-customized connection class.
+factory to create a ConnectionPool that will use this customized
+connection class, and a PoolManager to keep one pool per database
+within an optional process-wide connection budget.
+
+Pools block when exhausted, queueing waiting threads in FIFO order
+until a connection is returned or a configurable wait timeout
+elapses.  Only a timed-out checkout raises psycopg2.pool.PoolError.
 
 The purpose of the customized connection class is to make it easier to
 use a sane combination of psycopg2 features:
@@ -37,6 +42,15 @@ serialize results, without any risk of commencing serialization on a
 transaction that will fail nor with any need to buffer the entire
 result before serialization commences.
 
+Read-only requests may instead use streaming mode, where cursors are
+not held, so rows are fetched directly from the running query in a
+read-only transaction that is committed after the last row.  This
+avoids materializing the whole result when the transaction commits.
+
+An optional cooperative I/O backend can be enabled with
+set_io_backend('gevent') so that waiting on Postgres yields to other
+greenlets instead of blocking an OS thread.
+
 """
 
 import psycopg2
@@ -44,8 +58,84 @@ import psycopg2.pool
 import web
 import sys
 import traceback
-import datetime
-import math
+import time
+import threading
+import collections
+import os
+import errno
+import fcntl
+import tempfile
+import select
+
+_io_backend = None
+
+def _gevent_wait_callback(conn, timeout=None):
+    """Wait for conn by yielding to the gevent hub."""
+    from gevent.socket import wait_read, wait_write
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            break
+        elif state == psycopg2.extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError("Bad result from poll: %r" % state)
+
+def set_io_backend(name=None):
+    """Select how psycopg2 waits for the database in this process.
+
+       None or 'blocking' uses normal blocking libpq calls.
+
+       'gevent' installs a psycopg2 wait callback that yields to
+       other greenlets, for use in a gevent-based WSGI worker with
+       monkey-patched threading.  The gevent package is required.
+    """
+    global _io_backend
+    if name in (None, 'blocking'):
+        psycopg2.extensions.set_wait_callback(None)
+        _io_backend = None
+    elif name == 'gevent':
+        try:
+            import gevent.socket
+        except ImportError:
+            raise ValueError('io_backend "gevent" requires the gevent package')
+        psycopg2.extensions.set_wait_callback(_gevent_wait_callback)
+        _io_backend = name
+    else:
+        raise ValueError('unknown io_backend "%s"' % name)
+
+def copy_expert(cur, sql, file):
+    """Run cur.copy_expert(sql, file) under any I/O backend.
+
+       Psycopg2 cannot COPY while a wait callback is installed, so
+       the callback is suspended and COPY blocks the worker for its
+       duration.  This is safe with gevent because no other greenlet
+       can run until COPY returns, as long as file does not yield.
+    """
+    prelude = cur.connection.take_prelude()
+    if prelude is not None:
+        cur.execute(prelude)
+    if _io_backend is None:
+        return cur.copy_expert(sql, file)
+    callback = psycopg2.extensions.get_wait_callback()
+    psycopg2.extensions.set_wait_callback(None)
+    try:
+        return cur.copy_expert(sql, file)
+    finally:
+        psycopg2.extensions.set_wait_callback(callback)
+
+class prelude_cursor (psycopg2.extensions.cursor):
+    """Client-side cursor running any deferred prelude with its next statement."""
+
+    def execute(self, query, vars=None):
+        prelude = self.connection.take_prelude()
+        if prelude is not None:
+            if vars is not None:
+                prelude = prelude.replace('%', '%%')
+            query = prelude + ' ' + query
+        return psycopg2.extensions.cursor.execute(self, query, vars)
 
 class connection (psycopg2.extensions.connection):
     """Customized psycopg2 connection factory with per-execution() cursor support.
@@ -54,10 +144,150 @@ class connection (psycopg2.extensions.connection):
     def __init__(self, dsn):
         psycopg2.extensions.connection.__init__(self, dsn)
         self._curnumber  = 1
+        self.streaming = False
+        self._cursor = None
+        self._session_config = dict() # settings known to persist in session
+        self._pending_config = dict() # settings applied in open transaction
+        self._prepared = set() # names of statements prepared in session
+        self._prelude = None # SQL deferred to next statement in transaction
+        self._stream_cursors = [] # named cursors open in streaming transaction
+
+    def commit(self):
+        try:
+            psycopg2.extensions.connection.commit(self)
+            self._session_config.update(self._pending_config)
+        finally:
+            self._pending_config.clear()
+            self._prelude = None
+            self._stream_cursors = []
+
+    def rollback(self):
+        # session-level set_config() is undone by rollback too
+        self._pending_config.clear()
+        self._prelude = None
+        self._stream_cursors = []
+        psycopg2.extensions.connection.rollback(self)
+
+    def reset(self):
+        self._forget_session()
+        psycopg2.extensions.connection.reset(self)
+
+    def close(self):
+        self._forget_session()
+        psycopg2.extensions.connection.close(self)
+
+    def _forget_session(self):
+        self._session_config.clear()
+        self._pending_config.clear()
+        self._prepared.clear()
+        self._prelude = None
+        self._stream_cursors = []
+        self._cursor = None
 
-    def execute(self, stmt, vars=None):
+    def session_cursor(self):
+        """Return this connection's reusable client-side cursor.
+
+           A new cursor is created if the last one was closed.
+        """
+        if self._cursor is None or self._cursor.closed:
+            self._cursor = self.cursor(cursor_factory=prelude_cursor)
+        return self._cursor
+
+    def abandon_streams(self):
+        """Close server-side cursors still open in a streaming transaction.
+
+           Their queries may be suspended part way through a result,
+           holding server resources until the transaction ends.
+        """
+        cursors = self._stream_cursors
+        self._stream_cursors = []
+        for cur in cursors:
+            if not cur.closed:
+                try:
+                    cur.close()
+                except psycopg2.Error:
+                    # rollback will discard it anyway
+                    pass
+
+    def take_prelude(self):
+        """Return and forget SQL deferred to the next statement, or None."""
+        prelude = self._prelude
+        self._prelude = None
+        return prelude
+
+    def execute_prepared(self, cur, name, argtypes, stmt, args=()):
+        """Run a fixed statement via a session-level prepared statement.
+
+           The stmt uses $1, $2, ... placeholders for parameters of
+           the SQL types listed in argtypes.  It is prepared under
+           name on first use in this session and executed with args
+           adapted by psycopg2.  Prepared statements survive
+           transaction rollback but are forgotten on reset().
+        """
+        if name not in self._prepared:
+            # prepare separately so we know whether it exists if execution fails
+            cur.execute(
+                'PREPARE %s %s AS %s;' % (
+                    name,
+                    '(%s)' % ', '.join(argtypes) if argtypes else '',
+                    stmt
+                )
+            )
+            self._prepared.add(name)
+        cur.execute(
+            'EXECUTE %s %s;' % (
+                name,
+                '(%s)' % ', '.join([ '%s' ] * len(args)) if args else ''
+            ),
+            tuple(args)
+        )
+
+    def ensure_isolation_level(self, level):
+        """Set isolation level only if it differs from the current one."""
+        if self.isolation_level != level:
+            self.set_isolation_level(level)
+
+    def ensure_config(self, cur, settings, local_settings={}):
+        """Apply session settings via set_config(), skipping unchanged ones.
+
+           The settings dictionary maps configuration parameter names
+           to string values.  Values last applied on this connection
+           are remembered, so a round-trip is made only when some
+           value differs.
+
+           The local_settings dictionary is always applied, like SET
+           LOCAL, for the current transaction only.  When no session
+           setting changed, it is deferred and sent along with the
+           next statement run through session_cursor(), conn.execute(),
+           or copy_expert() in this transaction, avoiding a round-trip.
+        """
+        changed = []
+        for name, value in settings.items():
+            if self._pending_config.get(name, self._session_config.get(name)) != value:
+                changed.append((name, value))
+        local = local_settings.items()
+        if local and not changed:
+            self._prelude = cur.mogrify(
+                'SELECT %s;' % ', '.join([ 'set_config(%s, %s, true)' ] * len(local)),
+                [ x for pair in local for x in pair ]
+            )
+        elif changed or local:
+            cur.execute(
+                'SELECT %s;' % ', '.join(
+                    [ 'set_config(%s, %s, false)' ] * len(changed)
+                    + [ 'set_config(%s, %s, true)' ] * len(local)
+                ),
+                [ x for pair in changed + local for x in pair ]
+            )
+            self._pending_config.update(dict(changed))
+
+    def execute(self, stmt, vars=None, withhold=None):
         """Name and create a server-side cursor with withhold=True and run statement in it.
 
+           When withhold is None, a plain cursor is used instead if
+           the connection is in streaming mode and the results can
+           only be fetched until the transaction ends.
+
            You can iterate over the resulting cursor to efficiently
            fetch rows from the server, and you may do this before or
            after committing the transaction.  The entire result set
@@ -69,25 +299,463 @@ class connection (psycopg2.extensions.connection):
         """
         curname = 'cursor%d' % self._curnumber
         self._curnumber += 1
-        cur = self.cursor(curname, withhold=True)
+        if withhold is None:
+            withhold = not self.streaming
+        prelude = self.take_prelude()
+        if prelude is not None:
+            # DECLARE cannot share a round-trip with other statements
+            self.session_cursor().execute(prelude)
+        cur = self.cursor(curname, withhold=withhold)
+        if not withhold:
+            self._stream_cursors.append(cur)
         cur.execute(stmt, vars=vars)
         return cur
 
-def pool(minconn, maxconn, dsn):
+def connection_lost(conn):
+    """Return True if idle conn was closed by the server or on our side.
+
+       Idle pooled connections expect no input, so a readable socket
+       means the backend was terminated, e.g. to let a catalog be
+       cloned, and sent its goodbye before closing.  The check does
+       not involve a server round trip.
+    """
+    if conn.closed:
+        return True
+    return bool(wait_readable([conn.fileno()], 0))
+
+def wait_readable(fds, timeout):
+    """Return those of fds readable, closed, or failed within timeout seconds.
+
+       Uses poll() so descriptors beyond FD_SETSIZE work, which busy
+       processes holding many connections easily reach.
+    """
+    if not hasattr(select, 'poll'):
+        # e.g. removed by gevent monkey-patching, whose select() has no FD_SETSIZE limit
+        return select.select(fds, [], [], timeout)[0]
+    poller = select.poll()
+    for fd in fds:
+        poller.register(fd, select.POLLIN | select.POLLERR | select.POLLHUP)
+    return [ fd for fd, event in poller.poll(timeout * 1000) ]
+
+class PoolClosedError (psycopg2.pool.PoolError):
+    """Checkout attempted on a pool which has been retired."""
+    pass
+
+class Histogram (object):
+    """Cumulative histogram of durations in seconds.
+
+       Counts are kept per upper bound in bounds, with a final
+       overflow bucket, along with count, sum, and max.
+    """
+    bounds = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0]
+
+    def __init__(self):
+        self.buckets = [ 0 for b in self.bounds ] + [ 0 ]
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        # caller must serialize access
+        for i in range(len(self.bounds)):
+            if seconds <= self.bounds[i]:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def summary(self):
+        return dict(
+            count=self.count,
+            sum=self.sum,
+            max=self.max,
+            buckets=[
+                dict(le=bound, count=count)
+                for bound, count in zip(self.bounds + [None], self.buckets)
+            ]
+        )
+
+class PoolStats (object):
+    """Counters and histograms describing usage of one database's pool.
+
+       Kept by the PoolManager per dsn so they survive pool expiry.
+    """
+    counter_names = [ 'checkouts', 'connects', 'pool_errors', 'timeouts', 'broken', 'leaks' ]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = dict([ (name, 0) for name in self.counter_names ])
+        self.wait_seconds = Histogram()
+        self.hold_seconds = Histogram()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.wait_seconds.record(seconds)
+
+    def record_hold(self, seconds):
+        with self._lock:
+            self.hold_seconds.record(seconds)
+
+    def summary(self):
+        with self._lock:
+            return dict(
+                counters=dict(self.counters),
+                wait_seconds=self.wait_seconds.summary(),
+                hold_seconds=self.hold_seconds.summary()
+            )
+
+class _Waiter (object):
+    """A thread waiting in a ConnectionPool checkout queue."""
+    def __init__(self):
+        self.event = threading.Event()
+        self.conn = None
+        self.granted = False
+
+class ConnectionPool (object):
+    """Thread-safe pool of connections with blocking, fair checkout.
+
+       At most maxconn connections are open at once and up to minconn
+       idle connections are retained for reuse.  When the pool is
+       exhausted, getconn() waits up to wait_timeout seconds (forever
+       if None) and waiting threads are served in FIFO order.
+
+    """
+    def __init__(self, minconn, maxconn, dsn, wait_timeout=None, manager=None, stats=None):
+        assert 0 <= minconn <= maxconn
+        assert maxconn > 0
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.dsn = dsn
+        self.wait_timeout = wait_timeout
+        self.manager = manager
+        self.stats = stats if stats is not None else PoolStats()
+        self.closed = False
+        self._lock = threading.Lock()
+        self._idle = []
+        self._checkout_times = dict() # id(conn) -> checkout timestamp
+        self._size = 0 # idle + checked out + being opened
+        self._waiters = collections.deque()
+
+        for i in range(minconn):
+            try:
+                self._idle.append(self._connect())
+                self._size += 1
+            except psycopg2.pool.PoolError:
+                # connection budget exhausted, so open on demand later
+                break
+
+    def _connect(self):
+        if self.manager is not None:
+            self.manager.acquire_slot(self, self.wait_timeout)
+        try:
+            conn = psycopg2.connect(self.dsn, connection_factory=connection)
+            self.stats.count('connects')
+            return conn
+        except:
+            if self.manager is not None:
+                self.manager.release_slot()
+            raise
+
+    def _disconnect(self, conn):
+        """Close conn and give back its share of the connection budget.
+
+           Caller must not hold self._lock.
+        """
+        try:
+            if not conn.closed:
+                conn.close()
+        finally:
+            if self.manager is not None:
+                self.manager.release_slot()
+
+    def _release_slot(self):
+        """Give up one connection slot, passing it to the oldest waiter if any.
+
+           Caller must hold self._lock.
+        """
+        self._size -= 1
+        if self._waiters and not self.closed:
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            self._size += 1
+            waiter.event.set()
+
+    def getconn(self):
+        """Check out a connection, waiting if the pool is exhausted.
+
+           Connections lost while idle are discarded and replaced.
+           Raises psycopg2.pool.PoolError if the pool is closed or
+           the wait times out.
+        """
+        start = time.time()
+        try:
+            conn = self._getconn()
+            while connection_lost(conn):
+                self.putconn(conn, close=True)
+                conn = self._getconn()
+        except psycopg2.pool.PoolError, e:
+            self.stats.count('pool_errors')
+            if not isinstance(e, PoolClosedError):
+                self.stats.count('timeouts')
+            raise
+        now = time.time()
+        self.stats.count('checkouts')
+        self.stats.record_wait(now - start)
+        with self._lock:
+            self._checkout_times[id(conn)] = now
+        return conn
+
+    def _getconn(self):
+        waiter = None
+        with self._lock:
+            if self.closed:
+                raise PoolClosedError("connection pool is closed")
+            if not self._waiters and self._idle:
+                return self._idle.pop()
+            elif not self._waiters and self._size < self.maxconn:
+                self._size += 1
+            else:
+                waiter = _Waiter()
+                self._waiters.append(waiter)
+
+        if waiter is not None:
+            waiter.event.wait(self.wait_timeout)
+            with self._lock:
+                if waiter.conn is not None:
+                    return waiter.conn
+                elif not waiter.granted:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+                    if self.closed:
+                        raise PoolClosedError("connection pool is closed")
+                    raise psycopg2.pool.PoolError(
+                        "timed out after %s seconds waiting for database connection" % self.wait_timeout
+                    )
+
+        # we hold a slot but need to open the connection
+        try:
+            return self._connect()
+        except:
+            with self._lock:
+                self._release_slot()
+            raise
+
+    def putconn(self, conn, close=False):
+        """Return a checked out connection to the pool.
+
+           The connection is closed instead if close is True, it is
+           broken, or the pool has enough idle connections already.
+        """
+        with self._lock:
+            checkout_time = self._checkout_times.pop(id(conn), None)
+        if checkout_time is not None:
+            self.stats.record_hold(time.time() - checkout_time)
+        if conn.closed or close:
+            self.stats.count('broken')
+
+        if not conn.closed and not close:
+            status = conn.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                # server connection lost
+                close = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                # connection in error or in transaction
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    close = True
+
+        idled = False
+        with self._lock:
+            if not conn.closed and not close and not self.closed:
+                if self._waiters:
+                    # hand off directly to preserve FIFO fairness
+                    waiter = self._waiters.popleft()
+                    waiter.conn = conn
+                    waiter.event.set()
+                    return
+                elif len(self._idle) < self.minconn:
+                    self._idle.append(conn)
+                    idled = True
+            if not idled:
+                self._release_slot()
+
+        if idled:
+            if self.manager is not None:
+                # budget waiters may now evict this connection
+                self.manager.notify_idle()
+            return
+
+        self._disconnect(conn)
+
+    def take_idle(self):
+        """Remove one idle connection from the pool for eviction, or return None.
+
+           The caller becomes responsible for closing the connection
+           and accounting for its budget slot.
+        """
+        with self._lock:
+            if self._idle:
+                self._size -= 1
+                return self._idle.pop(0)
+        return None
+
+    def occupancy(self):
+        """Return dictionary summarizing pool usage."""
+        with self._lock:
+            return dict(
+                open=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+                waiting=len(self._waiters),
+                minconn=self.minconn,
+                maxconn=self.maxconn
+            )
+
+    def in_use(self):
+        """Return number of connections checked out or being opened."""
+        with self._lock:
+            return self._size - len(self._idle)
+
+    def closeall(self):
+        """Close idle connections and retire the pool.
+
+           Connections still checked out are closed when returned and
+           threads still waiting are failed.
+        """
+        with self._lock:
+            self.closed = True
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+            waiters = self._waiters
+            self._waiters = collections.deque()
+        for waiter in waiters:
+            waiter.event.set()
+        for conn in idle:
+            self._disconnect(conn)
+
+def pool(minconn, maxconn, dsn, wait_timeout=None, manager=None, stats=None):
     """Open a thread-safe connection pool with minconn <= N <= maxconn connections to database.
 
        The connections are from the customized connection factory in this module.
     """
-    return psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, dsn=dsn, connection_factory=connection)
+    return ConnectionPool(minconn, maxconn, dsn, wait_timeout, manager, stats)
+
+class HostSlots (object):
+    """Host-wide connection budget shared by cooperating processes.
+
+       Each of count slot files in dirname is claimed with a
+       non-blocking exclusive flock() while a connection is open.
+       The kernel releases locks held by a process which dies.
+
+       The slot files are opened once and kept open by the process,
+       so claiming a slot only costs flock() calls.
+    """
+    def __init__(self, dirname, count):
+        self.dirname = dirname
+        self.count = count
+        self._fds = None # open fds of all slot files
+        self._held = [] # indices of claimed slots
+
+    def _open(self):
+        try:
+            os.makedirs(self.dirname)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        fds = []
+        try:
+            for i in range(self.count):
+                fds.append(os.open(os.path.join(self.dirname, 'slot-%d' % i), os.O_RDWR | os.O_CREAT, 0666))
+        except:
+            for fd in fds:
+                os.close(fd)
+            raise
+        self._fds = fds
+
+    def try_acquire(self):
+        """Claim a free slot, returning True on success."""
+        if self._fds is None:
+            self._open()
+        for i in range(self.count):
+            if i in self._held:
+                continue
+            try:
+                fcntl.flock(self._fds[i], fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError, e:
+                if e.errno in (errno.EAGAIN, errno.EACCES):
+                    continue
+                raise
+            self._held.append(i)
+            return True
+        return False
+
+    def release(self):
+        """Release one slot claimed by this process."""
+        fcntl.flock(self._fds[self._held.pop()], fcntl.LOCK_UN)
 
 class PoolManager (object):
     """Manage a set of database connection pools keyed by database name.
 
+       Pools idle for longer than max_idle_seconds are closed by a
+       background reaper thread so that pool lookup stays cheap no
+       matter how many databases a process has touched.
+
+       Open connections across all pools are limited by max_total
+       in this process and by host_max_total across all processes
+       on the host.  When the budget is exhausted, idle connections
+       of the least-recently-used pools are closed to make room
+       before a checkout has to wait.
+
     """
     def __init__(self):
         # map dsn -> [pool, timestamp]
         self.pools = dict()
+        # map dsn -> PoolStats
+        self.stats = dict()
         self.max_idle_seconds = 60 * 15 # 15 minutes
+        self.reap_interval = 60
+        self.pool_config = dict(
+            minconn=1,
+            maxconn=4,
+            wait_timeout=5.0
+        )
+        self.max_total = None
+        self.host_slots = None
+        self._lock = threading.Lock()
+        self._reaper = None
+        self._budget = threading.Condition(threading.Lock())
+        self._total = 0
+
+    def configure(self, config):
+        """Update default pool sizing from a config dictionary.
+
+           Recognized keys are minconn, maxconn, and wait_timeout
+           (seconds or null to wait forever) for pool sizing,
+           max_idle_seconds and reap_interval for pool expiry, and
+           max_total, host_max_total, and host_slot_dir for the
+           connection budget.  Pools already open keep their original
+           sizing.
+        """
+        for k in self.pool_config.keys():
+            if k in config:
+                self.pool_config[k] = config[k]
+        self.max_idle_seconds = config.get('max_idle_seconds', self.max_idle_seconds)
+        self.reap_interval = config.get('reap_interval', self.reap_interval)
+        self.max_total = config.get('max_total', self.max_total)
+        if config.get('host_max_total') is not None:
+            self.host_slots = HostSlots(
+                config.get('host_slot_dir', os.path.join(tempfile.gettempdir(), 'ermrest-pool-slots')),
+                config['host_max_total']
+            )
 
     def __getitem__(self, dsn):
         """Lookup existing or create new pool for database on demand.
@@ -95,58 +763,226 @@ class PoolManager (object):
            May fail transiently and caller should retry.
 
         """
-        # abandon old pools so they can be garbage collected
-        for key in self.pools.keys():
-            try:
-                pair = self.pools.pop(key)
-                delta = (datetime.datetime.now() - pair[1])
-                try:
-                    delta_seconds = delta.total_seconds()
-                except:
-                    delta_seconds = delta.seconds + delta.microseconds * math.pow(10,-6)
-                    
-                if delta_seconds < self.max_idle_seconds:
-                    # this pool is sufficiently active so put it back!
-                    boundpair = self.pools.setdefault(key, pair)
-                
-                if self.pools.get(key, [None])[0] != pair[0]:
-                    # our pool is not registered anymore
-                    pair[0].closeall()
-                        
-            except KeyError:
-                # another thread could have purged key before we got to it
-                pass
+        return self.get(dsn)
 
-        try:
-            pair = self.pools[dsn]
-            pair[1] = datetime.datetime.now() # update timestamp
+    def get(self, dsn, config=None):
+        """Lookup existing or create new pool for database on demand.
+
+           The optional config dictionary overrides default sizing
+           when a new pool is created.
+
+        """
+        pair = self.pools.get(dsn)
+        if pair is not None:
+            pair[1] = time.time() # update timestamp
             return pair[0]
-        except KeyError:
+
+        pool_config = dict(self.pool_config)
+        pool_config.update(config or {})
+        newpool = pool(
+            pool_config['minconn'],
+            pool_config['maxconn'],
+            dsn,
+            pool_config['wait_timeout'],
+            self,
+            self.stats.setdefault(dsn, PoolStats())
+        )
+        with self._lock:
             # atomically get/set pool
-            newpool = pool(1, 4, dsn)
-            boundpair = self.pools.setdefault(dsn, [newpool, datetime.datetime.now()])
-            if boundpair[0] is not newpool:
-                # someone beat us to it
-                newpool.closeall()
-            return boundpair[0]
-            
+            boundpair = self.pools.setdefault(dsn, [newpool, time.time()])
+            self._start_reaper()
+        if boundpair[0] is not newpool:
+            # someone beat us to it
+            newpool.closeall()
+        return boundpair[0]
+
+    def acquire_slot(self, requester, timeout=None, evict=True):
+        """Reserve budget for one new connection on behalf of requester pool.
+
+           Evicts idle connections of least-recently-used pools when
+           the budget is exhausted and evict is true, and otherwise
+           waits up to timeout seconds (forever if None) before
+           raising PoolError.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._budget:
+            while True:
+                if self.max_total is None or self._total < self.max_total:
+                    if self.host_slots is None or self.host_slots.try_acquire():
+                        self._total += 1
+                        return
+                if evict and self._evict_lru(requester):
+                    continue
+                if deadline is None:
+                    remaining = None
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise psycopg2.pool.PoolError(
+                            "timed out after %s seconds waiting for database connection budget" % timeout
+                        )
+                if self.host_slots is not None:
+                    # other processes cannot notify us so poll
+                    remaining = min(remaining, 0.1) if remaining is not None else 0.1
+                self._budget.wait(remaining)
+
+    def release_slot(self):
+        """Return budget for one closed connection."""
+        with self._budget:
+            self._release_slot()
+            self._budget.notify()
+
+    def notify_idle(self):
+        """Wake a budget waiter because an idle connection became evictable."""
+        with self._budget:
+            self._budget.notify()
+
+    def _release_slot(self):
+        # caller must hold self._budget
+        self._total -= 1
+        if self.host_slots is not None:
+            self.host_slots.release()
+
+    def _evict_lru(self, requester):
+        """Close one idle connection from the least-recently-used pool having one.
+
+           The requester pool is skipped, since it only opens a new
+           connection when it has none idle or is still filling up
+           to minconn.  Caller must hold self._budget.  Returns True
+           if a slot was freed.
+        """
+        pairs = self.pools.values()
+        pairs.sort(key=lambda pair: pair[1])
+        for victim, timestamp in pairs:
+            if victim is requester:
+                continue
+            conn = victim.take_idle()
+            if conn is not None:
+                try:
+                    conn.close()
+                finally:
+                    self._release_slot()
+                return True
+        return False
+
+    def occupancy(self):
+        """Return dictionary summarizing connection usage per database.
+
+           The result maps each dsn to its pool occupancy and also
+           reports process-wide totals under the 'total' key.
+        """
+        result = dict(
+            total=dict(open=self._total, max_total=self.max_total),
+            pools=dict()
+        )
+        for dsn, pair in self.pools.items():
+            occ = pair[0].occupancy()
+            occ['last_used'] = pair[1]
+            result['pools'][dsn] = occ
+        return result
+
+    def metrics(self):
+        """Return dictionary of usage statistics per database.
+
+           Statistics are cumulative since process start and are
+           combined with current occupancy of pools still open.
+        """
+        occupancy = self.occupancy()
+        result = dict(total=occupancy['total'], pools=dict())
+        for dsn, stats in self.stats.items():
+            result['pools'][dsn] = stats.summary()
+            result['pools'][dsn]['occupancy'] = occupancy['pools'].get(dsn)
+        return result
+
+    def retire(self, dsn, oldpool):
+        """Forget oldpool if it is still registered for dsn and close it."""
+        with self._lock:
+            if self.pools.get(dsn, [None])[0] is oldpool:
+                del self.pools[dsn]
+        oldpool.closeall()
+
+    def discard(self, dsn):
+        """Close the pool for dsn, if any, e.g. before its database is copied."""
+        pair = self.pools.get(dsn)
+        if pair is not None:
+            self.retire(dsn, pair[0])
+
+    def _start_reaper(self):
+        """Start background reaper thread if not running.
+
+           Caller must hold self._lock.
+        """
+        if self._reaper is None or not self._reaper.is_alive():
+            self._reaper = threading.Thread(target=self._reap_loop, name='sanepg2-pool-reaper')
+            self._reaper.daemon = True
+            self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(self.reap_interval)
+            try:
+                self.reap()
+            except Exception, e:
+                web.debug('sanepg2.PoolManager reaper got exception', e)
+
+    def reap(self, now=None):
+        """Close pools idle for longer than max_idle_seconds.
+
+           A pool with connections still checked out is never closed.
+        """
+        if now is None:
+            now = time.time()
+        expired = []
+        with self._lock:
+            for dsn, pair in self.pools.items():
+                if (now - pair[1]) >= self.max_idle_seconds and pair[0].in_use() == 0:
+                    del self.pools[dsn]
+                    expired.append(pair[0])
+        for oldpool in expired:
+            oldpool.closeall()
 
 pools = PoolManager()       
 
 class PooledConnection (object):
-    def __init__(self, dsn):
-        self.used_pool = pools[dsn]
-        self.conn = self.used_pool.getconn()
-        self.conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ)
-        self.cur = self.conn.cursor()
+    def __init__(self, dsn, pool_config=None):
+        while True:
+            self.used_pool = pools.get(dsn, pool_config)
+            try:
+                self.conn = self.used_pool.getconn()
+                break
+            except PoolClosedError:
+                # pool was retired after our lookup so get a fresh one
+                pools.retire(dsn, self.used_pool)
+        self.conn.ensure_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ)
+        self.cur = self.conn.session_cursor()
 
-    def perform(self, bodyfunc, finalfunc=lambda x: x, verbose=False):
+    def perform(self, bodyfunc, finalfunc=lambda x: x, verbose=False, streaming=False):
         """Run bodyfunc(conn, cur) using pooling, commit, transform with finalfunc, clean up.
         
            Automates handling of errors.
+
+           With streaming=True, bodyfunc must not modify the database.
+           The transaction is made read-only, conn.execute() cursors
+           are not held, and commit is deferred until the finalfunc
+           result is drained.
         """
         assert self.conn is not None
         try:
+            if streaming:
+                self.cur.execute("SET TRANSACTION READ ONLY;")
+                self.conn.streaming = True
+                try:
+                    result = finalfunc(bodyfunc(self.conn, self.cur))
+                    if hasattr(result, 'next'):
+                        for d in result:
+                            yield d
+                    else:
+                        yield result
+                finally:
+                    self.conn.streaming = False
+                self.conn.commit()
+                return
+
             result = bodyfunc(self.conn, self.cur)
             self.conn.commit()
             result = finalfunc(result)
@@ -162,7 +998,14 @@ class PooledConnection (object):
             self.conn = None
             raise e
         except GeneratorExit, e:
-            # happens normally at end of result yielding sequence
+            # the consumer abandoned the result before draining it
+            if self.conn is not None:
+                if self.conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_ACTIVE:
+                    # a command is running, e.g. under a cooperative I/O backend
+                    self.conn.cancel()
+                # a suspended streaming query is not active but still open
+                self.conn.abandon_streams()
+                self.conn.rollback()
             raise
         except:
             if self.conn is not None:
@@ -175,7 +1018,8 @@ class PooledConnection (object):
 
     def final(self):
         if self.conn is not None:
-            self.cur.close()
+            # self.cur is owned by self.conn for reuse by next checkout
+            self.cur = None
             try:
                 self.conn.commit()
             except:
@@ -22,8 +22,14 @@ url_parse_func( uri_text ):
     returns an abstract syntax tree consisting of instances of classes
     from the ast sub-module.
 
+url_parse_tape( uri_text ):
+
+    returns a ParseTape which can be bound to the current request
+    repeatedly with its bind() method, without consulting the
+    catalog registry or model while parsing.
+
 """
 
-from parse import url_parse_func
+from parse import url_parse_func, url_parse_tape, url_parse_cache
 import ast
 
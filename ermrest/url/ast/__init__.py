@@ -29,6 +29,7 @@ once an appropriate database connection is available.
 import urllib
 
 from .catalog import Catalogs, Catalog
+from .service import ConnectionPools, ModelCache
 from . import model
 from . import data
 from .name import Name, NameList
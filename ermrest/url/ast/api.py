@@ -23,10 +23,11 @@ import web
 import traceback
 import sys
 import re
+import datetime
+import pytz
 
 from ...exception import *
 from ... import sanepg2
-from ...util import sql_literal
 import json
 
 class Api (object):
@@ -40,47 +41,47 @@ class Api (object):
         self.http_vary = web.ctx.webauthn2_manager.get_http_vary()
         self.http_etag = None
 
+    def rights(self, cur):
+        """Return bitmask of client's catalog rights, evaluated once per request.
+        """
+        if self.catalog._rights is None:
+            self.catalog._rights = self.catalog.manager.get_rights(
+                cur, web.ctx.webauthn2_context.attributes)
+        return self.catalog._rights
+
+    def _enforce(self, cur, right, uri):
+        if not (self.rights(cur) & right):
+            raise rest.Forbidden(uri)
+
     def enforce_owner(self, cur, uri=''):
         """Policy enforcement on is_owner.
         """
-        if not self.catalog.manager.is_owner(
-                        cur, web.ctx.webauthn2_context.attributes):
-            raise rest.Forbidden(uri)
+        self._enforce(cur, self.catalog.manager.RIGHT_OWNER, uri)
 
     def enforce_read(self, cur, uri=''):
         """Policy enforcement on has_read test.
         """
-        if not (self.catalog.manager.has_read(
-                        cur, web.ctx.webauthn2_context.attributes) ):
-            raise rest.Forbidden(uri)
+        self._enforce(cur, self.catalog.manager.RIGHT_READ, uri)
 
     def enforce_write(self, cur, uri=''):
         """Policy enforcement on has_write test.
         """
-        if not (self.catalog.manager.has_write(
-                        cur, web.ctx.webauthn2_context.attributes) ):
-            raise rest.Forbidden(uri)
+        self._enforce(cur, self.catalog.manager.RIGHT_WRITE, uri)
 
     def enforce_content_read(self, cur, uri=''):
         """Policy enforcement on has_content_read test.
         """
-        if not (self.catalog.manager.has_content_read(
-                        cur, web.ctx.webauthn2_context.attributes) ):
-            raise rest.Forbidden(uri)
+        self._enforce(cur, self.catalog.manager.RIGHT_CONTENT_READ, uri)
 
     def enforce_content_write(self, cur, uri=''):
         """Policy enforcement on has_content_write test.
         """
-        if not (self.catalog.manager.has_content_write(
-                        cur, web.ctx.webauthn2_context.attributes) ):
-            raise rest.Forbidden(uri)
+        self._enforce(cur, self.catalog.manager.RIGHT_CONTENT_WRITE, uri)
 
     def enforce_schema_write(self, cur, uri=''):
         """Policy enforcement on has_schema_write test.
         """
-        if not (self.catalog.manager.has_schema_write(
-                        cur, web.ctx.webauthn2_context.attributes) ):
-            raise rest.Forbidden(uri)
+        self._enforce(cur, self.catalog.manager.RIGHT_SCHEMA_WRITE, uri)
 
     def with_queryopts(self, qopt):
         self.queryopts = qopt
@@ -232,7 +233,40 @@ class Api (object):
         if self.http_etag:
             web.header('ETag', '%s' % self.http_etag)
         
-    def perform(self, body, finish):
+    def statement_timeout_settings(self):
+        """Return SET LOCAL settings enforcing the request time budget.
+
+           The request_timeout config option gives the budget in
+           seconds for the whole request and statements may only use
+           what remains of it.
+        """
+        budget = web.ctx.ermrest_config.get('request_timeout')
+        if budget is None:
+            return {}
+        elapsed = datetime.datetime.now(pytz.timezone('UTC')) - web.ctx.ermrest_start_time
+        remaining_ms = int((float(budget) - elapsed.total_seconds()) * 1000)
+        return {'statement_timeout': '%d' % max(remaining_ms, 1)}
+
+    def cached_version(self, cur):
+        """Return Catalog.cached_version if cur is the primary catalog cursor, else None.
+
+           Only for read-only requests, since remembered versions do
+           not reflect the request's own changes.
+        """
+        if cur is web.ctx.ermrest_catalog_pc.cur:
+            return self.catalog.manager.cached_version
+        return None
+
+    def perform(self, body, finish, versions=None, streaming=False):
+        """Run body and finish in the request's catalog transaction.
+
+           When a versions function is given, the request is
+           read-only and may run on a replica which is at least as
+           fresh as the primary according to versions(cur).
+
+           When streaming is True, the request is read-only and
+           results stream from the database until finish is drained.
+        """
         def wrapbody(conn, cur):
             try:
                 client = web.ctx.webauthn2_context.client
@@ -244,19 +278,32 @@ class Api (object):
                     for a in web.ctx.webauthn2_context.attributes
                 ]
                 
-                cur.execute("""
-SELECT set_config('webauthn2.client', %s, false);
-SELECT set_config('webauthn2.attributes', %s, false);
-""" % (
-    sql_literal(client),
-    sql_literal(json.dumps(attributes)),
-)
+                # pooled connections skip this when already configured for client
+                conn.ensure_config(
+                    cur,
+                    {
+                        'webauthn2.client': client,
+                        'webauthn2.attributes': json.dumps(attributes),
+                    },
+                    self.statement_timeout_settings()
                 )
                 return body(conn, cur)
             except psycopg2.InterfaceError, e:
                 raise rest.ServiceUnavailable("Please try again.")
             
-        return web.ctx.ermrest_catalog_pc.perform(wrapbody, finish)
+        def wrapfinish(result):
+            # our own change notifications may arrive after the next request
+            self.catalog.manager.note_write()
+            return finish(result)
+
+        pc = None
+        if versions is not None:
+            pc = self.catalog.replica_pc(versions)
+        if pc is None:
+            pc = web.ctx.ermrest_catalog_pc
+        if web.ctx.get('method') not in ('GET', 'HEAD'):
+            return pc.perform(wrapbody, wrapfinish, streaming=streaming)
+        return pc.perform(wrapbody, finish, streaming=streaming)
     
     def final(self):
         if self.catalog is not self:
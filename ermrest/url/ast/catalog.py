@@ -19,6 +19,8 @@
 """
 
 import json
+import random
+import psycopg2
 import web
 
 import model
@@ -50,15 +52,32 @@ class Catalogs (object):
         if not allowed:
             raise rest.Forbidden(uri)
 
-        # create the catalog instance
-        catalog = web.ctx.ermrest_catalog_factory.create()
-
-        # initialize the catalog instance
-        pc = sanepg2.PooledConnection(catalog.dsn)
-        try:
-            pc.perform(lambda conn, cur: catalog.init_meta(conn, cur, web.ctx.webauthn2_context.client)).next()
-        finally:
-            pc.final()
+        # optional request body names a source catalog to clone
+        source_id = None
+        body = web.data()
+        if body:
+            try:
+                source_id = json.loads(body)['source']
+            except (ValueError, TypeError, KeyError):
+                raise rest.BadRequest('Request body must be a JSON object with a "source" catalog id.')
+
+        catalog = None
+        if source_id is not None:
+            catalog = self._clone(source_id)
+        elif web.ctx.ermrest_spare_catalogs is not None:
+            # claim a pre-created spare, if available
+            catalog = web.ctx.ermrest_spare_catalogs.claim(web.ctx.webauthn2_context.client)
+
+        if catalog is None:
+            # create the catalog instance
+            catalog = web.ctx.ermrest_catalog_factory.create()
+
+            # initialize the catalog instance
+            pc = sanepg2.PooledConnection(catalog.dsn)
+            try:
+                pc.perform(lambda conn, cur: catalog.init_meta(conn, cur, web.ctx.webauthn2_context.client)).next()
+            finally:
+                pc.final()
 
         # register the catalog descriptor
         entry = web.ctx.ermrest_registry.register(catalog.descriptor)
@@ -78,6 +97,27 @@ class Catalogs (object):
             assert content_type == _application_json
             return json.dumps(dict(id=catalog_id))
 
+    def _clone(self, source_id):
+        """Copy the source catalog for a client who owns it."""
+        entries = web.ctx.ermrest_registry.lookup(source_id)
+        if not entries:
+            raise exception.rest.NotFound('catalog ' + str(source_id))
+        source = catalog.Catalog(
+            web.ctx.ermrest_catalog_factory,
+            entries[0]['descriptor'],
+            web.ctx.ermrest_config
+            )
+
+        pc = sanepg2.PooledConnection(source.dsn)
+        try:
+            allowed = pc.perform(lambda conn, cur: source.is_owner(cur, web.ctx.webauthn2_context.attributes)).next()
+        finally:
+            pc.final()
+        if not allowed:
+            raise rest.Forbidden('catalog/' + str(source_id))
+
+        return web.ctx.ermrest_catalog_factory.clone(source, web.ctx.webauthn2_context.client)
+
 class Catalog (Api):
 
     default_content_type = _application_json
@@ -88,6 +128,7 @@ class Catalog (Api):
         Api.__init__(self, self)
         self.catalog_id = catalog_id
         self.manager = None
+        self._rights = None # client's rights bitmask, see Api.rights()
         entries = web.ctx.ermrest_registry.lookup(catalog_id)
         if not entries:
             raise exception.rest.NotFound('catalog ' + str(catalog_id))
@@ -98,13 +139,47 @@ class Catalog (Api):
             )
         
         assert web.ctx.ermrest_catalog_pc is None
-        web.ctx.ermrest_catalog_pc = sanepg2.PooledConnection(self.manager.dsn)
+        self.pool_config = web.ctx.ermrest_config.get('connection_pool', {}).get('catalogs', {}).get(str(catalog_id))
+        web.ctx.ermrest_catalog_pc = sanepg2.PooledConnection(self.manager.dsn, self.pool_config)
 
         # now enforce read permission
         self.enforce_read(web.ctx.ermrest_catalog_pc.cur, 'catalog/' + str(self.catalog_id))
 
     def final(self):
+        if web.ctx.ermrest_catalog_replica_pc is not None:
+            web.ctx.ermrest_catalog_replica_pc.final()
+            web.ctx.ermrest_catalog_replica_pc = None
         web.ctx.ermrest_catalog_pc.final()
+
+    def replica_pc(self, versions):
+        """Return a PooledConnection on a sufficiently fresh replica or None.
+
+           The versions(cur) function returns a tuple of model and
+           data versions compared by catalog.Catalog.replica_is_fresh()
+           allowing the configured replica_max_txid_lag (default 0).
+        """
+        if not self.manager.replica_dsns:
+            return None
+
+        max_lag = web.ctx.ermrest_config.get('replica_max_txid_lag', 0)
+        primary = versions(web.ctx.ermrest_catalog_pc.cur)
+        candidates = list(self.manager.replica_dsns)
+        random.shuffle(candidates)
+
+        for dsn in candidates:
+            pc = None
+            try:
+                pc = sanepg2.PooledConnection(dsn, self.pool_config)
+                replica = versions(pc.cur)
+                if self.manager.replica_is_fresh(primary, replica, max_lag):
+                    web.ctx.ermrest_catalog_replica_pc = pc
+                    return pc
+            except (psycopg2.Error, psycopg2.pool.PoolError), e:
+                web.debug('ERMrest skipping unavailable replica', e)
+            if pc is not None:
+                pc.final()
+
+        return None
             
     def schemas(self):
         """The schema set for this catalog."""
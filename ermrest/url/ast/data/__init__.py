@@ -70,7 +70,7 @@ def _GET(handler, uri, dresource, vresource):
     limit = handler.negotiated_limit()
         
     def body(conn, cur):
-        handler.set_http_etag( vresource.get_data_version(cur) )
+        handler.set_http_etag( vresource.get_data_version(cur, handler.cached_version(cur)) )
         handler.http_check_preconditions()
         dresource.add_sort(handler.sort)
         dresource.add_paging(handler.after, handler.before)
@@ -85,7 +85,15 @@ def _GET(handler, uri, dresource, vresource):
         for line in lines:
             yield line
 
-    return handler.perform(body, post_commit)
+    def versions(cur):
+        manager = handler.catalog.manager
+        cached_version = handler.cached_version(cur)
+        return (
+            manager.get_model_version(cur) if cached_version else manager.query_model_version(cur),
+            vresource.get_data_version(cur, cached_version)[0]
+        )
+
+    return handler.perform(body, post_commit, versions, streaming=True)
 
 def _PUT(handler, uri, put_thunk, vresource):
     """Perform HTTP PUT of generic data resources.
@@ -182,7 +182,7 @@ class RegexpPredicate (BinaryTextPredicate):
     sqlop = '~'
 
 @op('ciregexp')
-class RegexpPredicate (BinaryTextPredicate):
+class CiRegexpPredicate (BinaryTextPredicate):
     sqlop = '~*'
 
 @op('ts')
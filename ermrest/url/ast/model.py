@@ -60,7 +60,11 @@ def _GET(handler, thunk, _post_commit):
         handler.set_http_etag( handler.catalog.manager._model_version )
         handler.http_check_preconditions()
         return thunk(conn, cur)
-    return handler.perform(body, lambda resource: _post_commit(handler, resource))
+    def versions(cur):
+        # load model from primary first, since introspection may write
+        handler.catalog.manager.get_model(cur)
+        return (handler.catalog.manager.query_model_version(cur),)
+    return handler.perform(body, lambda resource: _post_commit(handler, resource), versions)
 
 def _MODIFY(handler, thunk, _post_commit):
     def body(conn, cur):
@@ -69,7 +73,11 @@ def _MODIFY(handler, thunk, _post_commit):
         handler.catalog.manager.get_model(cur)
         handler.set_http_etag( handler.catalog.manager._model_version )
         handler.http_check_preconditions(method='PUT')
-        result = thunk(conn, cur)
+        try:
+            result = thunk(conn, cur)
+        finally:
+            # SQL compiled for the model before it changed in place
+            handler.catalog.manager._model.sql_templates.clear()
         handler.set_http_etag( handler.catalog.manager.get_model_update_version(cur) )
         return result
     return handler.perform(body, lambda resource: _post_commit(handler, resource))
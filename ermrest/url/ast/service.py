@@ -0,0 +1,70 @@
+# 
+# Copyright 2016 University of Southern California
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#    http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""ERMREST URL abstract syntax tree (AST) classes for service administration resources.
+"""
+
+import json
+import re
+import web
+
+from ... import sanepg2, catalog
+from ...apicore import web_method
+from ...exception import *
+
+_application_json = 'application/json'
+
+def _redact_dsn(dsn):
+    """Hide password values in a libpq connection string."""
+    return re.sub(r'password=\S*', 'password=***', dsn)
+
+class ConnectionPools (object):
+    """Connection pool metrics of the web service process handling the request."""
+
+    default_content_type = _application_json
+
+    @web_method()
+    def GET(self, uri='service/connection_pools'):
+        """Perform HTTP GET of connection pool metrics.
+        """
+        if not web.ctx.ermrest_registry.can_admin(web.ctx.webauthn2_context.attributes):
+            raise rest.Forbidden(uri)
+
+        metrics = sanepg2.pools.metrics()
+        metrics['pools'] = dict([
+            (_redact_dsn(dsn), stats)
+            for dsn, stats in metrics['pools'].items()
+        ])
+
+        web.header('Content-Type', self.default_content_type)
+        web.ctx.ermrest_request_content_type = self.default_content_type
+        return json.dumps(metrics, indent=2) + '\n'
+
+class ModelCache (object):
+    """Model cache statistics of the web service process handling the request."""
+
+    default_content_type = _application_json
+
+    @web_method()
+    def GET(self, uri='service/model_cache'):
+        """Perform HTTP GET of model cache statistics.
+        """
+        if not web.ctx.ermrest_registry.can_admin(web.ctx.webauthn2_context.attributes):
+            raise rest.Forbidden(uri)
+
+        web.header('Content-Type', self.default_content_type)
+        web.ctx.ermrest_request_content_type = self.default_content_type
+        return json.dumps(catalog.Catalog.MODEL_CACHE.stats(), indent=2) + '\n'
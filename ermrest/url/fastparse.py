@@ -0,0 +1,292 @@
+#
+# Copyright 2010-2016 University of Southern California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Fast path for the most common ERMREST URL shapes.
+
+A hand-written tokenizer and recursive-descent recognizer for:
+
+   /ermrest/catalog/N/entity/path
+   /ermrest/catalog/N/attribute/path/projection
+   /ermrest/catalog/N/schema/S
+   /ermrest/catalog/N/schema/S/table/T
+
+where path is a table name with optional alias followed by table
+names, context resets, and filters built from simple predicates with
+'!', '&' and ';', and an optional query string may follow.
+
+fast_parse() produces the same ParseTape the PLY grammar in parse.py
+would, or None for anything it does not recognize, including every
+malformed URL, so that the grammar remains the only source of parse
+errors.
+
+"""
+
+import re
+import web
+
+from ..util import urlunquote
+from lex import literals
+from parse import ParseTape, queryopts_add
+import ast
+
+# runs of STRING, NUMSTRING, and ESCAPESTRING lexer tokens form one
+# string in the grammar, other tokens are punctuation
+_token_re = re.compile(r'(?:[-*_.~A-Za-z0-9]|%[0-9A-Fa-f][0-9A-Fa-f])+|::|:=|[' + re.escape(''.join(literals)) + ']')
+_escapes_re = re.compile(r'((?:%[0-9A-Fa-f][0-9A-Fa-f])+)')
+_punctuation = set(literals + ['::', ':='])
+
+_oplabels = set([ 'geq', 'gt', 'leq', 'lt', 'regexp', 'ciregexp', 'ts' ])
+
+class _Fallback (Exception):
+    pass
+
+def _decode(run):
+    """Return grammar string value of one run of string tokens."""
+    if '%' not in run:
+        return run
+    parts = _escapes_re.split(run)
+    try:
+        # odd parts are ESCAPESTRING tokens decoded by the lexer
+        for i in range(1, len(parts), 2):
+            parts[i] = urlunquote(parts[i])
+    except UnicodeDecodeError:
+        raise _Fallback()
+    return reduce(lambda a, b: a + b, parts)
+
+class _Recognizer (object):
+
+    def __init__(self, tokens):
+        # None marks the end, twice for lookahead past the last token
+        self.tokens = tokens + [None, None]
+        self.pos = 0
+
+    def peek(self, offset=0):
+        return self.tokens[self.pos + offset]
+
+    def is_string(self, offset=0):
+        tok = self.peek(offset)
+        return tok is not None and tok not in _punctuation
+
+    def expect(self, tok):
+        if self.peek() != tok:
+            raise _Fallback()
+        self.pos += 1
+
+    def keyword(self, *words):
+        tok = self.peek()
+        if tok is None or tok.lower() not in words:
+            raise _Fallback()
+        self.pos += 1
+        return tok
+
+    def string(self):
+        if not self.is_string():
+            raise _Fallback()
+        self.pos += 1
+        return _decode(self.tokens[self.pos - 1])
+
+    def sname(self):
+        if self.peek() == ':':
+            self.pos += 1
+        name = ast.Name().with_suffix(self.string())
+        while self.peek() == ':':
+            self.pos += 1
+            name.with_suffix(self.string())
+        return name
+
+    def at_end(self, *followers):
+        return self.peek() in followers or self.peek() in ('?', None)
+
+    def expect_end(self):
+        if not self.at_end():
+            raise _Fallback()
+
+    def entityelem1(self):
+        if self.is_string() and self.peek(1) == ':=':
+            alias = self.string()
+            self.pos += 1
+            elem = self.entityelem1()
+            elem.set_alias(alias)
+            return elem
+        return ast.data.path.TableElem(self.sname())
+
+    def entityelem2(self):
+        if self.peek() == '$':
+            self.pos += 1
+            return ast.data.path.ContextResetElem(self.sname())
+        if self.is_string() and self.peek(1) == ':=':
+            alias = self.string()
+            self.pos += 1
+            elem = ast.data.path.TableElem(self.sname())
+            elem.set_alias(alias)
+            return elem
+        if self.peek() == '!':
+            return ast.data.path.FilterElem(self.filter())
+        name = self.sname()
+        if self.at_end('/'):
+            return ast.data.path.TableElem(name)
+        return ast.data.path.FilterElem(self.filter(name))
+
+    def filter(self, name=None):
+        disjunction = []
+        conjunction = ast.data.predicate.Conjunction([ self.npredicate(name) ])
+        while self.peek() in ('&', ';'):
+            if self.peek() == ';':
+                disjunction.append(conjunction)
+                self.pos += 1
+                conjunction = ast.data.predicate.Conjunction([ self.npredicate() ])
+            else:
+                self.pos += 1
+                conjunction.append( self.npredicate() )
+        if disjunction:
+            disjunction.append(conjunction)
+            return ast.data.predicate.Disjunction(disjunction)
+        return conjunction
+
+    def npredicate(self, name=None):
+        if name is None and self.peek() == '!':
+            self.pos += 1
+            return ast.data.predicate.Negation( self.predicate() )
+        return self.predicate(name)
+
+    def predicate(self, name=None):
+        if name is None:
+            name = self.sname()
+        if self.peek() == '=':
+            self.pos += 1
+            return ast.data.predicatecls('=')(name, self.expr())
+        self.expect('::')
+        op = self.peek()
+        if op == 'null':
+            self.pos += 1
+            self.expect('::')
+            return ast.data.predicatecls(op)(name)
+        if op not in _oplabels:
+            raise _Fallback()
+        self.pos += 1
+        self.expect('::')
+        return ast.data.predicatecls(op)(name, self.expr())
+
+    def expr(self):
+        if self.is_string():
+            return ast.Value(self.string())
+        elif self.peek() == ':':
+            self.pos += 1
+            return self.sname()
+        return ast.Value('')
+
+    def attritem(self):
+        if self.is_string() and self.peek(1) == ':=':
+            alias = self.string()
+            self.pos += 1
+            return self.sname().set_alias(alias)
+        return self.sname()
+
+    def attrlist1(self):
+        names = ast.NameList([ self.attritem() ])
+        while self.peek() == ',':
+            self.pos += 1
+            names.append( self.attritem() )
+        return names
+
+    def path(self, api, projection=False):
+        epath = api(self.entityelem1())
+        if projection:
+            # the final segment of the path is the projection
+            end = self.tokens.index('?' if '?' in self.tokens else None)
+            last = end - 1
+            while last > self.pos and self.tokens[last] != '/':
+                last -= 1
+        while self.peek() == '/' and not (projection and self.pos == last):
+            self.pos += 1
+            epath.append( self.entityelem2() )
+        if projection:
+            self.expect('/')
+            epath.set_projection( self.attrlist1() )
+        self.expect_end()
+        return epath
+
+    def queryopts(self):
+        queryopts = web.storage()
+        if self.peek() is None:
+            return queryopts
+        self.expect('?')
+        while True:
+            k = self.string()
+            v = None
+            if self.peek() == '=':
+                self.pos += 1
+                if self.is_string():
+                    v = self.string()
+                    if self.peek() == ',':
+                        v = set([ v ])
+                        while self.peek() == ',':
+                            self.pos += 1
+                            v.add( self.string() )
+            queryopts_add(queryopts, k, v)
+            if self.peek() is None:
+                return queryopts
+            if self.peek() not in ('&', ';'):
+                raise _Fallback()
+            self.pos += 1
+
+    def parse(self):
+        self.expect('/')
+        self.string()
+        self.expect('/')
+        self.keyword('catalog')
+        self.expect('/')
+        catalog_id = self.peek()
+        if catalog_id is None or not catalog_id.isdigit():
+            raise _Fallback()
+        self.pos += 1
+        self.expect('/')
+
+        tape = ParseTape(catalog_id)
+        api = self.keyword('entity', 'attribute', 'schema').lower()
+        self.expect('/')
+        if api == 'entity':
+            result = self.path(tape.catalog.entity)
+        elif api == 'attribute':
+            result = self.path(tape.catalog.attribute, projection=True)
+        else:
+            result = tape.catalog.schema(self.sname())
+            if self.peek() == '/':
+                self.pos += 1
+                self.keyword('table')
+                self.expect('/')
+                name = self.sname()
+                if len(name) > 1:
+                    raise _Fallback()
+                result = result.tables().table(name)
+            self.expect_end()
+
+        result = result.with_queryopts(self.queryopts())
+        return tape.finish(result)
+
+def fast_parse(s):
+    """Return ParseTape for URL text s, or None if s needs the full grammar."""
+    if '@' in s or '(' in s:
+        # sorting, paging, links, and grouping need the grammar
+        return None
+    tokens = _token_re.findall(s)
+    if sum(map(len, tokens)) != len(s):
+        # the lexer would reject a character
+        return None
+    try:
+        return _Recognizer(tokens).parse()
+    except _Fallback:
+        return None
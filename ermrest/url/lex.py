@@ -134,5 +134,7 @@ def t_error(t):
     raise LexicalError()
 
 def make_lexer():
-    return ply.lex.lex(debug=False, optimize=1, lextab=None)#'url_lextab')
+    # building from these few rules takes well under a millisecond,
+    # so we never read or write a lextab module which could go stale
+    return ply.lex.lex(debug=False, optimize=0)
 
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+# 
+# Copyright 2013-2016 University of Southern California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Write the URL parser tables module at build time.
+
+Importing the ermrest package configures the web service, which needs
+webauthn2, the deployed ermrest_config.json, and syslog.  Generating
+tables only needs the token list and the rule docstrings, so this
+script loads lex.py and parse.py from a bare ermrest.url package
+whose other submodules are empty and never run the rule actions.
+
+usage: maketables.py [OUTPUTDIR]
+"""
+
+import sys
+import os
+import types
+
+def bare_module(name, path=None, **attrs):
+    module = types.ModuleType(name)
+    if path is not None:
+        module.__path__ = [path]
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+def main(argv):
+    urldir = os.path.dirname(os.path.abspath(__file__))
+    outputdir = argv[0] if argv else urldir
+    # our ast package must not shadow the standard one for other modules
+    sys.path[:] = [ p for p in sys.path if os.path.abspath(p) != urldir ]
+    bare_module('ermrest', os.path.dirname(urldir))
+    bare_module('ermrest.exception')
+    bare_module('ermrest.util', urlunquote=None)
+    bare_module('ermrest.url', urldir)
+    bare_module('ermrest.url.ast')
+    # parse builds a parser when imported, warning that the tables we are about to write are missing
+    import web
+    debug, web.debug = web.debug, lambda *args: None
+    try:
+        from ermrest.url import parse
+    finally:
+        web.debug = debug
+    parse.write_tables(outputdir)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit( main(sys.argv[1:]) )
@@ -25,6 +25,9 @@ abstract syntax tree (AST)
 
 import ply.yacc as yacc
 import threading
+import copy
+import collections
+import cPickle
 import web
 import urllib
 
@@ -35,6 +38,66 @@ import ast
 
 url_parse_func = None
 
+################################################
+# parsing records catalog-bound AST construction on a tape
+
+class ParseTape (object):
+    """Immutable result of parsing one URL.
+
+       The AST classes bound to a catalog perform registry lookups
+       and bind the catalog model when constructed, so the grammar
+       does not construct them.  Instead, method calls made on the
+       catalog AST node and its descendants are recorded as
+       operations, whose arguments are pure syntax.  Calling bind()
+       replays them on a fresh ast.Catalog for the current request,
+       so one tape can be reused by many requests for the same URL.
+    """
+
+    def __init__(self, catalog_id):
+        self.catalog_id = catalog_id
+        # (target index, method name, args) building value index i+1
+        self.ops = []
+        self.result = 0
+        self.catalog = _TapeRef(self, 0)
+
+    def record(self, target, name, args):
+        self.ops.append((target, name, args))
+        return _TapeRef(self, len(self.ops))
+
+    def finish(self, ref):
+        """Mark ref as the parse result and freeze the tape."""
+        assert ref._tape is self
+        self.result = ref._index
+        # binding may modify arguments, so keep them serialized and
+        # give each bind() private copies, faster than deepcopy
+        self.ops = tuple([
+            (target, name, cPickle.dumps(args, cPickle.HIGHEST_PROTOCOL))
+            for target, name, args in self.ops
+        ])
+        self.catalog = None
+        return self
+
+    def bind(self):
+        """Return the AST for this URL bound for the current request."""
+        values = [ ast.Catalog(self.catalog_id) ]
+        for target, name, args in self.ops:
+            values.append(getattr(values[target], name)(*cPickle.loads(args)))
+        return values[self.result]
+
+class _TapeRef (object):
+    """Placeholder for one catalog-bound AST value while parsing."""
+
+    __slots__ = ['_tape', '_index']
+
+    def __init__(self, tape, index):
+        self._tape = tape
+        self._index = index
+
+    def __getattr__(self, name):
+        def record(*args):
+            return self._tape.record(self._index, name, args)
+        return record
+
 ################################################
 # here's the grammar and ast production rules
 
@@ -86,7 +149,7 @@ def p_slashopt(p):
 
 def p_catalog(p):
     """catalog : '/' string '/' CATALOG '/' NUMSTRING """ 
-    p[0] = ast.Catalog(p[6])
+    p[0] = ParseTape(p[6]).catalog
 
 def p_catalogslash(p):
     """catalogslash : catalog '/' """
@@ -689,30 +752,115 @@ def p_error(t):
 ################################################
 # provide wrappers to get a parser instance
 
-def make_parser():
-    # use this to shut it up: errorlog=yacc.NullLogger()
-    # NullLogger attribute not supported by Python 2.4
-    # return yacc.yacc(debug=False, errorlog=yacc.NullLogger())
-    return yacc.yacc(debug=False, optimize=1, tabmodule='url_parsetab', write_tables=0)
-#    return yacc.yacc()
-
-def make_parse():
-    lock = threading.Lock()
-    lock.acquire()
+# pregenerated by write_tables() at build time and installed with us
+TABMODULE = 'url_parsetab'
+
+def grammar_signature():
+    """Return PLY signature of this grammar, as saved in parser tables."""
+    pinfo = yacc.ParserReflect(globals())
+    pinfo.get_all()
+    return pinfo.signature()
+
+def tables_current():
+    """Return True if pregenerated parser tables match this grammar."""
     try:
-        parser = make_parser()
-        lexer = make_lexer()
-    finally:
-        lock.release()
-        
+        tables = __import__('%s.%s' % (__package__, TABMODULE), fromlist=[TABMODULE])
+    except ImportError:
+        return False
+    return getattr(tables, '_lr_signature', None) == grammar_signature()
+
+def write_tables(outputdir=None):
+    """Write parser tables module into outputdir (default this package's directory)."""
+    return yacc.yacc(debug=False, tabmodule=TABMODULE, outputdir=outputdir, write_tables=1)
+
+def make_parser():
+    if not tables_current():
+        web.debug('ERMrest URL parser tables are missing or stale, generating them in memory; run make to pregenerate them')
+    # without optimize, yacc also compares signatures before using tables
+    return yacc.yacc(debug=False, tabmodule=TABMODULE, write_tables=0)
+
+def make_parse(fast_parse=None):
+    """Return a parse(s) function safe for concurrent use by many threads.
+
+       The LALR tables and lexer rules are built once and shared.
+       Each thread lazily gets its own parser and lexer instances
+       holding the per-parse state, so parses need no global lock.
+       The function returns a ParseTape.
+
+       If fast_parse is given, it is tried first and the grammar is
+       only used when it returns None.
+    """
+    parser = make_parser()
+    lexer = make_lexer()
+    local = threading.local()
+
     def parse(s):
-        lock.acquire()
+        if fast_parse is not None:
+            tape = fast_parse(s)
+            if tape is not None:
+                return tape
         try:
-            return parser.parse(s, lexer=lexer)
-        finally:
-            lock.release()
+            tparser, tlexer = local.pair
+        except AttributeError:
+            tparser, tlexer = local.pair = (copy.copy(parser), lexer.clone())
+        ref = tparser.parse(s, lexer=tlexer)
+        return ref._tape.finish(ref)
     return parse
 
-# provide a mutexed parser instance for all to use
-url_parse_func = make_parse()
-
+class ParseCache (object):
+    """Bounded LRU cache of ParseTape results by URL text."""
+
+    def __init__(self, parse, max_entries=1000):
+        self.parse = parse
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def configure(self, config):
+        """Update settings from config dictionary."""
+        with self._lock:
+            self.max_entries = config.get('max_entries', self.max_entries)
+            self._trim()
+
+    def get(self, s):
+        """Return ParseTape for URL text s, parsing it if not cached."""
+        with self._lock:
+            tape = self._entries.pop(s, None)
+            if tape is not None:
+                self._entries[s] = tape
+                self.hits += 1
+                return tape
+            self.misses += 1
+
+        tape = self.parse(s)
+
+        with self._lock:
+            self._entries[s] = tape
+            self._trim()
+        return tape
+
+    def _trim(self):
+        # caller must hold self._lock
+        while len(self._entries) > max(self.max_entries, 0):
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        """Return dictionary of per-process cache statistics."""
+        with self._lock:
+            return dict(
+                entries=len(self._entries),
+                max_entries=self.max_entries,
+                hits=self.hits,
+                misses=self.misses
+            )
+
+# provide thread-safe parser instances for all to use
+from fastparse import fast_parse
+url_parse_tape = make_parse(fast_parse)
+url_parse_cache = ParseCache(url_parse_tape)
+
+def url_parse_func(s):
+    """Return the AST for URL text s bound for the current request."""
+    return url_parse_cache.get(s).bind()
@@ -76,6 +76,20 @@ AND table_name = %(table)s
     exists = cur.rowcount > 0
     return exists
 
+# advisory lock key serializing field upgrades of one catalog database
+_FIELD_UPGRADE_LOCK = 0x45524d52
+
+def lock_field_upgrades(cur):
+    """Wait until no other transaction is upgrading this catalog in the field.
+
+       The lock is held until the transaction ends.  Checks deciding
+       an upgrade is needed run in the transaction's snapshot, which
+       does not show an upgrade committed by a transaction we waited
+       for, so upgrade statements must still tolerate finding their
+       work already done.
+    """
+    cur.execute("SELECT pg_advisory_xact_lock(%d);" % _FIELD_UPGRADE_LOCK)
+
 def column_exists(cur, schemaname, tablename, columnname):
     cur.execute("""
 SELECT * FROM information_schema.columns
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+
+"""Check that a catalog can be cloned while its versions are listened to.
+
+A source catalog is created and listened to by this process's version
+listener and by a second listener standing in for another service
+process.  Cloning must succeed without waiting for either, and the
+terminated listener must not reconnect before its retry_interval.
+
+This test creates and drops catalog databases through the default
+database for the user calling the test, i.e. one named by username,
+so that user needs CREATEDB permission.
+
+usage: catalog-clone-tests.py
+"""
+
+import time
+
+from ermrest import sanepg2, listener
+from ermrest.catalog import CatalogFactory
+from ermrest.listener import VersionListener
+from checks import check, finish
+
+def wait_for(predicate, timeout=10.0):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.05)
+    return predicate()
+
+config = dict(enabled=True, retry_interval=5.0)
+listener.versions.configure(config)
+other = VersionListener()
+other.configure(config)
+
+factory = CatalogFactory('')
+source = factory.create()
+clone = None
+try:
+    # leaves an idle pooled connection, as a request would
+    pc = sanepg2.PooledConnection(source.dsn)
+    try:
+        pc.perform(lambda conn, cur: source.init_meta(conn, cur)).next()
+    finally:
+        pc.final()
+
+    cache = listener.versions.cache(source.dsn)
+    other_cache = other.cache(source.dsn)
+    check('listening', wait_for(lambda: cache.connected), True)
+    check('other listening', wait_for(lambda: other_cache.connected), True)
+
+    start = time.time()
+    clone = factory.clone(source)
+    check('clone is a new database', clone.dsn != source.dsn, True)
+    check('own listener stopped', listener.versions.caches.get(source.dsn), None)
+    check('own cache disconnected', cache.connected, False)
+    check('other listener terminated', wait_for(lambda: not other_cache.connected), True)
+    time.sleep(max(0, 1.0 - (time.time() - start)))
+    check('other listener backs off', other_cache.connected, False)
+finally:
+    other.stop(source.dsn)
+    for catalog in [clone, source]:
+        if catalog is not None:
+            catalog.destroy()
+
+finish('catalog clone test')
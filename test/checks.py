@@ -0,0 +1,28 @@
+"""Failure bookkeeping shared by the test scripts.
+
+Scripts record every failed expectation with check() or fail(), so
+one run reports them all, and call finish() last, which writes them
+to stderr and raises ValueError if there were any.
+"""
+
+import sys
+
+failures = []
+
+def fail(message):
+    """Record a failure described by message."""
+    failures.append(message)
+
+def check(label, got, expected):
+    """Record a failure labeled label unless got equals expected."""
+    if got != expected:
+        fail('%s: got %r, expected %r' % (label, got, expected))
+
+def finish(what):
+    """Report recorded failures of the what tests, raising ValueError if any."""
+    if failures:
+        for failure in failures:
+            if type(failure) is unicode:
+                failure = failure.encode('utf8')
+            sys.stderr.write(failure + '\n')
+        raise ValueError('%d %s failures' % (len(failures), what))
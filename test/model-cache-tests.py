@@ -0,0 +1,122 @@
+#!/usr/bin/python
+
+"""Check bounds and LRU eviction of the catalog model cache.
+
+Plain objects stand in for introspected models, so no database is
+needed.
+
+usage: model-cache-tests.py
+"""
+
+import shutil
+import tempfile
+
+from ermrest.catalog import ModelCache, ModelSnapshots, _approx_size, _dumps_flat, _loads_flat
+from checks import check, finish
+
+class FakeModel (object):
+    def __init__(self, name, payload=0):
+        self.name = name
+        self.payload = 'x' * payload
+
+# hits and misses by version
+cache = ModelCache(max_entries=2)
+m1 = FakeModel('m1')
+cache.put('a', 1, m1)
+check('hit', cache.get('a', 1), m1)
+check('other version misses', cache.get('a', 2), None)
+check('unknown catalog misses', cache.get('b', 1), None)
+check('latest', cache.latest('a'), (1, m1))
+check('latest unknown', cache.latest('b'), (None, None))
+check('counters', (cache.stats()['hits'], cache.stats()['misses']), (1, 2))
+
+# a newer version replaces the superseded one, an older one is ignored
+m2 = FakeModel('m2')
+cache.put('a', 2, m2)
+check('newer version', cache.get('a', 2), m2)
+check('superseded version', cache.get('a', 1), None)
+cache.put('a', 1, m1)
+check('older version ignored', cache.latest('a'), (2, m2))
+check('one entry per catalog', cache.stats()['entries'], 1)
+
+# least-recently-used catalogs are evicted beyond max_entries
+cache = ModelCache(max_entries=2)
+ma, mb, mc = FakeModel('a'), FakeModel('b'), FakeModel('c')
+cache.put('a', 1, ma)
+cache.put('b', 1, mb)
+cache.get('a', 1)
+cache.put('c', 1, mc)
+check('recently used kept', cache.get('a', 1), ma)
+check('least recently used evicted', cache.latest('b'), (None, None))
+check('newest kept', cache.get('c', 1), mc)
+check('eviction count', cache.stats()['evictions'], 1)
+
+# a miss on another version still counts as use
+cache = ModelCache(max_entries=2)
+cache.put('a', 1, ma)
+cache.put('b', 1, mb)
+cache.get('a', 2)
+cache.put('c', 1, mc)
+check('stale lookup keeps entry for refresh', cache.latest('a'), (1, ma))
+check('other entry evicted', cache.latest('b'), (None, None))
+
+# byte accounting follows entries in and out
+small = FakeModel('s1', 1000)
+large = FakeModel('large', 100000)
+cache = ModelCache(max_entries=None, max_bytes=_approx_size(large) + _approx_size(small))
+cache.put('s', 1, small)
+cache.put('l', 1, large)
+check('both fit', cache.stats()['entries'], 2)
+check('approx bytes', cache.stats()['approx_bytes'], _approx_size(small) + _approx_size(large))
+cache.put('s2', 1, FakeModel('s2', 1000))
+check('byte limit evicts oldest', cache.latest('s'), (None, None))
+check('byte limit keeps newer', cache.latest('l')[1], large)
+cache.put('l', 2, small)
+check('replacement reaccounts bytes', cache.stats()['approx_bytes'], _approx_size(small) + _approx_size(FakeModel('s2', 1000)))
+
+# the pristine copy is accounted and survives patching the cached model
+cache = ModelCache(max_entries=2)
+m1 = FakeModel('m1', 10)
+pristine = _dumps_flat(m1)
+cache.put('p', 1, m1, pristine)
+check('pristine bytes', cache.stats()['approx_bytes'], _approx_size(m1) + len(pristine))
+m1.payload = 'patched'
+version, data = cache.pristine('p')
+check('pristine version', version, 1)
+check('pristine unpatched', _loads_flat(data).payload, 'x' * 10)
+check('pristine is a copy', _loads_flat(data) is m1, False)
+cache.put('q', 1, FakeModel('q'))
+check('no pristine', cache.pristine('q'), (1, None))
+check('pristine unknown', cache.pristine('r'), (None, None))
+
+# the last model is kept even if it alone exceeds max_bytes
+cache = ModelCache(max_entries=None, max_bytes=10)
+cache.put('l', 1, large)
+check('oversized single model kept', cache.latest('l')[1], large)
+
+# shrinking bounds evicts immediately
+cache = ModelCache(max_entries=3)
+for key in ['a', 'b', 'c']:
+    cache.put(key, 1, FakeModel(key))
+cache.configure(dict(max_entries=1))
+check('configure shrinks', cache.stats()['entries'], 1)
+check('configure keeps most recent', cache.latest('c')[0], 1)
+
+# snapshots load with the serialized bytes reusable as pristine copy
+snapdir = tempfile.mkdtemp()
+try:
+    snapshots = ModelSnapshots(snapdir)
+    check('missing snapshot', snapshots.load('a', 1), None)
+    m1 = FakeModel('m1', 10)
+    snapshots.save('a', 1, m1)
+    model, data = snapshots.load('a', 1)
+    check('snapshot model', (model.name, model.payload), ('m1', 'x' * 10))
+    check('snapshot data', data, _dumps_flat(m1))
+    check('snapshot data loads', _loads_flat(data).name, 'm1')
+    snapshots.save('a', 2, m1, data)
+    check('superseded snapshot purged', snapshots.load('a', 1), None)
+    check('snapshot saved from data', snapshots.load('a', 2)[1], data)
+finally:
+    shutil.rmtree(snapdir)
+
+finish('model cache test')
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+
+"""Check expiry, bounds, and bypass rules of registry lookup caching.
+
+Lookups are counted by a stand-in query function and the listener
+connection state is set directly, so no database is needed.
+
+usage: registry-cache-tests.py
+"""
+
+import time
+
+from ermrest.registry import LookupCache
+from checks import check, finish
+
+class Query (object):
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.rows
+
+found = [(1, '{"dbname": "_ermrest_1"}')]
+
+def unlistened(**config):
+    config['listen'] = False
+    return LookupCache('dbname=unused', config)
+
+def listened(**config):
+    cache = LookupCache('dbname=unused', config)
+    # pretend the listener thread runs, so get() does not start one
+    cache._thread = object()
+    return cache
+
+# found entries live for ttl seconds
+cache = unlistened(ttl=0.2)
+query = Query(found)
+check('first lookup', cache.get(1, query), found)
+check('cached lookup', cache.get('1', query), found)
+check('ids compared as strings', query.calls, 1)
+time.sleep(0.3)
+cache.get(1, query)
+check('expired after ttl', query.calls, 2)
+check('counters', (cache.hits, cache.misses), (1, 2))
+
+# unknown ids live for negative_ttl seconds
+cache = unlistened(ttl=60, negative_ttl=0.2)
+query = Query([])
+cache.get(2, query)
+cache.get(2, query)
+check('negative cached', query.calls, 1)
+time.sleep(0.3)
+query.rows = found
+check('registered after negative expiry', cache.get(2, query), found)
+check('negative expired', query.calls, 2)
+cache.get(2, query)
+check('found cached for ttl', query.calls, 2)
+
+# a zero ttl disables caching
+cache = unlistened(ttl=0)
+query = Query(found)
+cache.get(1, query)
+cache.get(1, query)
+check('ttl 0 bypasses', query.calls, 2)
+check('ttl 0 stores nothing', cache._entries, {})
+
+# invalidation drops entries and lookups in progress
+cache = unlistened()
+query = Query(found)
+cache.get(1, query)
+cache.invalidate()
+cache.get(1, query)
+check('invalidated', query.calls, 2)
+def invalidating():
+    cache.invalidate()
+    return found
+cache.invalidate()
+cache.get(3, invalidating)
+check('racing lookup not stored', '3' in cache._entries, False)
+
+# beyond max_entries, expired entries are pruned first, else all
+cache = unlistened(ttl=60, negative_ttl=0.1, max_entries=2)
+cache.get(1, Query(found))
+cache.get(2, Query([]))
+time.sleep(0.2)
+cache.get(3, Query(found))
+check('expired pruned', sorted(cache._entries.keys()), ['1', '3'])
+cache.get(4, Query(found))
+check('full cache cleared', sorted(cache._entries.keys()), ['4'])
+
+# listening caches are bypassed while disconnected
+cache = listened()
+query = Query(found)
+cache.get(1, query)
+cache.get(1, query)
+check('disconnected bypass', query.calls, 2)
+check('disconnected stores nothing', cache._entries, {})
+cache._set_connected(True)
+cache.get(1, query)
+cache.get(1, query)
+check('connected caches', query.calls, 3)
+cache._set_connected(False)
+check('disconnect drops entries', cache._entries, {})
+cache.get(1, query)
+check('bypass after disconnect', query.calls, 4)
+cache._set_connected(True)
+cache.get(1, query)
+check('reconnect starts empty', query.calls, 5)
+
+finish('registry cache test')
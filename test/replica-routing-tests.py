@@ -0,0 +1,57 @@
+#!/usr/bin/python
+
+"""Check replica connection strings and freshness decisions.
+
+usage: replica-routing-tests.py
+"""
+
+from ermrest.catalog import Catalog
+from checks import check, finish
+
+def dsn_params(dsn):
+    return dict([ part.split('=', 1) for part in dsn.split() ])
+
+# replicas override connection parameters of the primary
+catalog = Catalog(
+    object(),
+    dict(
+        dbname='_ermrest_catalog_1',
+        host='primary.example.org',
+        replicas=[
+            dict(host='replica1.example.org'),
+            dict(host='replica2.example.org', port=5433),
+        ]
+    )
+)
+check('primary dsn', dsn_params(catalog.dsn), dict(dbname='_ermrest_catalog_1', host='primary.example.org'))
+check('replica count', len(catalog.replica_dsns), 2)
+check('replica 1 dsn', dsn_params(catalog.replica_dsns[0]), dict(dbname='_ermrest_catalog_1', host='replica1.example.org'))
+check('replica 2 dsn', dsn_params(catalog.replica_dsns[1]), dict(dbname='_ermrest_catalog_1', host='replica2.example.org', port='5433'))
+
+catalog = Catalog(object(), dict(dbname='_ermrest_catalog_2'))
+check('no replicas', catalog.replica_dsns, [])
+
+# (primary versions, replica versions, max_lag, expected freshness)
+for primary, replica, max_lag, expected in [
+        ((10,), (10,), 0, True),
+        ((10,), (9,), 0, False),
+        ((10,), (11,), 0, False),
+        ((10,), (9,), 5, False),
+        ((10, 20), (10, 20), 0, True),
+        ((10, 20), (10, 21), 0, True),
+        ((10, 20), (10, 19), 0, False),
+        ((10, 20), (10, 15), 5, True),
+        ((10, 20), (10, 14), 5, False),
+        ((10, 20, 30), (10, 20, 29), 0, False),
+        ((10, None), (10, None), 0, True),
+        ((10, None), (10, 5), 0, True),
+        ((10, 20), (10, None), 0, False),
+        ((10, 20), (10, None), 100, False),
+        ]:
+    check(
+        'replica_is_fresh(%r, %r, %r)' % (primary, replica, max_lag),
+        Catalog.replica_is_fresh(primary, replica, max_lag),
+        expected
+    )
+
+finish('replica routing test')
@@ -0,0 +1,101 @@
+#!/usr/bin/python
+
+"""Check that pool checkout replaces connections lost while idle.
+
+Socket pairs stand in for database connections, with the far end
+playing the server, so no database is needed.
+
+usage: sanepg2-pool-tests.py
+"""
+
+import socket
+import psycopg2
+import psycopg2.pool
+
+from ermrest import sanepg2
+from checks import check, finish
+
+class FakeConnection (object):
+    def __init__(self):
+        self.sock, self.server = socket.socketpair()
+        self.closed = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.sock.close()
+        self.server.close()
+        self.closed = 1
+
+    def terminate(self):
+        """Act like pg_terminate_backend() on the server side."""
+        self.server.send('E')
+        self.server.close()
+
+class FakePool (sanepg2.ConnectionPool):
+    def _connect(self):
+        if self.manager is not None:
+            self.manager.acquire_slot(self, self.wait_timeout)
+        self.stats.count('connects')
+        return FakeConnection()
+
+# liveness check
+conn = FakeConnection()
+check('fresh connection live', sanepg2.connection_lost(conn), False)
+conn.terminate()
+check('terminated connection lost', sanepg2.connection_lost(conn), True)
+conn.close()
+check('closed connection lost', sanepg2.connection_lost(conn), True)
+
+# checkout replaces idle connections terminated by the server
+pool = FakePool(2, 2, 'dbname=fake')
+idle = list(pool._idle)
+for conn in idle:
+    conn.terminate()
+conn = pool.getconn()
+check('replacement is new', conn in idle, False)
+check('replacement live', sanepg2.connection_lost(conn), False)
+check('terminated connections closed', [ c.closed for c in idle ], [1, 1])
+check('open after replacement', pool.occupancy()['open'], 1)
+check('connects', pool.stats.counters['connects'], 3)
+pool.putconn(conn)
+
+# live idle connections are reused
+conn = pool.getconn()
+check('reused', conn.closed, 0)
+check('no extra connects', pool.stats.counters['connects'], 3)
+pool.putconn(conn)
+
+# replacements take budget slots released by the lost connections
+manager = sanepg2.PoolManager()
+manager.max_total = 1
+pool = FakePool(1, 1, 'dbname=fake', 0, manager)
+lost = pool._idle[0]
+lost.terminate()
+conn = pool.getconn()
+check('replaced within budget', conn is not lost, True)
+check('budget in use', manager.occupancy()['total']['open'], 1)
+pool.putconn(conn)
+pool.closeall()
+check('budget released', manager.occupancy()['total']['open'], 0)
+
+# slots taken without eviction leave idle pooled connections alone
+manager = sanepg2.PoolManager()
+manager.max_total = 1
+pool = FakePool(1, 1, 'dbname=fake', 0, manager)
+manager.pools['dbname=fake'] = [pool, 0]
+idle = pool._idle[0]
+try:
+    manager.acquire_slot(None, timeout=0, evict=False)
+    check('full budget refused', None, psycopg2.pool.PoolError)
+except psycopg2.pool.PoolError:
+    pass
+check('idle connection kept', idle.closed, 0)
+manager.acquire_slot(None, timeout=0)
+check('evicting slot closes idle connection', idle.closed, 1)
+
+finish('pool test')
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+
+"""Check that abandoning a streaming result releases its query.
+
+A large streaming query is abandoned after a few rows, as when a
+client disconnects mid-response, and the pooled connection must come
+back idle with no open cursor and no running query.
+
+This test uses the default database for the user calling the test,
+i.e. one named by username.
+
+usage: sanepg2-stream-tests.py
+"""
+
+import psycopg2
+from ermrest import sanepg2
+from checks import check, fail, finish
+
+pc = sanepg2.PooledConnection('')
+conn = pc.conn
+backend_pid = []
+cursors = []
+
+def body(conn, cur):
+    cur.execute('SELECT pg_backend_pid();')
+    backend_pid.append(cur.fetchone()[0])
+    stream = conn.execute('SELECT i FROM generate_series(1, 10000000) s(i);')
+    cursors.append(stream)
+    return stream
+
+def finish(stream):
+    for row in stream:
+        yield row[0]
+
+result = pc.perform(body, finish, streaming=True)
+check('first rows', [ result.next() for i in range(10) ], range(1, 11))
+check('transaction open mid-stream', conn.get_transaction_status(), psycopg2.extensions.TRANSACTION_STATUS_INTRANS)
+
+# abandon the stream as the web dispatcher does for a closed response
+result.close()
+
+check('transaction after abandon', conn.get_transaction_status(), psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+check('stream cursor closed', cursors[0].closed, True)
+check('not streaming', conn.streaming, False)
+
+# the same connection must be reusable and hold no cursor
+cur = conn.cursor()
+cur.execute('SELECT count(*) FROM pg_cursors;')
+check('open server cursors', cur.fetchone()[0], 0)
+cur.close()
+conn.commit()
+
+pc.final()
+
+# another session sees the backend idle rather than running the query
+conn2 = psycopg2.connect('')
+cur = conn2.cursor()
+cur.execute('SELECT state, query FROM pg_stat_activity WHERE pid = %s;', (backend_pid[0],))
+row = cur.fetchone()
+if row is not None and row[0] != 'idle':
+    fail('abandoned backend is %r running %r' % row)
+conn2.close()
+
+finish('streaming test')
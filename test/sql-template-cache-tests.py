@@ -0,0 +1,156 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Check that cached SQL templates render the same SQL as sql_get().
+
+Paths are built against a small in-memory model of two linked
+tables, so no database is needed.
+
+usage: sql-template-cache-tests.py
+"""
+
+from ermrest.model.misc import Model, Schema, frozendict
+from ermrest.model.table import Table
+from ermrest.model.column import Column
+from ermrest.model.type import Type
+from ermrest.model.key import Unique, ForeignKey, KeyReference
+from ermrest import ermpath
+from ermrest.ermpath.resource import SqlTemplate
+from ermrest.url import ast
+from ermrest.url.ast.data import _preprocess_attributes
+from ermrest.url.ast.data.path import FilterElem, TableElem
+from ermrest.url.ast.data.predicate import predicatecls, Conjunction, Disjunction, Negation
+from checks import check, finish
+
+# s:A references s:B
+model = Model()
+schema = Schema(model, 's')
+B = Table(schema, 'B', [Column('id', 0, Type('int8'), None), Column('label', 1, Type('text'), None)], 'r')
+A = Table(schema, 'A', [Column('id', 0, Type('int8'), None), Column('name', 1, Type('text'), None), Column('ref', 2, Type('int8'), None)], 'r')
+bkey = Unique(frozenset([B.columns['id']]), ('s', 'B_pkey'))
+Unique(frozenset([A.columns['id']]), ('s', 'A_pkey'))
+fkey = ForeignKey(frozenset([A.columns['ref']]))
+fkrmap = frozendict({A.columns['ref']: B.columns['id']})
+fkey.references[fkrmap] = KeyReference(fkey, bkey, fkrmap, constraint_name=('s', 'A_ref_fkey'))
+
+def predicate(op, name, value=None):
+    cls = predicatecls(op)
+    name = ast.Name(name.split(':'))
+    if op == 'null':
+        return cls(name)
+    return cls(name, ast.Value(value))
+
+class Null (object):
+    """Page key value standing for ::null::."""
+    pass
+
+def page(v):
+    if v is None:
+        return None
+    return ast.PageList([ast.Value(None if v is Null else v)])
+
+def build(kind, name, idv, label, after=None, before=None, op='='):
+    """Return path of kind for A/name op name/!(id>idv)/B/label~label;label::null::;id<=idv@sort(...)@after(after)"""
+    epath = ermpath.EntityPath(model)
+    epath.set_base_entity(A, 'a')
+    epath.add_filter(FilterElem(Conjunction([
+        predicate(op, 'name', name),
+        Negation(predicate('gt', 'id', idv))
+    ])))
+    keyref, refop, lalias = TableElem(ast.Name(['s', 'B'])).resolve_link(model, epath)
+    epath.add_link(keyref, refop, 'b', lalias)
+    epath.add_filter(FilterElem(Disjunction([
+        Conjunction([predicate('regexp', 'label', label)]),
+        Conjunction([predicate('null', 'label')]),
+        Conjunction([predicate('leq', 'id', idv)])
+    ])))
+    if kind == 'entity':
+        path = epath
+        sortkey = 'label'
+    elif kind == 'attribute':
+        path = ermpath.AttributePath(epath, _preprocess_attributes(epath, [
+            ast.Name(['a', 'name']).set_alias('n'),
+            ast.Name(['id']).set_alias('bid'),
+            ast.Name(['label'])
+        ]))
+        sortkey = 'n'
+    elif kind == 'attributegroup':
+        path = ermpath.AttributeGroupPath(
+            epath,
+            _preprocess_attributes(epath, [ast.Name(['a', 'name']).set_alias('n')]),
+            _preprocess_attributes(epath, [ast.Aggregate('cnt', ast.Name(['id'])).set_alias('c'), ast.Name(['label'])])
+        )
+        sortkey = 'n'
+    path.add_sort(ast.SortList([ast.Sortkey(sortkey, True)]))
+    path.add_paging(page(after), page(before))
+    return path
+
+def render(method, kind, case, limit):
+    path = build(kind, *case)
+    try:
+        return getattr(path, method)(row_content_type='application/json', limit=limit)
+    except Exception, e:
+        return ('raise', type(e).__name__, str(e))
+
+def compare(label, kind, case, limit=10):
+    expected = render('sql_get', kind, case, limit)
+    check('%s %s %r limit=%r' % (label, kind, case, limit), render('sql_get_cached', kind, case, limit), expected)
+    return expected
+
+kinds = ['entity', 'attribute', 'attributegroup']
+
+# (name, idv, label, after, before [, op])
+cases = [
+    ('x', '5', 'l.*', 'p', None),
+    ("o'brien", '7', u'\xe9', None, None),
+    ('y', '9', 'q', None, 'z'),
+    ('y', '9', 'q', Null, None),
+    ('y', '9', 'q', None, Null),
+    ('y', 'notint', 'q', 'z', None),
+    ('y', '9', 'q', 'z', None, 'ts'),
+    ('y', '9', 'q', 'z', None, 'ciregexp'),
+]
+
+# misses and hits render exactly what sql_get() renders
+for kind in kinds:
+    for case in cases:
+        for limit in [10, None]:
+            compare('miss', kind, case, limit)
+            compare('hit', kind, case, limit)
+
+# a template compiled for one set of literals is reused for others
+for kind in kinds:
+    model.sql_templates.clear()
+    first = compare('first', kind, ('a', '1', 'b', 'c', None))
+    stats = model.sql_templates.stats()
+    check('%s template cached' % kind, stats['entries'], 1)
+    second = compare('different literals', kind, (u'd\xe9', '2', "e'f", 'g', None))
+    check('%s template reused' % kind, model.sql_templates.stats()['hits'], stats['hits'] + 1)
+    check('%s template entries' % kind, model.sql_templates.stats()['entries'], 1)
+    check('%s literals differ' % kind, first != second, True)
+
+# NULL page keys change the SQL shape, not only its literals
+for kind in kinds:
+    model.sql_templates.clear()
+    compare('non-null page', kind, ('a', '1', 'b', 'c', None))
+    compare('null page', kind, ('a', '1', 'b', Null, None))
+    check('%s null page key has own template' % kind, model.sql_templates.stats()['entries'], 2)
+
+# attribute groups embed the entity path SQL, and with it its slots, repeatedly
+model.sql_templates.clear()
+path = build('attributegroup', 'a', '1', 'b', 'c')
+sql = path.sql_get_cached(limit=10)
+template = model.sql_templates._entries.values()[0]
+literals = []
+path.sql_shape(literals)
+check('repeated slots reference every literal', set([ index for index, etype in template.slots ]), set(range(len(literals))))
+check('repeated slots rendered', len(template.slots) > len(literals), True)
+check('repeated slots bound', sql, build('attributegroup', 'a', '1', 'b', 'c').sql_get(limit=10))
+
+# templates are only compiled from intact slot marks
+check('marks in any order', SqlTemplate.compile('a \x001\x00 b \x000\x00 c', ['s0', 's1']).slots, ['s1', 's0'])
+check('repeated marks', SqlTemplate.compile('a \x000\x00 b \x000\x00', ['s0']).slots, ['s0', 's0'])
+check('missing mark', SqlTemplate.compile('a \x000\x00', ['s0', 's1']), None)
+check('broken mark', SqlTemplate.compile('a \x000 b', ['s0']), None)
+
+finish('SQL template cache test')
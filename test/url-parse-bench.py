@@ -0,0 +1,71 @@
+#!/usr/bin/python
+
+"""Benchmark concurrent URL parsing throughput.
+
+Compares the shared url_parse_tape against the same parser serialized
+through one global lock, as it was before per-thread parsers, for an
+increasing number of threads.  The resulting parse tapes are not bound
+to catalogs, so no registry or database is needed.
+
+usage: url-parse-bench.py [seconds-per-run [max-threads]]
+"""
+
+import sys
+import time
+import threading
+
+from ermrest.url import url_parse_tape
+
+urls = [
+    '/ermrest/catalog/1/schema/S1/table/T1',
+    '/ermrest/catalog/1/entity/S1:T1/C1=10',
+    '/ermrest/catalog/1/attribute/S1:T1/C1=a;C2=b/C3,C4,C5',
+    '/ermrest/catalog/1/entity/S1:T1/C1=value%20one&C2::regexp::%5Ea.*b%24/(C3)=(S2:T2:C4)/C5::gt::100@sort(C6,C7::desc::)?limit=25',
+    '/ermrest/catalog/1/attributegroup/S1:T1/C1=' + '&C1='.join([ 'v%d' % i for i in range(40) ]) + '/C2;n:=cnt(C3)'
+    ]
+
+_lock = threading.Lock()
+
+def locked_parse(s):
+    with _lock:
+        return url_parse_tape(s)
+
+def run(parse, nthreads, seconds):
+    counts = [0] * nthreads
+    stop = [False]
+
+    def worker(i):
+        n = 0
+        while not stop[0]:
+            for url in urls:
+                parse(url)
+            n += len(urls)
+        counts[i] = n
+
+    threads = [ threading.Thread(target=worker, args=(i,)) for i in range(nthreads) ]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop[0] = True
+    for t in threads:
+        t.join()
+    return sum(counts) / float(seconds)
+
+def main(argv):
+    seconds = float(argv[0]) if len(argv) > 0 else 2.0
+    max_threads = int(argv[1]) if len(argv) > 1 else 8
+
+    for url in urls:
+        url_parse_tape(url)
+
+    sys.stdout.write('%8s %14s %14s\n' % ('threads', 'locked/s', 'per-thread/s'))
+    nthreads = 1
+    while nthreads <= max_threads:
+        locked = run(locked_parse, nthreads, seconds)
+        unlocked = run(url_parse_tape, nthreads, seconds)
+        sys.stdout.write('%8d %14.0f %14.0f\n' % (nthreads, locked, unlocked))
+        nthreads *= 2
+    return 0
+
+if __name__ == '__main__':
+    sys.exit( main(sys.argv[1:]) )
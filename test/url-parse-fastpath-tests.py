@@ -0,0 +1,170 @@
+#!/usr/bin/python
+
+"""Check the URL parser fast path against the full grammar.
+
+Every URL from url-parse-tests.py and the lists below is parsed by
+the PLY grammar alone and by the fast path.  Whenever the fast path
+produces a parse tape, the grammar must produce an equivalent one.
+The common shapes listed below must take the fast path, and the other
+lists must fall back to the grammar.
+
+usage: url-parse-fastpath-tests.py
+"""
+
+import os
+import sys
+import ast
+import cPickle
+
+from ermrest.url.parse import make_parse
+from ermrest.url.fastparse import fast_parse
+from checks import fail, finish
+
+# URLs the fast path must recognize
+fast_urls = [
+    '/ermrest/catalog/1/entity/S1:T1',
+    '/ermrest/catalog/1/entity/T1',
+    '/ermrest/catalog/1/entity/:S1:T1',
+    '/ermrest/catalog/1/entity/S1:T1/C1=10',
+    '/ermrest/catalog/1/entity/S1:T1/C1=',
+    '/ermrest/catalog/1/entity/S1:T1/C1=:S1:T1:C2',
+    '/ermrest/catalog/1/entity/S1:T1/C1=value%20one&C2::regexp::%5Ea.*b%24',
+    '/ermrest/catalog/1/entity/S1:T1/C1=a;C2=b&C3=c;!C4::null::',
+    '/ermrest/catalog/1/entity/S1:T1/!C1=a&!C2::geq::5/C3::lt::6',
+    '/ermrest/catalog/1/entity/S1:T1/C1::gt::1&C1::leq::9&C2::ts::word&C3::ciregexp::x',
+    '/ermrest/catalog/1/entity/A:=S1:T1/B:=S2:T2/$A/C1=1',
+    '/ermrest/catalog/1/entity/A:=B:=S1:T1',
+    '/ermrest/catalog/1/entity/S1:T1/T2/T3/C1=1/$T2',
+    '/ermrest/catalog/1/entity/S1:T1/entity=table&schema::null::',
+    '/ermrest/catalog/1/ENTITY/S1:T1/C1=%C3%A9t%C3%A9',
+    '/ermrest/catalog/1/entity/S%201:T%3A1/C%2C1=a%2Fb',
+    '/ermrest/catalog/1/entity/S1:T1/C1=10?limit=25',
+    '/ermrest/catalog/1/entity/S1:T1?limit=25&accept=csv;defaults=a,b&flag&other=',
+    '/ermrest/catalog/1/entity/S1:T1?x=1&x=2&x=3,4',
+    '/ermrest/catalog/1/attribute/S1:T1/C1,C2,C3',
+    '/ermrest/catalog/1/attribute/S1:T1/C1=a;C2=b/C3,C4,C5',
+    '/ermrest/catalog/1/attribute/A:=S1:T1/B:=T2/X:=A:C1,B:C2,*',
+    '/ermrest/catalog/1/attribute/S1:T1/C1=1/T2/C2=2/$S1:T1/C3?limit=10',
+    '/ermrest/catalog/1/attribute/S1:T1/C1=1/:C2',
+    '/ermrest/catalog/1/schema/S1',
+    '/ermrest/catalog/1/schema/S1/table/T1',
+    '/ermrest/catalog/1/schema/S%201/Table/T%201?x',
+    '/erm%72est/catalog/42/schema/schema/table/table',
+    ]
+
+# valid URLs the fast path leaves to the grammar
+slow_urls = [
+    '/ermrest/catalog/1',
+    '/ermrest/catalog/1/',
+    '/ermrest/catalog/1/entity/S1:T1/(C1)=(S2:T2:C2)',
+    '/ermrest/catalog/1/entity/S1:T1/(C1=a;C2=b)',
+    '/ermrest/catalog/1/entity/S1:T1@sort(C1)',
+    '/ermrest/catalog/1/entity/S1:T1/C1=10@sort(C1::desc::)@after(5)?limit=25',
+    '/ermrest/catalog/1/attributegroup/S1:T1/C1;n:=cnt(C2)',
+    '/ermrest/catalog/1/aggregate/S1:T1/n:=cnt(*)',
+    '/ermrest/catalog/1/schema',
+    '/ermrest/catalog/1/schema/S1/',
+    '/ermrest/catalog/1/schema/S1/table',
+    '/ermrest/catalog/1/schema/S1/table/T1/column/C1',
+    '/ermrest/catalog/1/textfacet/foo',
+    ]
+
+# malformed URLs the grammar must reject
+bad_urls = [
+    '/ermrest/catalog/232/entity',
+    '/ermrest/catalog/232/entity/',
+    '/ermrest/catalog/232/entity/S1:T1/',
+    '/ermrest/catalog/232/entity/S1:T1//C1=1',
+    '/ermrest/catalog/232/entity/S1:T1/C1=a:b',
+    '/ermrest/catalog/232/entity/S1:T1/C1&C2=1',
+    '/ermrest/catalog/232/entity/S1:T1/C1::GT::1',
+    '/ermrest/catalog/232/entity/S1:T1/C1::null::x',
+    '/ermrest/catalog/232/entity/S1:T1/a:b:=T2',
+    '/ermrest/catalog/232/entity/S1:T1/C1=%zz',
+    '/ermrest/catalog/232/entity/S1:T1/C1=%ff',
+    '/ermrest/catalog/232/entity/S1:T1/C1=a b',
+    '/ermrest/catalog/232/entity/S1:T1?',
+    '/ermrest/catalog/232/entity/S1:T1?a=b,',
+    '/ermrest/catalog/232/entity/S1:T1?a&',
+    '/ermrest/catalog/232/entity/S1:T1?a/b',
+    '/ermrest/catalog/232/attribute/S1:T1',
+    '/ermrest/catalog/232/attribute/S1:T1/C1=1',
+    '/ermrest/catalog/232/attribute/S1:T1/C1,C2/T2',
+    '/ermrest/catalog/232/schema/S1/table/S1:T1',
+    '/ermrest/catalog/232/schema/S1/tables/T1',
+    '/ermrest/catalog/23a/schema/S1',
+    '/ermrest/catalog2/23/schema/S1',
+    '/ermrest/catalog/%32/schema/S1',
+    '//catalog/232/schema/S1',
+    ]
+
+def existing_urls():
+    """Return URL strings from the lists in url-parse-tests.py."""
+    fname = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'url-parse-tests.py')
+    urls = []
+    for node in ast.walk(ast.parse(open(fname).read(), fname)):
+        if isinstance(node, ast.For) and isinstance(node.iter, ast.List):
+            urls.extend([ elt.s for elt in node.iter.elts if isinstance(elt, ast.Str) ])
+    return urls
+
+def canonical(v):
+    """Return comparable structure of AST value v including types."""
+    if isinstance(v, (list, tuple)):
+        return (type(v).__name__, [ canonical(x) for x in v ])
+    elif isinstance(v, dict):
+        return (type(v).__name__, sorted([ (canonical(k), canonical(x)) for k, x in v.items() ]))
+    elif isinstance(v, (set, frozenset)):
+        return (type(v).__name__, sorted([ canonical(x) for x in v ]))
+    elif hasattr(v, '__dict__'):
+        return (type(v).__name__, canonical(v.__dict__))
+    else:
+        return (type(v).__name__, v)
+
+def canonical_tape(tape):
+    return (
+        canonical(tape.catalog_id),
+        tape.result,
+        [ (target, name, canonical(cPickle.loads(args))) for target, name, args in tape.ops ]
+    )
+
+grammar_parse = make_parse()
+
+def check(url, expect_fast, expect_error):
+    try:
+        grammar_tape = canonical_tape(grammar_parse(url))
+        grammar_error = None
+    except Exception, e:
+        grammar_tape = None
+        grammar_error = e
+
+    fast_tape = fast_parse(url)
+    if fast_tape is not None:
+        fast_tape = canonical_tape(fast_tape)
+
+    if fast_tape is not None and fast_tape != grammar_tape:
+        fail('fast path differs from grammar (%r) for: %s' % (grammar_error or grammar_tape, url))
+    elif expect_fast is not None and expect_fast != (fast_tape is not None):
+        fail('fast path %s for: %s' % (expect_fast and 'not taken' or 'unexpectedly taken', url))
+    elif expect_error is not None and expect_error != (grammar_error is not None):
+        fail('grammar %s for: %s' % (grammar_error and ('raised %r' % grammar_error) or 'accepted', url))
+
+    return fast_tape is not None
+
+taken = 0
+urls = 0
+for url in existing_urls():
+    taken += check(url, None, None)
+    urls += 1
+for url in fast_urls:
+    taken += check(url, True, False)
+    urls += 1
+for url in slow_urls:
+    taken += check(url, False, False)
+    urls += 1
+for url in bad_urls:
+    taken += check(url, False, True)
+    urls += 1
+
+sys.stdout.write('%d of %d URLs took the fast path\n' % (taken, urls))
+
+finish('fast path equivalence')
@@ -0,0 +1,50 @@
+#!/usr/bin/python
+
+"""Benchmark URL parser construction at worker startup.
+
+Compares building the URL parser from the pregenerated tables
+installed with ERMrest against generating the LALR tables from the
+grammar, as every worker process did before.  Also reports whether
+the installed tables are current for the installed grammar.
+
+usage: url-parse-startup-bench.py [repetitions]
+"""
+
+import sys
+import time
+import ply.yacc as yacc
+
+import ermrest.url.parse
+import ermrest.url.lex
+
+parse = sys.modules['ermrest.url.parse']
+lex = sys.modules['ermrest.url.lex']
+
+def timed(func, repetitions):
+    start = time.time()
+    for i in range(repetitions):
+        func()
+    return (time.time() - start) / repetitions
+
+def main(argv):
+    repetitions = int(argv[0]) if len(argv) > 0 else 10
+
+    current = parse.tables_current()
+    sys.stdout.write('pregenerated tables current: %s\n' % current)
+    if not current:
+        sys.stdout.write('run make to generate ermrest/url/%s.py\n' % parse.TABMODULE)
+
+    generated = timed(
+        lambda : yacc.yacc(module=parse, debug=False, tabmodule='%s.no_such_tables' % parse.__package__, write_tables=0),
+        repetitions
+    )
+    pregenerated = timed(parse.make_parser, repetitions)
+    lexer = timed(lex.make_lexer, repetitions)
+
+    sys.stdout.write('%-28s %10.1f ms\n' % ('parser from grammar', generated * 1000))
+    sys.stdout.write('%-28s %10.1f ms\n' % ('parser from tables', pregenerated * 1000))
+    sys.stdout.write('%-28s %10.1f ms\n' % ('lexer from rules', lexer * 1000))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit( main(sys.argv[1:]) )
@@ -0,0 +1,172 @@
+#!/usr/bin/python
+
+"""Check when remembered catalog versions may be reused.
+
+Version lookups are counted by a stand-in query function and
+notifications are fed directly to the cache, so no database is
+needed.
+
+usage: version-cache-tests.py
+"""
+
+import os
+import time
+
+from ermrest import listener
+from ermrest.listener import VersionCache, VersionListener, MODEL, table_key
+from checks import check, finish
+
+class Query (object):
+    def __init__(self, txid):
+        self.txid = txid
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.txid
+
+def request_start():
+    """Return a request start time strictly after everything so far."""
+    time.sleep(0.001)
+    start = listener._now()
+    time.sleep(0.001)
+    return start
+
+t1 = table_key(u's\xe9', 't1')
+t2 = table_key('s\xc3\xa9', 't2')
+
+# disconnected caches always query
+cache = VersionCache()
+query = Query(10)
+cache.version(MODEL, [MODEL], request_start(), query)
+cache.version(MODEL, [MODEL], request_start(), query)
+check('disconnected queries', query.calls, 2)
+check('disconnected misses', (cache.hits, cache.misses), (0, 2))
+
+# connected caches remember until notified
+cache = VersionCache()
+cache.set_connected(True)
+query = Query(10)
+check('first lookup', cache.version(MODEL, [MODEL], request_start(), query), 10)
+check('remembered', cache.version(MODEL, [MODEL], request_start(), query), 10)
+check('one query', query.calls, 1)
+cache.notify(10, MODEL)
+cache.version(MODEL, [MODEL], request_start(), query)
+check('notified at same txid still remembered', query.calls, 1)
+cache.notify(11, MODEL)
+query.txid = 11
+check('notified newer', cache.version(MODEL, [MODEL], request_start(), query), 11)
+check('requeried after newer notification', query.calls, 2)
+
+# requests which began before the lookup do not trust it
+since = request_start()
+query = Query(20)
+cache.version(('data', t1), [t1], request_start(), query)
+cache.version(('data', t1), [t1], since, query)
+check('older request requeries', query.calls, 2)
+
+# notifications only invalidate dependent lookups
+cache = VersionCache()
+cache.set_connected(True)
+q1, q2 = Query(30), Query(31)
+cache.version(('data', t1), [t1], request_start(), q1)
+cache.version(('data', t2), [t2], request_start(), q2)
+cache.notify(32, t1)
+cache.version(('data', t1), [t1], request_start(), q1)
+cache.version(('data', t2), [t2], request_start(), q2)
+check('dependent lookup requeried', q1.calls, 2)
+check('independent lookup remembered', q2.calls, 1)
+check('unicode and utf8 keys match', t1 == table_key('s\xc3\xa9', 't1'), True)
+
+# a local write distrusts lookups of requests which began before it
+cache = VersionCache()
+cache.set_connected(True)
+query = Query(40)
+before = request_start()
+cache.version(MODEL, [MODEL], before, query)
+cache.note_write()
+after = request_start()
+cache.version(MODEL, [MODEL], after, query)
+check('lookup before write requeried', query.calls, 2)
+cache.version(MODEL, [MODEL], request_start(), query)
+check('lookup after write remembered', query.calls, 2)
+
+# a lookup racing a local write is not trusted by later requests
+cache = VersionCache()
+cache.set_connected(True)
+query = Query(50)
+racing = request_start()
+cache.note_write()
+cache.version(MODEL, [MODEL], racing, query)
+cache.version(MODEL, [MODEL], request_start(), query)
+check('racing lookup requeried', query.calls, 2)
+
+# reconnecting forgets everything
+cache = VersionCache()
+cache.set_connected(True)
+query = Query(60)
+cache.version(MODEL, [MODEL], request_start(), query)
+cache.set_connected(False)
+cache.set_connected(True)
+cache.version(MODEL, [MODEL], request_start(), query)
+check('new generation requeries', query.calls, 2)
+
+# results of lookups spanning a disconnect are not stored
+cache = VersionCache()
+cache.set_connected(True)
+def disconnecting():
+    cache.set_connected(False)
+    cache.set_connected(True)
+    return 70
+cache.version(MODEL, [MODEL], request_start(), disconnecting)
+check('lookup spanning reconnect not stored', cache.entries, {})
+
+# listeners are disabled by default and bounded by max_catalogs
+versions = VersionListener()
+check('disabled', versions.cache('dbname=a'), None)
+versions.configure(dict(enabled=True, max_catalogs=0))
+check('full', versions.cache('dbname=a'), None)
+check('stats', versions.stats()['max_catalogs'], 0)
+
+# dropped or refused connections are retried only after retry_interval
+class CountingListener (VersionListener):
+    def __init__(self):
+        VersionListener.__init__(self)
+        self.connects = 0
+        self._wakeup = os.pipe()
+        # never run the listener thread
+        self._thread = True
+
+    def _connect(self, dsn, cache):
+        self.connects += 1
+        self._note_dropped(dsn)
+
+    def _wait(self, fds):
+        return []
+
+versions = CountingListener()
+versions.configure(dict(retry_interval=0.2))
+versions.caches['dbname=a'] = VersionCache()
+versions._cycle()
+versions._cycle()
+check('refused connection backs off', versions.connects, 1)
+time.sleep(0.3)
+versions._cycle()
+check('retried after retry_interval', versions.connects, 2)
+
+# stopped catalogs are forgotten and not reconnected before retry_interval
+versions = CountingListener()
+versions.configure(dict(enabled=True, retry_interval=0.2))
+stopped = versions.cache('dbname=a')
+stopped.set_connected(True)
+versions.stop('dbname=a')
+check('stop forgets cache', 'dbname=a' in versions.caches, False)
+check('stop disconnects cache', stopped.connected, False)
+check('new cache after stop', versions.cache('dbname=a') is stopped, False)
+versions._cycle()
+check('stopped catalog backs off', versions.connects, 0)
+time.sleep(0.3)
+versions._cycle()
+check('stopped catalog retried', versions.connects, 1)
+
+finish('version cache test')